@@ -0,0 +1,298 @@
+"""论文总结HTTP接口（无需浏览器）
+
+其他服务通过HTTP提交论文、查询各阶段进度并下载结果。任务由进程内共享的后台任务执行器处理
+（见 utils/job_worker.py），与界面和命令行使用同一处理流程、同一连接池、整篇文档缓存和全局并发限制。
+
+接口:
+    POST /jobs                      上传论文（multipart/form-data: file, mode, provider, chunk_size, max_concurrent, session_id）
+    GET  /jobs                      本密钥提交的任务列表（?session_id= 按会话过滤）
+    GET  /jobs/{id}                 任务状态、当前阶段和进度
+    POST /jobs/{id}/retry           重试失败的任务（从检查点继续），或为等待密钥的任务重新登记密钥
+    POST /jobs/{id}/cancel          停止排队中或运行中的任务（之后可重试）
+    GET  /jobs/{id}/summary.md      总结（Markdown）
+    GET  /jobs/{id}/mindmap.png     思维导图
+    GET  /jobs/{id}/excel           Excel行（?format=json 返回JSON）
+    GET  /health                    服务状态
+
+API密钥通过 Authorization: Bearer <key> 请求头提供，或在服务端设置环境变量（OPENAI_API_KEY / DEEPSEEK_API_KEY）。
+请求头中的密钥只用于该任务；服务重启后，没有服务端密钥的中断任务保持排队，需带着密钥调用 /jobs/{id}/retry 继续。
+任务归属于提交时使用的密钥：查询、下载、停止和重试只能访问同一密钥提交的任务（其他任务返回404）；
+不带Authorization请求头的客户端使用服务端密钥的身份，可以访问用服务端密钥提交的任务。
+服务端设置了密钥时，能访问接口的客户端都可以使用这些密钥，对外开放时应放在反向代理的认证之后。
+
+运行方式:
+    python api_server.py --port 8000
+    curl -F file=@paper.pdf -F mode=标准模式 http://127.0.0.1:8000/jobs
+"""
+import argparse
+import asyncio
+import io
+import os
+import re
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+from dotenv import load_dotenv
+from config import APIConfig, PDFConfig
+from prompts import TARGET_LENGTHS
+from utils.adaptive_limiter import get_adaptive_limiter
+from utils.exporter import PaperExporter
+from utils.file_processor import BaseFileProcessor
+from utils.http_server import HTTPServer, Request, Response, json_error
+from utils.job_store import JobStore, owner_of
+from utils.job_worker import JobWorker, get_job_worker
+from utils.usage import STAGE_LABELS
+
+SUPPORTED_EXTENSIONS = (".pdf", ".doc", ".docx")
+STAGE_NAMES = dict(STAGE_LABELS, extract="文本提取", dropped="文本块提取", render="思维导图", done="完成")
+
+
+class JobAPI:
+    """任务接口的路由与处理（只负责提交和查询，处理由后台任务执行器完成）"""
+
+    def __init__(self, worker: JobWorker = None):
+        self.worker = worker or get_job_worker()
+        self.store = self.worker.store
+        self.exporter = PaperExporter()
+
+    async def handle(self, request: Request) -> Response:
+        path = request.path.rstrip("/")
+
+        if request.method == "GET" and path == "/health":
+            return Response(self.health())
+        if path == "/jobs":
+            if request.method == "POST":
+                return await self.submit(request)
+            if request.method == "GET":
+                owners = self.owners(request)
+                if not owners:
+                    return json_error(401, "缺少API密钥：请使用Authorization请求头查询该密钥提交的任务")
+                jobs = self.store.list(session_id=request.query.get("session_id"), owners=owners)
+                return Response({"jobs": [self.job_view(job) for job in jobs]})
+            return json_error(405, f"不支持的方法: {request.method}")
+
+        match = re.fullmatch(r"/jobs/(\w+)(?:/(retry|cancel|summary\.md|mindmap\.png|excel))?", path)
+        if not match:
+            return json_error(404, f"未知接口: {request.method} {request.path}")
+        job_id, action = match.groups()
+        job = self.store.get(job_id, include_mindmap=action == "mindmap.png")
+        # 其他密钥提交的任务与不存在的任务一样返回404
+        if job is None or job["owner"] not in self.owners(request):
+            return json_error(404, f"没有找到任务: {job_id}", code="job_not_found")
+
+        if action == "retry" and request.method == "POST":
+            return self.retry(job, request)
+        if action == "cancel" and request.method == "POST":
+            return await self.cancel(job)
+        if request.method != "GET" or action in ("retry", "cancel"):
+            return json_error(405, f"不支持的方法: {request.method}")
+        if action is None:
+            return Response(self.job_view(job))
+
+        # 下载结果
+        if job["status"] != JobStore.DONE:
+            return json_error(409, f"任务尚未完成（{job['status']}）", code="job_not_done")
+        if action == "summary.md":
+            return Response(
+                job["result"]["summary"],
+                content_type="text/markdown; charset=utf-8",
+                headers=self.attachment(job, ".md")
+            )
+        if action == "mindmap.png":
+            if not job["mindmap"]:
+                return json_error(404, "该任务没有思维导图（生成失败）", code="mindmap_missing")
+            return Response(job["mindmap"], content_type="image/png", headers=self.attachment(job, "_mindmap.png"))
+        return await self.excel(job, request.query.get("format"))
+
+    def owners(self, request: Request) -> List[str]:
+        """调用方可以访问的任务提交者：请求头中的密钥，未提供时为服务端密钥"""
+        authorization = request.headers.get("authorization", "")
+        if authorization.lower().startswith("bearer "):
+            return [owner_of(authorization[7:].strip())]
+        return [owner_of(api_key) for api_key, _ in self.worker.credentials.values()]
+
+    def health(self) -> dict:
+        return {
+            "status": "ok",
+            "jobs": self.store.count_by_status(),
+            "running": len(self.worker.running),
+            "max_jobs": self.worker.max_jobs,
+            "providers": sorted(self.worker.credentials),
+            # 服务端密钥的自适应并发（当前并发数和调整统计）
+            "concurrency": {
+                provider: get_adaptive_limiter(provider, api_key).snapshot()
+                for provider, (api_key, _) in self.worker.credentials.items()
+            } if APIConfig.ADAPTIVE_CONCURRENCY else {}
+        }
+
+    @staticmethod
+    def job_view(job: dict) -> dict:
+        """任务状态（不含总结正文和思维导图，结果通过下载接口获取）"""
+        view = {
+            "id": job["id"],
+            "filename": job["filename"],
+            "session_id": job["session_id"],
+            "status": job["status"],
+            "stage": job["stage"],
+            "stage_label": STAGE_NAMES.get(job["stage"], job["stage"]),
+            "progress": job["progress"],
+            "message": job["message"],
+            "error": job["error"],
+            "attempts": job["attempts"],
+            "settings": job["settings"],
+            "created": job["created"],
+            "updated": job["updated"]
+        }
+        if job["status"] == JobStore.DONE:
+            result = job["result"]
+            view.update({
+                "path": result.get("path"),
+                "usage": result.get("usage"),
+                "links": {
+                    "summary": f"/jobs/{job['id']}/summary.md",
+                    "mindmap": f"/jobs/{job['id']}/mindmap.png",
+                    "excel": f"/jobs/{job['id']}/excel"
+                }
+            })
+        return view
+
+    @staticmethod
+    def attachment(job: dict, suffix: str) -> dict:
+        filename = os.path.splitext(job["filename"])[0] + suffix
+        return {"content-disposition": f"attachment; filename*=UTF-8''{quote(filename)}"}
+
+    async def submit(self, request: Request) -> Response:
+        """上传论文并创建任务，立即返回任务ID（202）"""
+        if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+            return json_error(400, "请使用multipart/form-data上传文件（字段名file）")
+        form = request.form()
+        filename, data = form.get("file", (None, b""))
+        if not filename or not data:
+            return json_error(400, "缺少上传文件（字段名file）")
+        if os.path.splitext(filename)[1].lower() not in SUPPORTED_EXTENSIONS:
+            return json_error(400, f"不支持的文件类型: {filename}（支持 PDF、Word）")
+        if len(data) > PDFConfig.MAX_FILE_SIZE:
+            return json_error(413, f"文件大小超过限制: {len(data)} > {PDFConfig.MAX_FILE_SIZE} bytes")
+
+        def field(name: str, default=None):
+            value = form.get(name)
+            return value[1].decode("utf-8").strip() if value else default
+
+        provider = field("provider", "openai")
+        mode = field("mode", "标准模式")
+        if provider not in APIConfig.PROVIDERS:
+            return json_error(400, f"不支持的API提供商: {provider}")
+        if mode not in TARGET_LENGTHS:
+            return json_error(400, f"不支持的总结模式: {mode}（可选：{'、'.join(TARGET_LENGTHS)}）")
+        try:
+            chunk_size = int(field("chunk_size", PDFConfig.CHUNK_SIZE))
+            max_concurrent = int(field("max_concurrent", APIConfig.MAX_CONCURRENT))
+        except ValueError:
+            return json_error(400, "chunk_size和max_concurrent必须是整数")
+
+        # 请求头中的密钥只登记给该任务使用；未提供时使用服务端环境变量中的密钥
+        credentials = self.request_credentials(request, provider) or self.worker.credentials.get(provider)
+        if credentials is None:
+            return self.missing_key(provider)
+        api_key, api_base = credentials
+
+        file = io.BytesIO(data)
+        file.name = filename
+        loop = asyncio.get_running_loop()
+        # 估算成本（PDF需读取页数）和保存文件放进线程池，不阻塞其他请求
+        cost = await loop.run_in_executor(None, BaseFileProcessor.estimate_tokens, file)
+        job_id = await loop.run_in_executor(None, lambda: self.worker.submit(
+            filename,
+            data,
+            {
+                "provider": provider,
+                "mode": mode,
+                "chunk_size": chunk_size,
+                "max_concurrent": max_concurrent
+            },
+            api_key=api_key,
+            api_base=api_base,
+            session_id=field("session_id"),
+            cost=cost
+        ))
+        return Response(self.job_view(self.store.get(job_id)), status=202, headers={"location": f"/jobs/{job_id}"})
+
+    def retry(self, job: dict, request: Request) -> Response:
+        """重试失败的任务；请求头中的密钥重新登记给该任务（服务重启后排队等待密钥的任务也用这种方式继续）"""
+        provider = job["settings"]["provider"]
+        credentials = self.request_credentials(request, provider)
+        if job["status"] not in (JobStore.FAILED, JobStore.QUEUED) or (job["status"] == JobStore.QUEUED and credentials is None):
+            return json_error(409, f"只能重试失败的任务（当前: {job['status']}）", code="job_not_failed")
+        if credentials is None and not self.worker.can_run(job):
+            return self.missing_key(provider)
+        if credentials is not None:
+            self.worker.register(job["id"], *credentials)
+        if job["status"] == JobStore.FAILED:
+            self.store.requeue(job["id"])
+        self.worker.wake()
+        return Response(self.job_view(self.store.get(job["id"])), status=202)
+
+    async def cancel(self, job: dict) -> Response:
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(None, self.worker.cancel, job["id"]):
+            return json_error(409, f"只能停止排队中或运行中的任务（当前: {job['status']}）", code="job_not_active")
+        return Response(self.job_view(self.store.get(job["id"])), status=202)
+
+    @staticmethod
+    def request_credentials(request: Request, provider: str) -> Optional[Tuple[str, Optional[str]]]:
+        """Authorization请求头中的密钥和X-API-Base（未提供时使用服务端的API_BASE）"""
+        authorization = request.headers.get("authorization", "")
+        if not authorization.lower().startswith("bearer "):
+            return None
+        api_base = request.headers.get("x-api-base") or os.getenv(f"{provider.upper()}_API_BASE")
+        return authorization[7:].strip(), api_base
+
+    @staticmethod
+    def missing_key(provider: str) -> Response:
+        return json_error(401, f"缺少API密钥：请使用Authorization请求头，或在服务端设置 {provider.upper()}_API_KEY")
+
+    async def excel(self, job: dict, format: str = None) -> Response:
+        """与界面导出相同格式的Excel行"""
+        result = job["result"]
+        record = {
+            "filename": job["filename"],
+            "summary": result["summary"],
+            "mode": result["mode"],
+            "path": result["path"],
+            "usage": result["usage"]
+        }
+        if format == "json":
+            return Response(self.exporter.excel_row(record))
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, self.exporter.export_excel, [record])
+        return Response(
+            data,
+            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers=self.attachment(job, ".xlsx")
+        )
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="论文总结HTTP接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-jobs", type=int, default=APIConfig.MAX_CONCURRENT_PAPERS, help="同时处理的论文数")
+    args = parser.parse_args()
+
+    worker = get_job_worker()
+    worker.max_jobs = max(args.max_jobs, 1)
+    api = JobAPI(worker)
+
+    async def serve():
+        server = await HTTPServer(api.handle, args.host, args.port).start()
+        print(f"论文总结接口已启动: {server.base_url}")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -6,16 +6,28 @@ import pandas as pd
 import difflib
 import zipfile
 import tempfile
+import time
+import uuid
 from datetime import datetime
 from utils.pdf_processor import PDFProcessor
 from utils.word_processor import WordProcessor
 from utils.openai_handler import AIHandler
-from utils.mindmap_generator import MindmapGenerator
 from utils.exporter import PaperExporter
-from utils.batch_processor import BatchProcessor
+from utils.router import ProviderRouter
+from utils.cassette import Cassette
+from utils.batch_job import BatchJobCollector
+from utils.document_cache import DocumentCache
+from utils.scheduler import PaperScheduler, get_priority_limiter, set_job_cost
+from utils.pipeline import StagedPipeline
+from utils.summarizer import DocumentSummarizer, compose_summary, render_mindmap
+from utils.deadline import Deadline
+from utils.rate_limiter import estimate_tokens
+from utils.job_worker import get_job_worker
+from utils.job_store import JobStore
+from utils.usage import UsageTracker, STAGE_LABELS, merge_usage
 from utils.file_processor import BaseFileProcessor
+from utils.exceptions import APIError, APIAuthError, APIQuotaError, APIContextLengthError, DeadlineExceededError
 from config import APIConfig, UIConfig, PDFConfig
-from prompts import get_prompts
 
 def set_page_style():
     st.set_page_config(
@@ -31,6 +43,9 @@ class PaperSummarizer:
         # 加载环境变量
         load_dotenv()
         
+        self.document_cache = DocumentCache()
+        # 多篇论文共享全局并发限制的调度器（每次开始总结时创建）
+        self.scheduler = None
         set_page_style()
         self.setup_sidebar()
         self.initialize_session_state()
@@ -121,9 +136,22 @@ class PaperSummarizer:
             max_concurrent = st.slider(
                 "最大并发请求数",
                 min_value=1,
+                max_value=APIConfig.GLOBAL_MAX_CONCURRENT,
+                value=APIConfig.GLOBAL_MAX_CONCURRENT if APIConfig.ADAPTIVE_CONCURRENCY else APIConfig.MAX_CONCURRENT,
+                help=(
+                    "同时进行的请求数上限（所有论文共享），实际并发根据延迟和限流自动调整"
+                    if APIConfig.ADAPTIVE_CONCURRENCY else "同时进行的最大请求数（所有论文共享）"
+                )
+            )
+            max_papers = st.slider(
+                "同时处理的论文数",
+                min_value=1,
                 max_value=10,
-                value=APIConfig.MAX_CONCURRENT,
-                help="同时处理的最大文本块数量"
+                value=APIConfig.MAX_CONCURRENT_PAPERS,
+                help=(
+                    "多篇论文同时处理，某篇论文在合并或生成最终总结时，其余论文可以使用空闲的并发请求；"
+                    f"后台任务模式下为本会话同时运行的任务数（所有会话合计不超过{APIConfig.MAX_CONCURRENT_PAPERS}个）"
+                )
             )
             
             # 文本处理设置
@@ -136,6 +164,60 @@ class PaperSummarizer:
                 help="单个文本块的最大字符数"
             )
             
+            # 多提供商路由设置
+            st.write("#### 多提供商路由")
+            enable_routing = st.checkbox(
+                "启用多提供商路由",
+                value=False,
+                help="在所有已配置API Key的提供商之间分配请求，出错时自动切换"
+            )
+            enable_hedge = st.checkbox(
+                "启用对冲请求",
+                value=APIConfig.HEDGE_ENABLED,
+                disabled=not enable_routing,
+                help="请求超过p95延迟仍未返回时，向另一个提供商发送相同请求并采用先返回的结果"
+            )
+            
+            # 离线批处理设置
+            st.write("#### 离线批处理")
+            offline_batch = st.checkbox(
+                "离线批处理模式（Batch API）",
+                value=False,
+                disabled=not config.get("batch_api"),
+                help="所有请求通过提供商的Batch API提交，费用约为一半，但需要等待任务完成（最长24小时），适合大量论文的夜间处理"
+            )
+            
+            # 后台任务设置
+            st.write("#### 后台任务")
+            background_jobs = st.checkbox(
+                "后台任务模式（可断点续传）",
+                value=True,
+                help=(
+                    "文件提交给服务器上共享的后台任务执行器处理，处理期间页面保持可操作，进度自动刷新；"
+                    "进度保存在本地数据库中，关闭页面或服务重启后可按任务ID重新查看，中断的任务从检查点继续。"
+                    "取消勾选则在页面中直接处理（离线批处理和请求录制/回放始终在页面中处理）"
+                )
+            )
+            
+            # 请求录制/回放设置
+            st.write("#### 请求录制（回归测试）")
+            cassette_mode = st.selectbox(
+                "录制模式",
+                ["关闭", "录制", "回放"],
+                help="录制：保存每个请求的响应与耗时；回放：不调用API，直接返回录制的响应。录制/回放时不使用本地缓存"
+            )
+            cassette_path = st.text_input(
+                "录制文件",
+                value=os.path.join(APIConfig.CASSETTE_DIR, "session.jsonl.gz"),
+                disabled=cassette_mode == "关闭"
+            )
+            cassette_zero_latency = st.checkbox(
+                "回放时忽略原始延迟",
+                value=False,
+                disabled=cassette_mode != "回放",
+                help="勾选后回放立即返回；否则按录制时的耗时等待，便于比较阶段耗时"
+            )
+            
             # 模型参数设置
             st.write("#### 模型参数")
             temperature = st.slider(
@@ -153,8 +235,16 @@ class PaperSummarizer:
         
         st.session_state.settings.update({
             "max_concurrent": max_concurrent,
+            "max_papers": max_papers,
             "chunk_size": chunk_size,
-            "temperature": temperature
+            "temperature": temperature,
+            "routing": enable_routing,
+            "hedge": enable_hedge,
+            "offline_batch": offline_batch and bool(config.get("batch_api")),
+            "background_jobs": background_jobs,
+            "cassette_mode": {"录制": Cassette.RECORD, "回放": Cassette.REPLAY}.get(cassette_mode),
+            "cassette_path": cassette_path,
+            "cassette_zero_latency": cassette_zero_latency
         })
         
     def initialize_session_state(self):
@@ -165,120 +255,572 @@ class PaperSummarizer:
             st.session_state.processing = False
         if "ai_handler" not in st.session_state:
             st.session_state.ai_handler = None
-            
-    async def process_paper(self, file):
-        """处理单个论文文件"""
-        try:
-            # 创建状态容器
-            status_container = st.empty()
-            with status_container:
-                st.info(f"正在处理：{file.name}")
-            
-            # 获取文件处理器
-            processor = BaseFileProcessor.get_processor(file.name)
-            
-            # 提取文本
-            text_chunks = processor.extract_text(file)
-            
-            # 初始化或更新AI处理器
-            if not st.session_state.ai_handler:
-                st.session_state.ai_handler = AIHandler(
-                    api_key=st.session_state.api_key,
-                    api_base=st.session_state.api_base,
-                    provider=self.api_provider
-                )
-            
-            # 获取提示词
-            prompts = get_prompts(self.summary_mode)
-            
-            # 创建批处理器
-            batch_processor = BatchProcessor(
-                max_workers=st.session_state.settings["max_concurrent"],
-                progress_callback=lambda p, d: status_container.progress(p)
+        if "cassette" not in st.session_state:
+            st.session_state.cassette = None
+        if "job_ids" not in st.session_state:
+            # 本会话提交或重新连接的后台任务，已完成的任务加入历史记录后记入imported_jobs
+            st.session_state.job_ids = []
+            st.session_state.imported_jobs = set()
+        if "session_id" not in st.session_state:
+            # 在同一API密钥的多个会话之间公平分配并发名额
+            st.session_state.session_id = uuid.uuid4().hex
+    
+    def routing_credentials(self) -> dict:
+        """当前提供商以外、已配置API Key的提供商：{提供商: (api_key, api_base)}"""
+        credentials = {}
+        for provider in APIConfig.PROVIDERS:
+            if provider == self.api_provider:
+                continue
+            api_key = st.session_state.get(f"{provider}_api_key") or os.getenv(f"{provider.upper()}_API_KEY", "")
+            if not api_key:
+                continue
+            api_base = st.session_state.get(f"{provider}_api_base") or os.getenv(
+                f"{provider.upper()}_API_BASE",
+                APIConfig.get_config(provider)["api_base"]
             )
+            credentials[provider] = (api_key, api_base)
+        return credentials
+    
+    def build_router(self) -> ProviderRouter:
+        """使用所有已配置API Key的提供商构建路由，不足两个时返回None"""
+        handlers = {self.api_provider: st.session_state.ai_handler}
+        for provider, (api_key, api_base) in self.routing_credentials().items():
+            handlers[provider] = AIHandler(api_key=api_key, api_base=api_base, provider=provider)
+        
+        if len(handlers) < 2:
+            st.warning("多提供商路由需要至少两个已配置API Key的提供商，将只使用当前提供商")
+            return None
+        return ProviderRouter(handlers, hedge=st.session_state.settings["hedge"])
             
-            # 批量处理文本块
-            with status_container:
-                st.info("正在分析文本块...")
-            
-            summaries = await batch_processor.process_batch(
-                text_chunks,
-                lambda chunk: st.session_state.ai_handler.process_text(
-                    chunk,
-                    prompts["summary_prompt"]
-                ),
-                description="正在总结文本块"
+    def ensure_ai_handler(self) -> AIHandler:
+        """初始化AI处理器并配置多提供商路由"""
+        if not st.session_state.ai_handler:
+            st.session_state.ai_handler = AIHandler(
+                api_key=st.session_state.api_key,
+                api_base=st.session_state.api_base,
+                provider=self.api_provider
             )
-            
-            if not summaries:
-                raise Exception("文本块处理失败")
-            
-            # 合并所有总结
-            with status_container:
-                st.info("正在合并总结...")
-            
-            merged_summary = await st.session_state.ai_handler.process_text(
-                "\n\n".join(summaries),
-                prompts["merge_prompt"]
+        
+        # 离线批处理只使用当前提供商的Batch API
+        settings = st.session_state.settings
+        st.session_state.ai_handler.router = (
+            self.build_router() if settings["routing"] and not settings["offline_batch"] else None
+        )
+        
+        # 录制/回放作用于所有参与路由的处理器
+        handlers = (
+            st.session_state.ai_handler.router.handlers.values()
+            if st.session_state.ai_handler.router else [st.session_state.ai_handler]
+        )
+        for handler in handlers:
+            handler.cassette = st.session_state.cassette
+        return st.session_state.ai_handler
+    
+    def open_cassette(self):
+        """按设置打开录制文件（未启用时返回None）"""
+        settings = st.session_state.settings
+        if not settings.get("cassette_mode"):
+            return None
+        try:
+            return Cassette(
+                settings["cassette_path"],
+                mode=settings["cassette_mode"],
+                original_latency=not settings["cassette_zero_latency"]
             )
-            
-            if not merged_summary:
-                raise Exception("总结合并失败")
-            
-            # 使用专门的final_summary_prompt生成最终总结
+        except (OSError, ValueError) as e:
+            st.error(f"无法打开录制文件：{str(e)}")
+            return None
+    
+    def create_summarizer(self, deadline: Deadline = None) -> DocumentSummarizer:
+        """按当前设置创建单篇论文的处理流程（与界面无关，见 utils/summarizer.py）
+        
+        deadline为论文的处理时限，同一篇论文的提取和总结阶段共用。
+        """
+        settings = st.session_state.settings
+        return DocumentSummarizer(
+            st.session_state.ai_handler,
+            mode=self.summary_mode,
+            provider=self.api_provider,
+            chunk_size=settings["chunk_size"],
+            max_concurrent=settings["max_concurrent"],
+            scheduler=self.scheduler,
+            offline=settings["offline_batch"],
+            deadline=deadline
+        )
+    
+    @staticmethod
+    def status_reporter(status_container):
+        """把处理流程的进度显示在论文的状态容器中"""
+        def report(stage, message, progress):
+            if progress is not None:
+                # 进度说明包含完成、失败、重试中和进行中的数量，吞吐、延迟和预计剩余时间
+                status_container.progress(progress, text=message)
+            elif stage == "dropped":
+                with status_container:
+                    st.warning(message)
+            else:
+                with status_container:
+                    st.info(message)
+        return report
+    
+    def document_key(self, file):
+        """整篇文档缓存的键（录制/回放时不使用缓存）"""
+        if st.session_state.get("cassette") is not None:
+            return None
+        return self.create_summarizer().document_key(file)
+    
+    def restore_cached(self, file, cached):
+        """用缓存的结果生成历史记录（不调用API，不解析文件）"""
+        complete_summary = compose_summary(file.name, cached["final_summary"])
+        mindmap_image = cached.get("mindmap")
+        if cached.get("filename") != file.name:
+            # 思维导图包含文件名标题，文件名变化时由缓存的总结重新生成
+            try:
+                mindmap_image = render_mindmap(complete_summary)
+            except Exception as e:
+                st.error(f"思维导图生成失败：{str(e)}")
+                mindmap_image = None
+        
+        usage = UsageTracker().summary()
+        usage.update({
+            "provider": self.api_provider,
+            "model": APIConfig.get_config(self.api_provider)["model"],
+            "chunk_size": st.session_state.settings["chunk_size"],
+            "path": cached.get("path"),
+            "document_cache": True
+        })
+        print(f"{file.name} 命中整篇文档缓存，跳过文本提取和API调用")
+        st.session_state.history.append({
+            "filename": file.name,
+            "summary": complete_summary,
+            "mode": self.summary_mode,
+            "timestamp": pd.Timestamp.now(),
+            "mindmap": mindmap_image,
+            "path": cached.get("path"),
+            "usage": usage
+        })
+    
+    def report_error(self, e, status_container):
+        """在论文的状态容器中显示错误；密钥无效、配额不足重新抛出，由调用方终止批处理"""
+        if isinstance(e, (APIAuthError, APIQuotaError)):
             with status_container:
-                st.info("正在生成最终总结...")
-            
-            final_summary = await st.session_state.ai_handler.process_text(
-                merged_summary,
-                prompts["final_summary_prompt"]
+                if isinstance(e, APIQuotaError):
+                    st.error("😢 API配额不足，请检查账户余额")
+                else:
+                    st.error("🔑 API密钥无效，请检查配置")
+            # 密钥和配额问题对其余文件同样无法恢复，交给调用方终止批处理
+            raise e
+        
+        error_msg = str(e)
+        with status_container:
+            if isinstance(e, APIContextLengthError):
+                st.error(f"📏 {error_msg}")
+            elif isinstance(e, DeadlineExceededError):
+                st.error(f"⏱️ {error_msg}")
+            elif isinstance(e, APIError) and "不可用" in error_msg:
+                st.error("⚠️ 模型不可用，请尝试其他模型")
+            else:
+                st.error(f"❌ 处理失败：{error_msg}")
+    
+    def check_document_cache(self, paper):
+        """同一文件在相同设置下处理过时直接使用整篇文档的缓存结果，返回是否命中"""
+        paper["document_key"] = self.document_key(paper["file"])
+        cached = self.document_cache.get(paper["document_key"]) if paper["document_key"] else None
+        if not cached:
+            return False
+        self.restore_cached(paper["file"], cached)
+        with paper["status"]:
+            st.success(f"✅ 完成：{paper['file'].name}（使用缓存结果）")
+        return True
+    
+    async def extract_paper(self, paper):
+        """提取阶段：在线程池中解析文件（PDF解析、OCR不阻塞事件循环中的API请求）"""
+        file = paper["file"]
+        with paper["status"]:
+            st.info(f"正在提取文本：{file.name}")
+        paper["text_chunks"] = await self.create_summarizer(paper["deadline"]).extract(file.name, file)
+        return paper
+    
+    async def summarize_paper(self, paper):
+        """总结阶段：单次总结，或 文本块提取 -> 分层合并 -> 最终总结"""
+        file = paper["file"]
+        with paper["status"]:
+            st.info(f"正在处理：{file.name}")
+        
+        # 初始化或更新AI处理器
+        self.ensure_ai_handler()
+        result = await self.create_summarizer(paper["deadline"]).summarize(
+            file.name,
+            paper["text_chunks"],
+            self.status_reporter(paper["status"])
+        )
+        paper.update(result)
+        return paper
+    
+    async def render_paper(self, paper):
+        """渲染阶段：在线程池中生成思维导图，保存历史记录和整篇文档缓存"""
+        file = paper["file"]
+        # 组合最终内容
+        complete_summary = compose_summary(file.name, paper["final_summary"])
+        
+        # 生成思维导图
+        with paper["status"]:
+            st.info("正在生成思维导图...")
+        
+        loop = asyncio.get_running_loop()
+        try:
+            mindmap_image = await loop.run_in_executor(None, render_mindmap, complete_summary)
+        except Exception as e:
+            st.error(f"思维导图生成失败：{str(e)}")
+            mindmap_image = None
+        
+        # 保存到历史记录
+        st.session_state.history.append({
+            "filename": file.name,
+            "summary": complete_summary,
+            "mode": self.summary_mode,
+            "timestamp": pd.Timestamp.now(),
+            "mindmap": mindmap_image,
+            "path": paper["path"],
+            "usage": paper["usage"]
+        })
+        # 有文本块被丢弃的不完整结果不写入整篇文档缓存
+        if paper.get("document_key") and not paper["usage"].get("dropped_chunks"):
+            self.document_cache.put(paper["document_key"], {
+                "filename": file.name,
+                "final_summary": paper["final_summary"],
+                "mindmap": mindmap_image,
+                "path": paper["path"],
+                "usage": paper["usage"]
+            })
+        
+        # 完成处理
+        with paper["status"]:
+            st.success(f"✅ 完成：{file.name}")
+        return paper
+    
+    async def process_paper(self, file, text_chunks=None, status_container=None):
+        """处理单个论文文件（text_chunks为已提取的文本块时跳过提取）"""
+        # 创建状态容器
+        if status_container is None:
+            status_container = st.empty()
+        paper = {"file": file, "status": status_container, "text_chunks": text_chunks, "deadline": Deadline()}
+        try:
+            if self.check_document_cache(paper):
+                return
+            if text_chunks is None:
+                await self.extract_paper(paper)
+            await self.summarize_paper(paper)
+            await self.render_paper(paper)
+        except Exception as e:
+            self.report_error(e, status_container)
+            return None
+    
+    async def process_offline(self, files):
+        """离线批处理：先提取全部文本，再并发处理所有论文，请求统一通过Batch API提交"""
+        handler = self.ensure_ai_handler()
+        
+        extracted = []
+        for file in files:
+            # 命中整篇文档缓存的文件无需提取文本
+            document_key = self.document_key(file)
+            if document_key and self.document_cache.get(document_key):
+                extracted.append((file, None))
+                continue
+            try:
+                processor = BaseFileProcessor.get_processor(file.name, st.session_state.settings["chunk_size"])
+                extracted.append((file, processor.extract_text(file)))
+            except Exception as e:
+                st.error(f"{file.name} 文本提取失败：{str(e)}")
+        
+        job_status = st.empty()
+        with BatchJobCollector(handler, status_callback=lambda message: job_status.info(message)):
+            results = await asyncio.gather(
+                *(self.process_paper(file, text_chunks=chunks) for file, chunks in extracted),
+                return_exceptions=True
+            )
+        job_status.empty()
+        
+        for (file, _), result in zip(extracted, results):
+            if isinstance(result, Exception) and not isinstance(result, (APIAuthError, APIQuotaError)):
+                st.error(f"{file.name} 处理失败：{str(result)}")
+    
+    def paper_stage(self, stage):
+        """包装流水线阶段：单篇论文的错误显示在其状态容器中，不影响其他论文"""
+        async def run(paper):
+            try:
+                return await stage(paper)
+            except Exception as e:
+                self.report_error(e, paper["status"])
+                return None
+        return run
+    
+    async def process_concurrent(self, files):
+        """多篇论文流水线处理：文本提取、LLM总结、思维导图渲染分阶段重叠进行
+        
+        第N篇论文在总结时，第N+1篇已经在线程池中提取文本；阶段之间的队列有界，
+        提取不会过多领先于总结。所有API请求共享全局并发限制，每篇论文单独显示进度。
+        """
+        self.ensure_ai_handler()
+        max_concurrent = st.session_state.settings["max_concurrent"]
+        # 同一API密钥的所有会话共享并发名额：会话之间公平分配，会话内短论文优先
+        limiter = get_priority_limiter(self.api_provider, st.session_state.api_key).session(
+            st.session_state.session_id,
+            max_concurrent
+        )
+        self.scheduler = PaperScheduler(
+            max_papers=st.session_state.settings["max_papers"],
+            max_concurrent=max_concurrent,
+            limiter=limiter,
+            adaptive_limiter=st.session_state.ai_handler.concurrency_limiter
+        )
+        
+        papers = []
+        for file in files:
+            status_container = st.empty()
+            status_container.info(f"排队中：{file.name}")
+            # 每篇论文单独计算处理时限（不含排队等待的时间）
+            papers.append({"file": file, "status": status_container, "deadline": Deadline()})
+        
+        async def prepare(paper):
+            if self.check_document_cache(paper):
+                return None
+            return await self.extract_paper(paper)
+        
+        async def summarize(paper):
+            # 提取完成后按实际的token数设置优先级（短论文的请求优先）
+            set_job_cost(paper["cost"])
+            return await self.summarize_paper(paper)
+        
+        def paper_cost(paper):
+            paper["cost"] = sum(estimate_tokens(chunk) for chunk in paper["text_chunks"])
+            return paper["cost"]
+        
+        pipeline = StagedPipeline(queue_size=APIConfig.PIPELINE_QUEUE_SIZE)
+        pipeline.add_stage(
+            "extract",
+            self.paper_stage(prepare),
+            workers=PDFConfig.EXTRACT_WORKERS,
+            priority=lambda paper: BaseFileProcessor.estimate_tokens(paper["file"])
+        )
+        pipeline.add_stage(
+            "summarize",
+            self.paper_stage(summarize),
+            workers=st.session_state.settings["max_papers"],
+            priority=paper_cost
+        )
+        pipeline.add_stage("render", self.paper_stage(self.render_paper))
+        
+        try:
+            await pipeline.run(papers)
+        except (APIAuthError, APIQuotaError):
+            return
+        finally:
+            self.scheduler = None
+    
+    async def run_stoppable(self, coroutine):
+        """执行处理流程并显示停止按钮
+        
+        点击停止会触发脚本重跑，Streamlit在下一次界面调用时中断脚本；这里定期刷新已用时间，
+        使中断在半秒内发生，随后取消处理任务，进行中的API请求随之取消，不再消耗token。
+        """
+        st.button("⏹️ 停止处理", key="stop_processing", use_container_width=True)
+        elapsed = st.empty()
+        start = time.monotonic()
+        task = asyncio.ensure_future(coroutine)
+        concurrency_limiter = st.session_state.ai_handler and st.session_state.ai_handler.concurrency_limiter
+        try:
+            while not task.done():
+                caption = f"⏱️ 已用时 {time.monotonic() - start:.0f} 秒"
+                if concurrency_limiter:
+                    # 自适应并发的当前值（同一API密钥的所有会话共享）
+                    caption += f" · 当前并发 {concurrency_limiter.current_limit}"
+                elapsed.caption(caption)
+                await asyncio.wait([task], timeout=0.5)
+        except BaseException:
+            # 停止按钮（或其他页面操作）中断了脚本
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            raise
+        elapsed.empty()
+        return task.result()
+    
+    def submit_jobs(self, files):
+        """把文件提交给后台任务执行器（关闭页面或服务重启后可按任务ID重新查看）"""
+        worker = get_job_worker()
+        settings = st.session_state.settings
+        # 多提供商路由使用的其他提供商密钥只登记给本会话的任务
+        routes = self.routing_credentials() if settings["routing"] else None
+        if settings["routing"] and not routes:
+            st.warning("多提供商路由需要至少两个已配置API Key的提供商，将只使用当前提供商")
+        for file in files:
+            job_id = worker.submit(
+                file.name,
+                file.getvalue(),
+                {
+                    "provider": self.api_provider,
+                    "mode": self.summary_mode,
+                    "chunk_size": settings["chunk_size"],
+                    "max_concurrent": settings["max_concurrent"],
+                    "routing": bool(routes),
+                    "hedge": settings["hedge"],
+                    # 本会话同时运行的后台任务数（同时受执行器的任务数上限限制）
+                    "max_papers": settings["max_papers"]
+                },
+                api_key=st.session_state.api_key,
+                api_base=st.session_state.api_base,
+                session_id=st.session_state.session_id,
+                cost=BaseFileProcessor.estimate_tokens(file),
+                routes=routes
             )
+            st.session_state.job_ids.append(job_id)
+        st.success(f"已提交 {len(files)} 个后台任务，任务ID见下方「后台任务」")
+    
+    def render_jobs_fragment(self):
+        """后台任务状态放在局部刷新的片段中：有进行中的任务时每隔JOB_UI_REFRESH秒只重跑这一部分"""
+        store = get_job_worker().store
+        active = any(
+            job["status"] in (JobStore.QUEUED, JobStore.RUNNING)
+            for job in store.list(job_ids=st.session_state.job_ids)
+        )
+        run_every = APIConfig.JOB_UI_REFRESH if active else None
+        st.fragment(run_every=run_every)(lambda: self.render_jobs(refreshing=active))()
+    
+    def render_jobs(self, refreshing: bool = False):
+        """后台任务状态：按任务ID重新连接，失败的任务可从检查点重试，完成的任务加入历史记录
+        
+        refreshing表示所在片段正在自动刷新；有任务完成或全部结束时重跑整个页面，显示历史记录并停止刷新。
+        """
+        worker = get_job_worker()
+        store = worker.store
+        
+        with st.expander("📋 后台任务", expanded=True):
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                attach_id = st.text_input("任务ID", placeholder="输入任务ID重新查看（关闭页面或服务重启后）")
+            with col2:
+                st.write("")
+                if st.button("查看", use_container_width=True) and attach_id:
+                    attach_id = attach_id.strip()
+                    if not store.get(attach_id):
+                        st.warning(f"没有找到任务：{attach_id}")
+                    elif attach_id not in st.session_state.job_ids:
+                        st.session_state.job_ids.append(attach_id)
+                        st.rerun()
             
-            if not final_summary:
-                raise Exception("最终总结生成失败")
+            jobs = store.list(job_ids=st.session_state.job_ids)
+            if not jobs:
+                st.caption("暂无后台任务")
+                return
             
-            # 组合最终内容
-            complete_summary = f"""# {file.name} 论文总结
-
-{final_summary}"""
+            # 服务重启后排队等待密钥的任务，使用本会话的密钥继续
+            for job in jobs:
+                if job["status"] == JobStore.QUEUED:
+                    self.register_job_key(worker, job)
             
-            # 生成思维导图
-            with status_container:
-                st.info("正在生成思维导图...")
+            status_labels = {
+                JobStore.QUEUED: "⏳ 排队中",
+                JobStore.RUNNING: "🔄 运行中",
+                JobStore.DONE: "✅ 已完成",
+                JobStore.FAILED: "❌ 失败"
+            }
+            stage_labels = dict(STAGE_LABELS, extract="文本提取", render="思维导图", done="完成")
+            st.dataframe(pd.DataFrame([
+                {
+                    "任务ID": job["id"],
+                    "文件": job["filename"],
+                    "状态": status_labels.get(job["status"], job["status"]),
+                    "阶段": stage_labels.get(job["stage"], job["stage"] or ""),
+                    "进度": f"{job['progress']:.0%}" if job["progress"] is not None else "",
+                    "说明": job["error"] or job["message"] or ""
+                }
+                for job in jobs
+            ]), hide_index=True, use_container_width=True)
             
-            mindmap_generator = MindmapGenerator()
-            try:
-                dot_source = mindmap_generator.generate(complete_summary)
-                mindmap_image = mindmap_generator.export_image(dot_source, 'png')
-            except Exception as e:
-                st.error(f"思维导图生成失败：{str(e)}")
-                mindmap_image = None
+            # 排队中和运行中的任务可以停止（之后可从检查点重试）
+            active_jobs = [job for job in jobs if job["status"] in (JobStore.QUEUED, JobStore.RUNNING)]
+            for i in range(0, len(active_jobs), 4):
+                for job, col in zip(active_jobs[i:i + 4], st.columns(4)):
+                    with col:
+                        if st.button(f"⏹️ 停止 {job['filename']}", key=f"stop_job_{job['id']}", use_container_width=True):
+                            worker.cancel(job["id"])
+                            st.rerun()
             
-            # 保存到历史记录
+            col1, col2 = st.columns(2)
+            with col1:
+                st.button("🔄 刷新状态", use_container_width=True)
+            with col2:
+                failed = [job for job in jobs if job["status"] == JobStore.FAILED]
+                if st.button("↩️ 重试失败的任务", disabled=not failed, use_container_width=True):
+                    for job in failed:
+                        self.register_job_key(worker, job)
+                        store.requeue(job["id"])
+                    worker.wake()
+                    st.rerun()
+        
+        # 已完成的任务加入历史记录
+        imported = False
+        for job in jobs:
+            if job["status"] != JobStore.DONE or job["id"] in st.session_state.imported_jobs:
+                continue
+            imported = True
+            job = store.get(job["id"], include_mindmap=True)
+            result = job["result"]
             st.session_state.history.append({
-                "filename": file.name,
-                "summary": complete_summary,
-                "mode": self.summary_mode,
-                "timestamp": pd.Timestamp.now(),
-                "mindmap": mindmap_image
+                "filename": job["filename"],
+                "summary": result["summary"],
+                "mode": result["mode"],
+                "timestamp": pd.Timestamp.fromtimestamp(job["updated"]),
+                "mindmap": job["mindmap"],
+                "path": result["path"],
+                "usage": result["usage"]
             })
-            
-            # 完成处理
-            with status_container:
-                st.success(f"✅ 完成：{file.name}")
-            
-        except Exception as e:
-            error_msg = str(e)
-            with status_container:
-                if "API配额不足" in error_msg:
-                    st.error("😢 API配额不足，请检查账户余额")
-                elif "API密钥无效" in error_msg:
-                    st.error("🔑 API密钥无效，请检查配置")
-                elif "模型不可用" in error_msg:
-                    st.error("⚠️ 模型不可用，请尝试其他模型")
-                else:
-                    st.error(f"❌ 处理失败：{error_msg}")
-            return None
+            st.session_state.imported_jobs.add(job["id"])
+        
+        active = any(job["status"] in (JobStore.QUEUED, JobStore.RUNNING) for job in jobs)
+        if refreshing and (imported or not active):
+            st.rerun()
+    
+    def register_job_key(self, worker, job: dict):
+        """任务没有可用密钥时（服务重启后内存中的密钥丢失），登记本会话同一提供商的密钥"""
+        if worker.can_run(job) or job["settings"]["provider"] != self.api_provider or not st.session_state.api_key:
+            return
+        worker.register(job["id"], st.session_state.api_key, st.session_state.api_base)
+    
+    def render_usage(self, usage: dict):
+        """显示token用量与费用统计"""
+        # 提供商上下文缓存命中的输入token占比
+        prefix_hit_rate = usage["cached_tokens"] / usage["prompt_tokens"] if usage["prompt_tokens"] else 0.0
+        
+        cols = st.columns(5)
+        cols[0].metric("API调用次数", f"{usage['calls']}", help=f"命中本地缓存 {usage['cache_hits']} 次")
+        cols[1].metric("输入 tokens", f"{usage['prompt_tokens']:,}")
+        cols[2].metric(
+            "前缀缓存命中",
+            f"{usage['cached_tokens']:,}",
+            f"{prefix_hit_rate:.0%}",
+            delta_color="off",
+            help="提供商上下文缓存命中的输入tokens（按折扣计费）"
+        )
+        cols[3].metric("输出 tokens", f"{usage['completion_tokens']:,}")
+        cols[4].metric("预估费用", f"${usage['cost']:.4f}")
+        
+        if usage.get("stages"):
+            rows = []
+            for stage, stats in usage["stages"].items():
+                rows.append({
+                    "阶段": STAGE_LABELS.get(stage, stage),
+                    "调用次数": stats["calls"],
+                    "缓存命中": stats["cache_hits"],
+                    "输入tokens": stats["prompt_tokens"],
+                    "缓存命中tokens": stats["cached_tokens"],
+                    "输出tokens": stats["completion_tokens"],
+                    "计划输出tokens": stats.get("planned_tokens", 0),
+                    "截断次数": stats.get("truncated", 0),
+                    "费用(USD)": round(stats["cost"], 4),
+                    "耗时(秒)": round(stats.get("wall_time", stats["latency"]), 2)
+                })
+            st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
 
     async def main(self):
         st.title("论文批量总结助手 📚")
@@ -289,6 +831,11 @@ class PaperSummarizer:
             accept_multiple_files=True
         )
         
+        if st.session_state.processing:
+            # 上次的处理被停止按钮中断
+            st.session_state.processing = False
+            st.warning("⏹️ 已停止处理，进行中的请求已取消")
+        
         if uploaded_files:
             col1, col2, col3 = st.columns([1, 2, 1])
             with col2:
@@ -298,13 +845,30 @@ class PaperSummarizer:
                         return
                     
                     st.session_state.processing = True
-                    for file in uploaded_files:
-                        try:
-                            await self.process_paper(file)
-                        except Exception as e:
-                            st.error(f"处理失败：{str(e)}")
-                            continue
+                    history_start = len(st.session_state.history)
+                    st.session_state.cassette = self.open_cassette()
+                    try:
+                        if st.session_state.settings["offline_batch"]:
+                            await self.run_stoppable(self.process_offline(uploaded_files))
+                        elif st.session_state.settings["background_jobs"] and not st.session_state.cassette:
+                            # 默认交给后台任务执行器，脚本立即结束，页面不被处理过程阻塞
+                            self.submit_jobs(uploaded_files)
+                        else:
+                            await self.run_stoppable(self.process_concurrent(uploaded_files))
+                    finally:
+                        if st.session_state.cassette:
+                            st.session_state.cassette.close()
+                            st.session_state.cassette = None
                     st.session_state.processing = False
+                    
+                    # 本批次的用量汇总
+                    st.session_state.batch_usage = merge_usage(
+                        record.get("usage") for record in st.session_state.history[history_start:]
+                    )
+        
+        # 后台任务状态（完成的任务加入历史记录）
+        if st.session_state.settings["background_jobs"] or st.session_state.job_ids:
+            self.render_jobs_fragment()
         
         # 历史记录区域
         if st.session_state.history:
@@ -333,6 +897,24 @@ class PaperSummarizer:
                     key="download_excel_btn",
                     use_container_width=True,
                 )
+                # 用量报告（JSON，便于脚本分析）
+                st.download_button(
+                    "📥 下载用量报告 (JSON)",
+                    exporter.export_usage_report(st.session_state.history),
+                    "usage_report.json",
+                    "application/json",
+                    key="download_usage_btn",
+                    use_container_width=True,
+                )
+            
+            # 用量汇总
+            if st.session_state.get("batch_usage"):
+                with st.expander("📈 本批次用量统计", expanded=False):
+                    self.render_usage(st.session_state.batch_usage)
+            with st.expander("📈 全部历史用量统计", expanded=False):
+                self.render_usage(
+                    merge_usage(record.get("usage") for record in st.session_state.history)
+                )
             
             st.markdown("## 历史记录")
             
@@ -373,6 +955,20 @@ class PaperSummarizer:
                                 key=f"download_mindmap_{i}"
                             )
                     
+                    # 显示用量统计
+                    if record.get("usage"):
+                        with st.expander("📈 用量统计"):
+                            if record["usage"].get("document_cache"):
+                                st.caption("♻️ 相同文件已在相同设置下处理过，直接使用整篇文档缓存（未调用API）")
+                            elif record.get("path") == "fast":
+                                st.caption("⚡ 文档较短，使用单次总结（跳过分块、合并和最终总结）")
+                            if record["usage"].get("dropped_chunks"):
+                                st.warning(
+                                    f"⚠️ {record['usage']['dropped_chunks']}/{record['usage']['chunks']} "
+                                    "个文本块重试后仍然失败，总结中不包含这些部分"
+                                )
+                            self.render_usage(record["usage"])
+                    
                     # 下载单个文件按钮
                     st.download_button(
                         "📄 下载此总结",
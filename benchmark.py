@@ -0,0 +1,289 @@
+"""处理流程基准测试（基于本地模拟后端，不消耗token）
+
+比较文本块总结与合并阶段的两种调度方式：
+    barrier: 等全部文本块总结完成后再分层合并
+    stream:  相邻的总结完成后立即合并（TreeReducer.reduce_stream）
+
+指定 --papers 时比较多篇论文的两种处理方式（每篇论文：文本块提取 + 合并 + 最终总结）：
+    sequential: 逐篇处理（原先的循环）
+    concurrent: 多篇论文同时处理，共享全局并发限制（PaperScheduler）
+
+指定 --adaptive 时在模拟的提供商限制（--max-concurrency / --rpm / --tpm / --saturation）下比较：
+    fixed:    固定 --workers 个并发请求
+    adaptive: 自适应并发（AIMD），--workers 作为上限
+
+运行方式:
+    python benchmark.py --chunks 48 --budget 3000 --runs 5
+    python benchmark.py --papers 20 --chunks 12 --workers 5 --runs 3
+    python benchmark.py --adaptive --chunks 60 --workers 16 --max-concurrency 6 --sigma 0.3
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from prompts import get_prompts
+from utils.adaptive_limiter import AdaptiveLimiter
+from utils.batch_processor import BatchProcessor
+from utils.fake_llm import start_fake_backend
+from utils.openai_handler import AIHandler
+from utils.rate_limiter import estimate_tokens
+from utils.scheduler import PaperScheduler
+
+
+def start_backend(args):
+    """按命令行参数启动模拟后端"""
+    return start_fake_backend(
+        latency=args.latency,
+        latency_sigma=args.sigma,
+        tokens_per_second=args.tps,
+        output_ratio=args.output_ratio,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        max_concurrency=args.max_concurrency,
+        saturation=args.saturation,
+        seed=args.seed
+    )
+
+
+def make_chunks(count: int, chars: int, salt: str) -> list:
+    """生成互不相同的文本块（salt保证每轮不命中本地缓存）"""
+    rng = random.Random(salt)
+    words = ["model", "training", "dataset", "attention", "baseline", "result", "method", "analysis"]
+    chunks = []
+    for i in range(count):
+        sentences = []
+        while sum(len(s) for s in sentences) < chars:
+            sentences.append(" ".join(rng.choice(words) for _ in range(12)).capitalize() + ".")
+        chunks.append(f"[{salt} chunk {i}] " + " ".join(sentences))
+    return chunks
+
+
+async def run_once(handler: AIHandler, chunks: list, mode: str, workers: int, budget: int) -> dict:
+    """运行一次文本块总结 + 合并，返回关键路径耗时"""
+    prompts = get_prompts("标准模式")
+    batch_processor = BatchProcessor(max_workers=workers)
+    reducer = handler.create_reducer(prompts["merge_prompt"], batch_processor)
+    reducer.input_budget = min(budget, reducer.max_input_tokens)
+
+    def summarize(chunk):
+        return handler.process_text(chunk, prompts["extraction_prompt"])
+
+    start = time.monotonic()
+    if mode == "stream":
+        merged = await reducer.reduce_stream(chunks, summarize)
+        map_time = None
+    else:
+        summaries = await batch_processor.process_batch(chunks, summarize)
+        map_time = time.monotonic() - start
+        merged = await reducer.reduce(summaries)
+    return {
+        "total": time.monotonic() - start,
+        "map": map_time,
+        "levels": reducer.levels,
+        "tokens": estimate_tokens(merged)
+    }
+
+
+async def summarize_paper(handler: AIHandler, chunks: list, batch_processor: BatchProcessor, limited) -> str:
+    """单篇论文的完整流程：边提取边合并，然后生成最终总结"""
+    prompts = get_prompts("标准模式")
+    reducer = handler.create_reducer(prompts["merge_prompt"], batch_processor)
+    merged = await reducer.reduce_stream(
+        chunks,
+        lambda chunk: handler.process_text(chunk, prompts["extraction_prompt"])
+    )
+    return await limited(handler.process_text(merged, prompts["final_summary_prompt"]))
+
+
+async def run_papers(handler: AIHandler, papers: list, mode: str, workers: int, max_papers: int) -> dict:
+    """处理一批论文，返回整批耗时和每篇论文的完成时间"""
+    start = time.monotonic()
+    finished = []
+
+    async def timed(coroutine):
+        result = await coroutine
+        finished.append(time.monotonic() - start)
+        return result
+
+    if mode == "sequential":
+        async def direct(awaitable):
+            return await awaitable
+        for chunks in papers:
+            await timed(summarize_paper(handler, chunks, BatchProcessor(max_workers=workers), direct))
+    else:
+        scheduler = PaperScheduler(max_papers=max_papers, max_concurrent=workers)
+        await scheduler.run(
+            papers,
+            lambda chunks: timed(summarize_paper(handler, chunks, scheduler.batch_processor(), scheduler.limited))
+        )
+    return {"total": time.monotonic() - start, "mean_finish": statistics.mean(finished)}
+
+
+def benchmark_papers(handler: AIHandler, args):
+    """逐篇处理与多篇并发处理的整批耗时对比"""
+    rng = random.Random(args.seed)
+    # 论文长度不一：文本块数在 chunks/4 到 chunks 之间
+    sizes = [rng.randint(max(args.chunks // 4, 1), args.chunks) for _ in range(args.papers)]
+    results = {"sequential": [], "concurrent": []}
+    for run in range(args.runs):
+        for mode in results:
+            papers = [
+                make_chunks(size, args.chunk_chars, f"{mode}-{args.seed}-{run}-{index}-{time.time_ns()}")
+                for index, size in enumerate(sizes)
+            ]
+            results[mode].append(asyncio.run(run_papers(handler, papers, mode, args.workers, args.max_papers)))
+
+    print()
+    print(
+        f"论文: {args.papers} 篇（文本块数 {min(sizes)}-{max(sizes)}）, "
+        f"并发请求: {args.workers}, 同时处理论文: {args.max_papers}"
+    )
+    for mode, runs in results.items():
+        totals = [r["total"] for r in runs]
+        print(
+            f"{mode:10s} 整批耗时 中位数 {statistics.median(totals):6.2f}s  (各轮: {', '.join(f'{t:.2f}' for t in totals)})"
+            f"  平均完成时间 {statistics.median(r['mean_finish'] for r in runs):.2f}s"
+        )
+
+    sequential = statistics.median(r["total"] for r in results["sequential"])
+    concurrent = statistics.median(r["total"] for r in results["concurrent"])
+    print(f"concurrent 相对 sequential: {(concurrent - sequential) / sequential:+.1%}")
+
+
+async def run_adaptive(handler: AIHandler, chunks: list, mode: str, workers: int) -> dict:
+    """固定并发或自适应并发下完成所有文本块提取，返回耗时、失败数和并发数的变化"""
+    prompts = get_prompts("标准模式")
+    limiter = AdaptiveLimiter(ceiling=workers) if mode == "adaptive" else None
+    handler.concurrency_limiter = limiter
+    batch_processor = BatchProcessor(max_workers=workers, adaptive_limiter=limiter)
+
+    limits = []
+
+    async def sample():
+        while True:
+            limits.append(limiter.current_limit if limiter else workers)
+            await asyncio.sleep(0.1)
+
+    sampler = asyncio.ensure_future(sample())
+    start = time.monotonic()
+    try:
+        results = await batch_processor.process_batch(
+            chunks,
+            lambda chunk: handler.process_text(chunk, prompts["extraction_prompt"])
+        )
+    finally:
+        sampler.cancel()
+    return {
+        "total": time.monotonic() - start,
+        "failed": len(chunks) - len(results),
+        "mean_limit": statistics.mean(limits) if limits else workers,
+        "final_limit": limiter.current_limit if limiter else workers
+    }
+
+
+def benchmark_adaptive(args):
+    """模拟的提供商限制下，固定并发与自适应并发的耗时和429次数对比"""
+    results = {"fixed": [], "adaptive": []}
+    for run in range(args.runs):
+        for mode in results:
+            # 每轮使用新的模拟后端和密钥，RPM/TPM窗口和限流暂停不会影响下一轮
+            server = start_backend(args)
+            handler = AIHandler(
+                api_key=f"sk-benchmark-{mode}-{run}",
+                api_base=f"{server.base_url}/v1",
+                provider="openai"
+            )
+            chunks = make_chunks(args.chunks, args.chunk_chars, f"{mode}-{args.seed}-{run}-{time.time_ns()}")
+            try:
+                result = asyncio.run(run_adaptive(handler, chunks, mode, args.workers))
+            finally:
+                server.stop_thread()
+            stats = server.backend.get_stats()
+            result["rate_limited"] = stats.get("rate_limited", 0)
+            result["requests"] = stats.get("requests", 0)
+            results[mode].append(result)
+
+    print()
+    print(
+        f"文本块: {args.chunks} x {args.chunk_chars}字符, 并发上限: {args.workers}, "
+        f"提供商限制: 并发 {args.max_concurrency or '-'} / RPM {args.rpm or '-'} / TPM {args.tpm or '-'}"
+        f" / 排队阈值 {args.saturation or '-'}"
+    )
+    for mode, runs in results.items():
+        totals = [r["total"] for r in runs]
+        print(
+            f"{mode:8s} 耗时 中位数 {statistics.median(totals):6.2f}s  (各轮: {', '.join(f'{t:.2f}' for t in totals)})"
+            f"  429 {statistics.median(r['rate_limited'] for r in runs):.0f}/{statistics.median(r['requests'] for r in runs):.0f} 次请求"
+            f"  失败 {sum(r['failed'] for r in runs)}"
+            f"  平均并发 {statistics.median(r['mean_limit'] for r in runs):.1f}（结束时 {runs[-1]['final_limit']}）"
+        )
+
+    fixed = statistics.median(r["total"] for r in results["fixed"])
+    adaptive = statistics.median(r["total"] for r in results["adaptive"])
+    print(f"adaptive 相对 fixed: {(adaptive - fixed) / fixed:+.1%}")
+
+
+def benchmark_merge(handler: AIHandler, args):
+    """文本块阶段与合并阶段两种调度方式的关键路径对比"""
+    results = {"barrier": [], "stream": []}
+    for run in range(args.runs):
+        for mode in results:
+            chunks = make_chunks(args.chunks, args.chunk_chars, f"{mode}-{args.seed}-{run}-{time.time_ns()}")
+            results[mode].append(asyncio.run(run_once(handler, chunks, mode, args.workers, args.budget)))
+
+    print()
+    print(f"文本块: {args.chunks} x {args.chunk_chars}字符, 并发: {args.workers}, 合并预算: {args.budget} tokens")
+    for mode, runs in results.items():
+        totals = [r["total"] for r in runs]
+        line = f"{mode:8s} 关键路径 中位数 {statistics.median(totals):6.2f}s  (各轮: {', '.join(f'{t:.2f}' for t in totals)})"
+        maps = [r["map"] for r in runs if r["map"] is not None]
+        if maps:
+            line += f"  文本块阶段 {statistics.median(maps):.2f}s"
+        print(line)
+        print(f"{'':8s} 合并树: {runs[-1]['levels']}")
+
+    barrier = statistics.median(r["total"] for r in results["barrier"])
+    stream = statistics.median(r["total"] for r in results["stream"])
+    print(f"stream 相对 barrier: {(stream - barrier) / barrier:+.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文本块总结/合并调度基准测试")
+    parser.add_argument("--chunks", type=int, default=48, help="每篇论文的文本块数")
+    parser.add_argument("--chunk-chars", type=int, default=2000, help="每个文本块的字符数")
+    parser.add_argument("--workers", type=int, default=8, help="最大并发请求数")
+    parser.add_argument("--budget", type=int, default=3000, help="单次合并的输入token预算（较小的预算模拟长论文的多层合并）")
+    parser.add_argument("--runs", type=int, default=3, help="每种方式运行的次数")
+    parser.add_argument("--latency", type=float, default=1.0, help="模拟后端的首token延迟中位数（秒）")
+    parser.add_argument("--sigma", type=float, default=1.0, help="延迟对数正态分布的sigma（越大长尾越明显）")
+    parser.add_argument("--tps", type=float, default=200.0, help="模拟后端的输出速度（token/秒）")
+    parser.add_argument("--output-ratio", type=float, default=0.4, help="模拟后端的输出/输入token比例")
+    parser.add_argument("--papers", type=int, default=0, help="论文篇数（大于0时比较逐篇处理与多篇并发处理）")
+    parser.add_argument("--max-papers", type=int, default=3, help="同时处理的论文数")
+    parser.add_argument("--adaptive", action="store_true", help="比较固定并发与自适应并发")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="模拟后端的最大并发数（超出返回429，0为不限制）")
+    parser.add_argument("--rpm", type=int, default=0, help="模拟后端的每分钟请求数限制（0为不限制）")
+    parser.add_argument("--tpm", type=int, default=0, help="模拟后端的每分钟token数限制（0为不限制）")
+    parser.add_argument("--saturation", type=int, default=0, help="模拟后端超过该并发数后延迟成比例增加（0为不限制）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.adaptive:
+        benchmark_adaptive(args)
+        return
+
+    server = start_backend(args)
+    handler = AIHandler(api_key="sk-benchmark", api_base=f"{server.base_url}/v1", provider="openai")
+
+    try:
+        if args.papers > 0:
+            benchmark_papers(handler, args)
+        else:
+            benchmark_merge(handler, args)
+    finally:
+        server.stop_thread()
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,386 @@
+"""命令行批处理（无需浏览器）
+
+处理目录或通配符匹配的全部论文，把总结（Markdown）、思维导图和清单（manifest.json）写入输出目录。
+文本提取、LLM总结、思维导图渲染分阶段重叠进行（与界面的多篇论文处理相同），
+输出已是最新（文件内容和处理设置都未变化）的论文直接跳过，适合定时任务反复运行。
+
+运行方式:
+    python cli.py papers/ -o output --mode 标准模式 --max-papers 4 --workers 8
+    python cli.py "papers/**/*.pdf" -o output --provider deepseek --extract-workers 4
+
+API密钥通过 --api-key 或环境变量（OPENAI_API_KEY / DEEPSEEK_API_KEY）提供。
+"""
+import argparse
+import asyncio
+import glob
+import io
+import json
+import os
+import sys
+import time
+from dotenv import load_dotenv
+from config import APIConfig, PDFConfig
+from prompts import TARGET_LENGTHS
+from utils.deadline import Deadline
+from utils.document_cache import DocumentCache
+from utils.exceptions import APIAuthError, APIQuotaError
+from utils.openai_handler import AIHandler
+from utils.pipeline import StagedPipeline
+from utils.rate_limiter import estimate_tokens
+from utils.scheduler import PaperScheduler, set_job_cost
+from utils.summarizer import DocumentSummarizer, compose_summary, render_mindmap
+from utils.usage import merge_usage
+
+SUPPORTED_EXTENSIONS = (".pdf", ".doc", ".docx")
+MANIFEST_NAME = "manifest.json"
+MANIFEST_SAVE_INTERVAL = 5.0  # 清单写入间隔（秒），中断后已完成的论文不会重复处理
+PROGRESS_INTERVAL = 5.0  # 打印每篇论文进度统计的间隔（秒）
+
+
+def collect_files(inputs: list) -> list:
+    """展开目录和通配符，返回 (源文件路径, 相对于输入根目录的路径) 列表"""
+    files = {}
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            root = pattern
+            paths = glob.glob(os.path.join(pattern, "**", "*"), recursive=True)
+        else:
+            # 第一个通配符之前的目录作为输出路径的根目录
+            parts = pattern.split(os.sep)
+            magic = [i for i, part in enumerate(parts) if glob.has_magic(part)]
+            root = os.sep.join(parts[:magic[0] if magic else len(parts) - 1])
+            paths = glob.glob(pattern, recursive=True)
+        for path in paths:
+            if os.path.isfile(path) and os.path.splitext(path)[1].lower() in SUPPORTED_EXTENSIONS:
+                files.setdefault(os.path.abspath(path), os.path.relpath(path, root or "."))
+    return sorted(files.items(), key=lambda item: item[1])
+
+
+class Manifest:
+    """输出目录中的处理清单：记录每个源文件的内容哈希、处理设置和输出文件"""
+
+    def __init__(self, output_dir: str):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f).get("files", {})
+        self.output_dir = output_dir
+        self._saved = 0.0
+
+    def up_to_date(self, source: str, settings: dict, document_key: str = None) -> bool:
+        """输出是否已是最新：未给出document_key时只比较文件大小和修改时间（不读取文件）"""
+        entry = self.entries.get(source)
+        if not entry or entry.get("status") != "done" or entry.get("settings") != settings:
+            return False
+        outputs = [entry.get("summary")] + ([entry["mindmap"]] if entry.get("mindmap") else [])
+        if not all(os.path.exists(os.path.join(self.output_dir, output)) for output in outputs):
+            return False
+        if document_key is not None:
+            return entry.get("document_key") == document_key
+        stat = os.stat(source)
+        return entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime_ns
+
+    def update(self, source: str, **fields):
+        stat = os.stat(source)
+        entry = self.entries.setdefault(source, {})
+        entry.update(fields, size=stat.st_size, mtime=stat.st_mtime_ns, updated=time.time())
+        if time.monotonic() - self._saved >= MANIFEST_SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        """先写临时文件再替换，中断时不会留下损坏的清单"""
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"updated": time.time(), "files": self.entries}, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+        self._saved = time.monotonic()
+
+
+class BatchRunner:
+    """无界面的多篇论文流水线：提取（线程池） -> 总结（共享全局并发限制） -> 渲染（线程池）"""
+
+    def __init__(self, handler: AIHandler, args):
+        self.handler = handler
+        self.args = args
+        self.manifest = Manifest(args.output)
+        self.document_cache = None if args.no_cache else DocumentCache()
+        self.scheduler = PaperScheduler(
+            max_papers=args.max_papers,
+            max_concurrent=args.workers,
+            adaptive_limiter=handler.concurrency_limiter
+        )
+        self.settings = {
+            "provider": args.provider,
+            "model": APIConfig.get_config(args.provider)["model"],
+            "mode": args.mode,
+            "chunk_size": args.chunk_size,
+            "overlap_size": PDFConfig.OVERLAP_SIZE
+        }
+        self.stats = {"total": 0, "skipped": 0, "cached": 0, "done": 0, "failed": 0, "bytes": 0}
+        self.stage_time = {"extract": 0.0, "summarize": 0.0, "render": 0.0}
+        self.usage = []
+
+    def create_summarizer(self, deadline: Deadline = None) -> DocumentSummarizer:
+        return DocumentSummarizer(
+            self.handler,
+            mode=self.args.mode,
+            provider=self.args.provider,
+            chunk_size=self.args.chunk_size,
+            max_concurrent=self.args.workers,
+            scheduler=self.scheduler,
+            deadline=deadline
+        )
+
+    def output_paths(self, relpath: str) -> tuple:
+        """输出文件保持源目录结构：<输出目录>/<相对路径去掉扩展名>.md / .png"""
+        stem = os.path.splitext(relpath)[0]
+        return f"{stem}.md", f"{stem}.png"
+
+    def fail(self, paper: dict, e: Exception):
+        """单篇论文失败记入清单，不影响其他论文；密钥无效、配额不足终止整批"""
+        print(f"[失败] {paper['relpath']}: {str(e)}")
+        self.stats["failed"] += 1
+        self.manifest.update(paper["source"], status="failed", error=str(e), settings=self.settings)
+        if isinstance(e, (APIAuthError, APIQuotaError)):
+            raise e
+
+    def stage(self, name: str, func):
+        """包装流水线阶段：累计各阶段耗时，单篇论文的错误不影响其他论文"""
+        async def run(paper):
+            start = time.monotonic()
+            try:
+                return await func(paper)
+            except Exception as e:
+                self.fail(paper, e)
+                return None
+            finally:
+                self.stage_time[name] += time.monotonic() - start
+        return run
+
+    async def extract(self, paper: dict):
+        loop = asyncio.get_running_loop()
+        with open(paper["source"], "rb") as f:
+            data = await loop.run_in_executor(None, f.read)
+        self.stats["bytes"] += len(data)
+        file = io.BytesIO(data)
+        file.name = os.path.basename(paper["source"])
+        paper["file"] = file
+
+        summarizer = self.create_summarizer(paper["deadline"])
+        paper["document_key"] = summarizer.document_key(file)
+        # 修改时间变了但内容和设置未变（如重新拷贝）时同样跳过
+        if not self.args.force and self.manifest.up_to_date(paper["source"], self.settings, paper["document_key"]):
+            self.stats["skipped"] += 1
+            self.manifest.update(paper["source"])
+            return None
+
+        cached = self.document_cache.get(paper["document_key"]) if self.document_cache and not self.args.force else None
+        if cached:
+            self.stats["cached"] += 1
+            paper.update({"final_summary": cached["final_summary"], "path": cached.get("path"), "usage": None})
+            paper["mindmap"] = cached.get("mindmap") if cached.get("filename") == file.name else None
+            paper["cached"] = True
+            return paper
+
+        print(f"[提取] {paper['relpath']}")
+        paper["text_chunks"] = await summarizer.extract(file.name, file)
+        paper["cost"] = sum(estimate_tokens(chunk) for chunk in paper["text_chunks"])
+        return paper
+
+    async def summarize(self, paper: dict):
+        if paper.get("cached"):
+            return paper
+        print(f"[总结] {paper['relpath']}（{len(paper['text_chunks'])} 个文本块）")
+        # 短论文的请求在全局并发限制中优先
+        set_job_cost(paper["cost"])
+        result = await self.create_summarizer(paper["deadline"]).summarize(
+            paper["file"].name,
+            paper["text_chunks"],
+            self.progress_reporter(paper["relpath"])
+        )
+        paper.update(result)
+        self.usage.append(result["usage"])
+        return paper
+
+    @staticmethod
+    def progress_reporter(relpath: str):
+        """每隔PROGRESS_INTERVAL秒打印论文的进度统计（完成、失败、重试中、进行中、吞吐、延迟、预计剩余时间）"""
+        printed_at = 0.0
+
+        def report(stage: str, message: str, progress: float = None):
+            nonlocal printed_at
+            if stage == "dropped":
+                print(f"[警告] {relpath} {message}")
+            elif progress is not None and (time.monotonic() - printed_at >= PROGRESS_INTERVAL or progress >= 1):
+                printed_at = time.monotonic()
+                print(f"[进度] {relpath} {message}")
+        return report
+
+    async def render(self, paper: dict):
+        filename = paper["file"].name
+        complete_summary = compose_summary(filename, paper["final_summary"])
+        summary_path, mindmap_path = self.output_paths(paper["relpath"])
+        os.makedirs(os.path.dirname(os.path.join(self.args.output, summary_path)), exist_ok=True)
+        with open(os.path.join(self.args.output, summary_path), "w", encoding="utf-8") as f:
+            f.write(complete_summary)
+
+        mindmap_image = paper.get("mindmap")
+        if mindmap_image is None and not self.args.no_mindmap:
+            loop = asyncio.get_running_loop()
+            try:
+                mindmap_image = await loop.run_in_executor(None, render_mindmap, complete_summary)
+            except Exception as e:
+                print(f"[警告] {paper['relpath']} 思维导图生成失败: {str(e)}")
+        if mindmap_image:
+            with open(os.path.join(self.args.output, mindmap_path), "wb") as f:
+                f.write(mindmap_image)
+
+        # 有文本块被丢弃的不完整结果不写入整篇文档缓存
+        if self.document_cache and not paper.get("cached") and not paper["usage"].get("dropped_chunks"):
+            self.document_cache.put(paper["document_key"], {
+                "filename": filename,
+                "final_summary": paper["final_summary"],
+                "mindmap": mindmap_image,
+                "path": paper["path"],
+                "usage": paper["usage"]
+            })
+
+        usage = paper.get("usage") or {}
+        self.manifest.update(
+            paper["source"],
+            status="done",
+            error=None,
+            settings=self.settings,
+            document_key=paper["document_key"],
+            summary=summary_path,
+            mindmap=mindmap_path if mindmap_image else None,
+            path=paper.get("path"),
+            cached=bool(paper.get("cached")),
+            tokens=usage.get("total_tokens", 0),
+            dropped_chunks=usage.get("dropped_chunks", 0),
+            cost=usage.get("cost", 0.0)
+        )
+        self.stats["done"] += 1
+        print(f"[完成] {paper['relpath']} -> {summary_path}")
+        return paper
+
+    async def run(self, files: list):
+        papers = []
+        for source, relpath in files:
+            self.stats["total"] += 1
+            # 大小、修改时间和设置都未变的文件不读取、不解析
+            if not self.args.force and self.manifest.up_to_date(source, self.settings):
+                self.stats["skipped"] += 1
+                continue
+            # 每篇论文的处理时限（提取和总结共用，不含排队等待的时间）
+            papers.append({"source": source, "relpath": relpath, "deadline": Deadline(self.args.timeout or None)})
+
+        pipeline = StagedPipeline(queue_size=self.args.queue_size)
+        pipeline.add_stage(
+            "extract",
+            self.stage("extract", self.extract),
+            workers=self.args.extract_workers,
+            priority=lambda paper: os.path.getsize(paper["source"])
+        )
+        pipeline.add_stage(
+            "summarize",
+            self.stage("summarize", self.summarize),
+            workers=self.args.max_papers,
+            priority=lambda paper: paper.get("cost", 0)
+        )
+        pipeline.add_stage("render", self.stage("render", self.render), workers=self.args.render_workers)
+        try:
+            await pipeline.run(papers)
+        finally:
+            self.manifest.save()
+
+    def print_stats(self, elapsed: float):
+        stats = self.stats
+        usage = merge_usage(self.usage)
+        processed = stats["done"] + stats["failed"]
+        print()
+        dropped = sum(summary.get("dropped_chunks", 0) for summary in self.usage)
+        print(
+            f"文件: {stats['total']}  完成: {stats['done']}（整篇缓存 {stats['cached']}）  "
+            f"跳过（已是最新）: {stats['skipped']}  失败: {stats['failed']}"
+            + (f"  丢弃文本块: {dropped}" if dropped else "")
+        )
+        print(
+            f"耗时: {elapsed:.1f}s  吞吐: {processed / elapsed * 60 if elapsed else 0:.1f} 篇/分钟  "
+            f"读取: {stats['bytes'] / 1024 / 1024:.1f}MB"
+        )
+        print(
+            f"API调用: {usage['calls']} 次  tokens: 输入 {usage['prompt_tokens']} / 输出 {usage['completion_tokens']}  "
+            f"({usage['total_tokens'] / elapsed if elapsed else 0:.0f} tokens/s)  预估费用: ${usage['cost']:.4f}"
+        )
+        # 各阶段累计耗时之和大于总耗时的部分即为阶段重叠节省的时间
+        busy = "  ".join(f"{name} {seconds:.1f}s" for name, seconds in self.stage_time.items())
+        print(f"阶段累计耗时: {busy}  （合计 {sum(self.stage_time.values()):.1f}s）")
+        if self.handler.concurrency_limiter:
+            concurrency = self.handler.concurrency_limiter.snapshot()
+            print(
+                f"自适应并发: 当前 {concurrency['limit']}（上限 {min(concurrency['ceiling'], self.args.workers)}）  "
+                f"增加 {concurrency.get('increases', 0)} 次  退避 {concurrency.get('decreases', 0)} 次  "
+                f"（429 {concurrency.get('throttled', 0)} 次，延迟突增 {concurrency.get('latency_spikes', 0)} 次）"
+            )
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="论文批量总结（命令行）")
+    parser.add_argument("inputs", nargs="+", help="论文目录或通配符（如 \"papers/**/*.pdf\"）")
+    parser.add_argument("-o", "--output", default="output", help="输出目录（总结、思维导图和manifest.json）")
+    parser.add_argument("--provider", choices=APIConfig.PROVIDERS, default="openai")
+    parser.add_argument("--api-key", help="API密钥（默认读取 <PROVIDER>_API_KEY 环境变量）")
+    parser.add_argument("--api-base", help="API地址（默认读取 <PROVIDER>_API_BASE 环境变量或配置）")
+    parser.add_argument("--mode", choices=list(TARGET_LENGTHS), default="标准模式", help="总结模式")
+    parser.add_argument("--chunk-size", type=int, default=PDFConfig.CHUNK_SIZE, help="文本块大小")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=APIConfig.ADAPTIVE_MAX_CONCURRENT,
+        help="最大并发API请求数（所有论文共享；自适应并发在此范围内调整）"
+    )
+    parser.add_argument("--no-adaptive", action="store_true", help="固定使用--workers的并发数，不根据延迟和429调整")
+    parser.add_argument("--max-papers", type=int, default=APIConfig.MAX_CONCURRENT_PAPERS, help="同时总结的论文数")
+    parser.add_argument("--extract-workers", type=int, default=PDFConfig.EXTRACT_WORKERS, help="同时提取文本的文件数")
+    parser.add_argument("--render-workers", type=int, default=1, help="同时生成思维导图的论文数")
+    parser.add_argument("--queue-size", type=int, default=APIConfig.PIPELINE_QUEUE_SIZE, help="阶段之间的队列长度")
+    parser.add_argument("--timeout", type=float, default=PDFConfig.TIMEOUT, help="单篇论文的处理时限（秒，0为不限时）")
+    parser.add_argument("--no-mindmap", action="store_true", help="不生成思维导图")
+    parser.add_argument("--no-cache", action="store_true", help="不使用整篇文档缓存")
+    parser.add_argument("--force", action="store_true", help="忽略清单和缓存，全部重新处理")
+    args = parser.parse_args()
+
+    api_key = args.api_key or os.getenv(f"{args.provider.upper()}_API_KEY")
+    if not api_key:
+        parser.error(f"缺少API密钥：请使用 --api-key 或设置 {args.provider.upper()}_API_KEY")
+    api_base = args.api_base or os.getenv(f"{args.provider.upper()}_API_BASE") or APIConfig.get_config(args.provider)["api_base"]
+
+    files = collect_files(args.inputs)
+    if not files:
+        print("没有找到可处理的文件（支持 PDF、Word）")
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+
+    handler = AIHandler(api_key=api_key, api_base=api_base, provider=args.provider)
+    if args.no_adaptive:
+        handler.concurrency_limiter = None
+    runner = BatchRunner(handler, args)
+    start = time.monotonic()
+    try:
+        asyncio.run(runner.run(files))
+    except (APIAuthError, APIQuotaError) as e:
+        print(f"批处理终止: {str(e)}")
+        return 1
+    except KeyboardInterrupt:
+        print("已中断，已完成的论文记录在清单中，再次运行时跳过")
+        return 130
+    finally:
+        runner.print_stats(time.monotonic() - start)
+    return 1 if runner.stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
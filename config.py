@@ -2,18 +2,84 @@ class APIConfig:
     """API配置"""
     # 并发设置
     MAX_CONCURRENT = 5
+    MAX_CONCURRENT_PAPERS = 3  # 同时处理的论文数（所有论文共享MAX_CONCURRENT的请求并发）
+    PIPELINE_QUEUE_SIZE = 2  # 流水线阶段之间的队列长度（如已提取文本、等待总结的论文数上限）
+    GLOBAL_MAX_CONCURRENT = 10  # 同一API密钥下所有会话合计的最大并发请求数
+    PRIORITY_AGING_RATE = 200  # 排队每秒相当于预估成本减少的token数（防止长论文一直等待）
+    # 自适应并发（AIMD）：延迟稳定且没有429时逐步增加并发，触发限流或延迟突增时按比例减少；
+    # 同一API密钥在进程内共享，界面滑块/命令行--workers的并发数作为上限
+    ADAPTIVE_CONCURRENCY = True
+    ADAPTIVE_INITIAL_CONCURRENT = MAX_CONCURRENT  # 初始并发数（慢启动：每个成功请求加1，直到第一次退避）
+    ADAPTIVE_MAX_CONCURRENT = 20  # 自适应并发的上限
+    ADAPTIVE_BACKOFF = 0.7  # 触发限流或延迟突增时并发数乘以该系数
+    ADAPTIVE_LATENCY_TOLERANCE = 2.0  # 近期延迟超过长期基线的倍数时视为延迟突增
     MAX_RETRIES = 3
-    RETRY_DELAY = 0.5  # 秒
+    RETRY_DELAY = 0.5  # 秒，指数退避的基础等待时间
+    RETRY_MAX_DELAY = 30.0  # 秒，单次退避等待的上限
+    
+    # 速率限制（同一提供商、同一API密钥在进程内共享）
+    RATE_LIMIT_BACKOFF = 5.0  # 429响应未携带Retry-After时的默认等待时间（秒）
+    
+    # 连接池设置（进程内按 提供商+地址+密钥 共享客户端）
+    POOL_MAX_CONNECTIONS = 20  # 最大连接数
+    POOL_MAX_KEEPALIVE = 10  # 最大保持活动的空闲连接数
+    POOL_KEEPALIVE_EXPIRY = 120.0  # 空闲连接保持时间（秒）
+    ENABLE_HTTP2 = False  # 是否启用HTTP/2（需要安装h2）
+    REQUEST_TIMEOUT = 120.0  # 单次请求超时时间（秒）
+    
+    # 离线批处理（Batch API）
+    BATCH_COLLECT_IDLE = 1.0  # 无新请求超过该时间（秒）后提交批处理任务
+    BATCH_POLL_INTERVAL = 30.0  # 轮询批处理任务状态的间隔（秒）
+    BATCH_COMPLETION_WINDOW = "24h"
+    BATCH_COST_MULTIPLIER = 0.5  # Batch API的价格折扣
+    
+    # 后台任务（断点续传），见 utils/job_worker.py
+    JOB_POLL_INTERVAL = 2.0  # 后台任务执行器检查队列的间隔（秒）
+    JOB_UI_REFRESH = 1.0  # 有进行中的任务时，界面自动刷新任务状态的间隔（秒）
+    JOB_MAX_ATTEMPTS = 3  # 后台任务最多执行的次数，多次中断（如处理时进程崩溃）的任务重启后不再自动恢复
+    
+    # 请求录制/回放（回归测试）
+    CASSETTE_DIR = "cassettes"  # 录制文件目录
+    
+    # 多提供商路由
+    PROVIDERS = ["openai", "deepseek"]
+    ROUTING_WEIGHTS = {"openai": 1.0, "deepseek": 1.0}  # 请求分配权重
+    HEDGE_ENABLED = False  # 是否启用对冲请求
+    HEDGE_MIN_DELAY = 2.0  # 对冲请求的最小等待时间（秒）
+    HEDGE_MIN_SAMPLES = 10  # 延迟样本数达到该值后才启用对冲
+    LATENCY_WINDOW = 100  # 延迟统计的滚动窗口大小
+    
+    # 分层合并
+    MERGE_INPUT_BUDGET = 12000  # 单次合并请求的输入token预算（决定每次合并的总结数量）
+    MERGE_MIN_FAN_IN = 2  # 每次合并至少包含的总结数量
+    
+    # 输出token预算（见 utils/budget.py）
+    CHUNK_OUTPUT_MIN = 300  # 单个文本块总结的最小输出预算
+    CHUNK_OUTPUT_MAX = 1200  # 单个文本块总结的最大输出预算
+    OUTPUT_HEADROOM = 1.25  # 目标长度之上预留的余量
+    TRUNCATION_RETRIES = 1  # 输出被截断时放大预算重试的次数
+    
+    # 短文档快速路径：整篇文档能放进一次请求时跳过分块、合并和最终总结
+    FAST_PATH_ENABLED = True
+    FAST_PATH_MAX_TOKENS = 16000  # 单次总结的最大输入token数（另受上下文窗口限制）
     
     # OpenAI配置
     OPENAI_MODEL = "gpt-4o-mini"
     OPENAI_TEMPERATURE = 0.7
     OPENAI_MAX_TOKENS = 4096
+    OPENAI_RPM = 500  # 每分钟请求数
+    OPENAI_TPM = 200000  # 每分钟token数
+    OPENAI_CONTEXT_WINDOW = 128000  # 上下文窗口（token）
+    OPENAI_PRICING = {"input": 0.15, "cached_input": 0.075, "output": 0.60}  # 美元/百万token
     
     # DeepSeek配置
     DEEPSEEK_MODEL = "deepseek-chat"
     DEEPSEEK_TEMPERATURE = 1.0
     DEEPSEEK_MAX_TOKENS = 4096
+    DEEPSEEK_RPM = 300
+    DEEPSEEK_TPM = 300000
+    DEEPSEEK_CONTEXT_WINDOW = 64000
+    DEEPSEEK_PRICING = {"input": 0.27, "cached_input": 0.07, "output": 1.10}
     
     @staticmethod
     def get_config(provider: str) -> dict:
@@ -23,6 +89,11 @@ class APIConfig:
                 "model": APIConfig.OPENAI_MODEL,
                 "temperature": APIConfig.OPENAI_TEMPERATURE,
                 "max_tokens": APIConfig.OPENAI_MAX_TOKENS,
+                "rpm": APIConfig.OPENAI_RPM,
+                "tpm": APIConfig.OPENAI_TPM,
+                "context_window": APIConfig.OPENAI_CONTEXT_WINDOW,
+                "pricing": APIConfig.OPENAI_PRICING,
+                "batch_api": True,
                 "api_base": "https://api.openai.com/v1"
             }
         elif provider == "deepseek":
@@ -30,6 +101,11 @@ class APIConfig:
                 "model": APIConfig.DEEPSEEK_MODEL,
                 "temperature": APIConfig.DEEPSEEK_TEMPERATURE,
                 "max_tokens": APIConfig.DEEPSEEK_MAX_TOKENS,
+                "rpm": APIConfig.DEEPSEEK_RPM,
+                "tpm": APIConfig.DEEPSEEK_TPM,
+                "context_window": APIConfig.DEEPSEEK_CONTEXT_WINDOW,
+                "pricing": APIConfig.DEEPSEEK_PRICING,
+                "batch_api": False,
                 "api_base": "https://api.deepseek.com/v1"
             }
         else:
@@ -39,6 +115,8 @@ class PDFConfig:
     """PDF处理配置"""
     # 文本处理
     CHUNK_SIZE = 2000
+    TOKENS_PER_PAGE = 800  # 提取文本前按页数估算论文的token数
+    EXTRACT_WORKERS = 2  # 同时提取文本的文件数（在线程池中执行，不阻塞API请求）
     OVERLAP_SIZE = 150
     MIN_SENTENCE_LENGTH = 10
     MIN_PARAGRAPH_LENGTH = 40
@@ -65,7 +143,7 @@ class PDFConfig:
     # 处理限制
     MAX_PAGES = 100  # 最大处理页数
     MAX_FILE_SIZE = 50 * 1024 * 1024  # 最大文件大小（50MB）
-    TIMEOUT = 300  # 处理超时时间（秒）
+    TIMEOUT = 300  # 单篇论文的处理时限（秒，不含排队和等待并发名额的时间），超时后取消剩余的请求，见 utils/deadline.py
 
 class UIConfig:
     """界面配置"""
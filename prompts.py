@@ -1,5 +1,44 @@
 from typing import Dict
 
+# 提示词只包含静态指令，不包含待处理的文本。
+# 请求时提示词作为system消息放在最前面，文本作为最后的user消息，
+# 同一模式下的所有请求因此共享字节一致的前缀，可以命中提供商的上下文缓存。
+
+# 文本块信息提取提示词（与总结模式无关）
+# 文本块阶段和合并阶段只做中立、详尽的信息提取，结果按文本内容缓存，
+# 不同总结模式都从同一份提取结果生成，切换模式时只需重新生成最终总结。
+EXTRACTION_PROMPT = """
+# Role: Academic Reading Assistant
+You are a senior academic researcher skilled at extracting information from papers.
+
+## Core Tasks
+Extract all substantive information from the given part of a paper:
+1. Research context
+   - Background, motivation and research problems
+   - Related work mentioned and its limitations
+2. Methods
+   - Theoretical foundation and technical approach
+   - Model/system architecture and implementation details
+   - Experimental setup, datasets and baselines
+3. Results
+   - Key findings with concrete numbers and comparisons
+   - Ablations and analyses
+4. Discussion
+   - Contributions and innovations claimed
+   - Limitations, applications and future directions
+
+## Requirements
+- Be faithful to the text; do not add information that is not in it
+- Keep technical terms, numbers and names exactly
+- Use concise bullet points grouped under the headings above
+- Omit headings for which the text has no information
+- Do not write an introduction or conclusion of your own
+
+## Output
+- Please provide the response in Simplified Chinese.
+- The text to process is given in the user message.
+"""
+
 # 简洁模式提示词
 CONCISE_SUMMARY_PROMPT = """
 # Role: Academic Reading Assistant
@@ -28,10 +67,9 @@ You are a senior academic researcher skilled at creating concise paper summaries
 - Keep total length around 800 words
 - Ensure logical flow between sections
 
-Input Text:
-{text}
-
-Please provide the response in Simplified Chinese.
+## Output
+- Please provide the response in Simplified Chinese.
+- The text to process is given in the user message.
 """
 
 # 标准模式提示词
@@ -65,10 +103,9 @@ You are a senior academic researcher skilled at creating comprehensive paper sum
 - Keep total length around 1500 words
 - Use clear section transitions
 
-Input Text:
-{text}
-
-Please provide the response in Simplified Chinese.
+## Output
+- Please provide the response in Simplified Chinese.
+- The text to process is given in the user message.
 """
 
 # 详细模式提示词
@@ -109,10 +146,9 @@ You are a senior academic researcher skilled at creating in-depth paper summarie
 - Keep total length around 2500 words
 - Maintain academic style
 
-Input Text:
-{text}
-
-Please provide the response in Simplified Chinese.
+## Output
+- Please provide the response in Simplified Chinese.
+- The text to process is given in the user message.
 """
 
 # 合并提示词
@@ -141,44 +177,24 @@ You are a senior academic researcher skilled at merging multiple summaries.
 - Remove duplicated content
 - Preserve academic rigor
 
-Input Text:
-{text}
-
-Please provide the response in Simplified Chinese.
+## Output
+- Please provide the response in Simplified Chinese.
+- The text to process is given in the user message.
 """
 
-# 最终总结提示词
-FINAL_SUMMARY_PROMPT = """
-# Role: Academic Reading Assistant
-You are a senior academic researcher skilled at creating final summaries.
+# 各模式最终总结的目标长度（输出token数），用于规划各阶段的max_tokens
+TARGET_LENGTHS = {
+    "简洁模式": 1200,
+    "标准模式": 2200,
+    "详细模式": 3600
+}
 
-## Core Tasks
-1. Overall Research Summary
-   - Research background and motivation
-   - Core innovations and contributions
-   - Key findings and results
-
-2. Value Analysis
-   - Theoretical significance
-   - Practical applications
-   - Research impact
-
-3. Future Outlook
-   - Research directions
-   - Potential improvements
-   - Extended applications
-
-## Requirements
-- Focus on key contributions
-- Highlight practical value
-- Keep language clear and concise
-- Total length around 1000 words
-
-Input Text:
-{text}
+# 合并后的提取结果的目标长度（与模式无关，需足够支撑详细模式）
+EXTRACTION_TARGET_LENGTH = 3000
 
-Please provide the response in Simplified Chinese.
-"""
+def get_target_length(mode: str) -> int:
+    """获取模式对应的目标输出长度（token）"""
+    return TARGET_LENGTHS.get(mode, TARGET_LENGTHS["标准模式"])
 
 def get_summary_prompt(mode: str) -> str:
     """根据模式获取对应的总结提示词"""
@@ -193,6 +209,7 @@ def get_prompts(mode: str = "标准模式") -> Dict[str, str]:
     """获取提示词集合"""
     return {
         "summary_prompt": get_summary_prompt(mode),
+        "extraction_prompt": EXTRACTION_PROMPT,
         "merge_prompt": MERGE_PROMPT,
-        "final_summary_prompt": FINAL_SUMMARY_PROMPT
+        "final_summary_prompt": get_summary_prompt(mode)
     } 
\ No newline at end of file
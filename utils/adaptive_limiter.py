@@ -0,0 +1,178 @@
+from typing import Any, Dict, Optional, Tuple
+from collections import Counter, deque
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from config import APIConfig
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    """自适应并发限制（AIMD）
+
+    - 加性增加：请求成功、没有限流且延迟稳定时增加并发数。慢启动阶段每个成功请求加1，
+      第一次退避之后每个成功请求加 1/当前并发数（约每轮请求加1）；只在并发名额用满时增加。
+    - 乘性减少：收到429或近期延迟超过长期基线的ADAPTIVE_LATENCY_TOLERANCE倍时，
+      并发数乘以ADAPTIVE_BACKOFF；同一波请求的多个429只退避一次（冷却时间约为一次请求的耗时）。
+    延迟按输出token数归一化（每token耗时），长输出的合并请求不会被误判为延迟突增。
+    使用线程锁保护状态，不绑定事件循环，可以在多个会话（线程）之间共享。
+    """
+
+    SHORT_WEIGHT = 0.3  # 近期延迟的EWMA权重
+    LONG_WEIGHT_DOWN = 0.05  # 长期延迟基线的EWMA权重（延迟下降时）
+    LONG_WEIGHT_UP = 0.01  # 延迟上升时基线跟随得更慢，并发逐步增加导致的排队也能被识别
+    MIN_TOKENS = 100  # 归一化时输出token数的下限（短输出以首token延迟为主）
+    MIN_COOLDOWN = 1.0  # 两次退避之间的最短间隔（秒）
+
+    def __init__(
+        self,
+        ceiling: int = APIConfig.ADAPTIVE_MAX_CONCURRENT,
+        initial: int = APIConfig.ADAPTIVE_INITIAL_CONCURRENT,
+        backoff: float = APIConfig.ADAPTIVE_BACKOFF,
+        tolerance: float = APIConfig.ADAPTIVE_LATENCY_TOLERANCE
+    ):
+        self.ceiling = max(ceiling, 1)
+        self.limit = float(min(max(initial, 1), self.ceiling))
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.slow_start = True
+        self.in_flight = 0
+        self.latency: Optional[float] = None  # 请求耗时的EWMA（秒），用于退避冷却时间
+        self.recent: Optional[float] = None  # 近期每token耗时
+        self.baseline: Optional[float] = None  # 长期每token耗时基线
+        self.decreased_at = 0.0
+        self.stats = Counter()
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def current_limit(self) -> int:
+        """当前允许的并发请求数"""
+        return max(int(self.limit), 1)
+
+    def _dispatch(self):
+        """按等待顺序分配空闲名额（调用方持有锁）"""
+        while self._waiters and self.in_flight < self.current_limit:
+            waiter = self._waiters.popleft()
+            self.in_flight += 1
+            waiter["granted"] = True
+            waiter["loop"].call_soon_threadsafe(_wake, waiter["future"])
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        waiter = {"future": loop.create_future(), "loop": loop, "granted": False}
+        with self._lock:
+            self._waiters.append(waiter)
+            self._dispatch()
+        try:
+            await waiter["future"]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter["granted"]:
+                    self._release()
+                else:
+                    self._waiters.remove(waiter)
+            raise
+
+    def try_acquire(self) -> bool:
+        """有空闲名额且没有排队的请求时立即占用（不等待），否则返回False"""
+        with self._lock:
+            if self._waiters or self.in_flight >= self.current_limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def release(self):
+        with self._lock:
+            self._release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def record_success(self, latency: float, completion_tokens: int = 0):
+        """记录一次成功请求的耗时：延迟稳定时增加并发，延迟突增时退避"""
+        sample = latency / max(completion_tokens or 0, self.MIN_TOKENS)
+        with self._lock:
+            self.stats["requests"] += 1
+            if self.baseline is None:
+                self.latency, self.recent, self.baseline = latency, sample, sample
+            else:
+                self.latency += self.SHORT_WEIGHT * (latency - self.latency)
+                self.recent += self.SHORT_WEIGHT * (sample - self.recent)
+                weight = self.LONG_WEIGHT_UP if sample > self.baseline else self.LONG_WEIGHT_DOWN
+                self.baseline += weight * (sample - self.baseline)
+
+            if self.recent > self.baseline * self.tolerance:
+                self.stats["latency_spikes"] += 1
+                self._decrease("延迟突增")
+            elif self._waiters or self.in_flight >= self.current_limit:
+                # 只在名额用满（请求量足够）时增加，避免空闲时并发数无限增长
+                previous = self.current_limit
+                self.limit = min(self.limit + (1 if self.slow_start else 1 / self.limit), self.ceiling)
+                if self.current_limit > previous:
+                    self.stats["increases"] += 1
+                    self._dispatch()
+
+    def record_throttle(self):
+        """记录一次429限流，立即退避"""
+        with self._lock:
+            self.stats["throttled"] += 1
+            self._decrease("触发限流")
+
+    def _decrease(self, reason: str):
+        """乘性减少并发数（调用方持有锁）"""
+        now = time.monotonic()
+        if now - self.decreased_at < max(self.latency or 0.0, self.MIN_COOLDOWN):
+            return
+        previous = self.current_limit
+        self.limit = max(self.limit * self.backoff, 1.0)
+        self.slow_start = False
+        self.decreased_at = now
+        self.stats["decreases"] += 1
+        logger.info(f"{reason}，并发数 {previous} -> {self.current_limit}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前并发上限和调整统计"""
+        with self._lock:
+            return {
+                "limit": self.current_limit,
+                "ceiling": self.ceiling,
+                "in_flight": self.in_flight,
+                "waiting": len(self._waiters),
+                "latency": self.latency,
+                **self.stats
+            }
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+# 进程级自适应并发注册表：同一提供商、同一API密钥的所有会话共享并发数
+_adaptive_limiters: Dict[Tuple[str, str], AdaptiveLimiter] = {}
+_adaptive_limiters_lock = threading.Lock()
+
+
+def get_adaptive_limiter(provider: str, api_key: str) -> AdaptiveLimiter:
+    """获取（或创建）进程内共享的自适应并发限制"""
+    key_hash = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    registry_key = (provider, key_hash)
+    with _adaptive_limiters_lock:
+        limiter = _adaptive_limiters.get(registry_key)
+        if limiter is None:
+            limiter = AdaptiveLimiter()
+            _adaptive_limiters[registry_key] = limiter
+        return limiter
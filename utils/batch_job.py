@@ -0,0 +1,175 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import json
+import time
+import uuid
+from openai.types.chat import ChatCompletion
+from config import APIConfig
+from .client_pool import run_in_background
+from .exceptions import APIError, APIServerError
+
+# 批处理任务的终止状态
+_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchJobCollector:
+    """离线批处理收集器
+
+    挂到AIHandler.batch_collector后，所有未命中缓存的请求不会立即发送，
+    而是在一段时间内没有新请求时，统一写成Batch API的JSONL格式提交。
+    任务完成后把结果交还给等待中的调用方，后续的合并、最终总结阶段照常运行，
+    结果同样会写入响应缓存。每一轮（文本块、合并、最终总结）对应一个批处理任务。
+    """
+
+    def __init__(
+        self,
+        ai_handler,
+        idle_time: float = APIConfig.BATCH_COLLECT_IDLE,
+        poll_interval: float = APIConfig.BATCH_POLL_INTERVAL,
+        completion_window: str = APIConfig.BATCH_COMPLETION_WINDOW,
+        status_callback: Callable[[str], None] = None
+    ):
+        self.ai_handler = ai_handler
+        self.client = ai_handler.client
+        self.idle_time = idle_time
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+        self.status_callback = status_callback
+
+        self._pending: List[Tuple[str, Dict[str, Any], asyncio.Future]] = []
+        self._last_submit = 0.0
+        self._timer = None
+        self._jobs: List[asyncio.Task] = []
+
+    def _report(self, message: str):
+        print(message)
+        if self.status_callback:
+            self.status_callback(message)
+
+    async def submit(self, request: Dict[str, Any]) -> ChatCompletion:
+        """登记一个请求，等待批处理任务返回结果"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        custom_id = f"req-{uuid.uuid4().hex}"
+        self._pending.append((custom_id, request, future))
+        self._last_submit = time.monotonic()
+        if self._timer is None:
+            self._timer = loop.call_later(self.idle_time, self._check_idle)
+        return await future
+
+    def _check_idle(self):
+        """空闲时间达到阈值后提交批处理任务"""
+        self._timer = None
+        if not self._pending:
+            return
+        loop = asyncio.get_running_loop()
+        remaining = self._last_submit + self.idle_time - time.monotonic()
+        if remaining > 0:
+            self._timer = loop.call_later(remaining, self._check_idle)
+            return
+
+        requests, self._pending = self._pending, []
+        self._jobs.append(loop.create_task(self._run_job(requests)))
+
+    @staticmethod
+    def build_jsonl(requests: List[Tuple[str, Dict[str, Any], Any]]) -> bytes:
+        """生成Batch API的JSONL输入文件"""
+        lines = [
+            json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body
+            }, ensure_ascii=False)
+            for custom_id, body, _ in requests
+        ]
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    @staticmethod
+    def parse_results(content: str) -> Dict[str, Dict[str, Any]]:
+        """解析Batch API的输出/错误文件，按custom_id返回"""
+        results = {}
+        for line in content.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            results[item["custom_id"]] = item
+        return results
+
+    async def _read_file(self, file_id: Optional[str]) -> Dict[str, Dict[str, Any]]:
+        if not file_id:
+            return {}
+        content = await run_in_background(self.client.files.content(file_id))
+        return self.parse_results(content.text)
+
+    async def _run_job(self, requests: List[Tuple[str, Dict[str, Any], asyncio.Future]]):
+        """提交并轮询一个批处理任务，然后分发结果"""
+        try:
+            batch = await self.run_batch(requests)
+            results = await self._read_file(batch.output_file_id)
+            results.update(await self._read_file(getattr(batch, "error_file_id", None)))
+        except Exception as e:
+            error = e if isinstance(e, APIError) else APIServerError(f"批处理任务失败: {str(e)}")
+            for _, _, future in requests:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for custom_id, _, future in requests:
+            if future.done():
+                continue
+            item = results.get(custom_id)
+            response = (item or {}).get("response") or {}
+            if item and response.get("status_code") == 200:
+                future.set_result(ChatCompletion(**response["body"]))
+            else:
+                error = (item or {}).get("error") or response.get("body", {}).get("error")
+                message = error.get("message") if isinstance(error, dict) else f"批处理任务状态: {batch.status}"
+                future.set_exception(APIError(f"批处理请求失败: {message}"))
+
+    async def run_batch(self, requests: List[Tuple[str, Dict[str, Any], Any]]):
+        """上传输入文件、创建批处理任务并等待其结束"""
+        self._report(f"正在提交批处理任务：{len(requests)} 个请求")
+        input_file = await run_in_background(
+            self.client.files.create(
+                file=("batch_input.jsonl", self.build_jsonl(requests)),
+                purpose="batch"
+            )
+        )
+        batch = await run_in_background(
+            self.client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window=self.completion_window
+            )
+        )
+
+        while batch.status not in _FINAL_STATUSES:
+            counts = getattr(batch, "request_counts", None)
+            progress = f"{counts.completed}/{counts.total}" if counts else "-"
+            self._report(f"批处理任务 {batch.id}：{batch.status}（已完成 {progress}）")
+            await asyncio.sleep(self.poll_interval)
+            batch = await run_in_background(self.client.batches.retrieve(batch.id))
+
+        self._report(f"批处理任务 {batch.id}：{batch.status}")
+        if batch.status != "completed" and not batch.output_file_id:
+            raise APIServerError(f"批处理任务未完成: {batch.status}", retryable=False)
+        return batch
+
+    def __enter__(self):
+        self.ai_handler.batch_collector = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.ai_handler.batch_collector = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for _, _, future in self._pending:
+            if not future.done():
+                future.cancel()
+        self._pending = []
+        for job in self._jobs:
+            job.cancel()
+        return False
\ No newline at end of file
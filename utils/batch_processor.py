@@ -1,7 +1,14 @@
-from typing import List, Dict, Callable, Any
+from typing import List, Dict, Callable, Any, AsyncIterator, Tuple
 import asyncio
+import contextlib
 import logging
+import random
+import time
 from config import APIConfig
+from .adaptive_limiter import AdaptiveLimiter
+from .deadline import remaining_time, running_request, waiting_for_slot
+from .exceptions import APIError, APIRateLimitError, DeadlineExceededError
+from .progress import BatchProgress
 
 class BatchProcessor:
     """批量处理管理器"""
@@ -9,17 +16,117 @@ class BatchProcessor:
     def __init__(
         self,
         max_workers: int = APIConfig.MAX_CONCURRENT,
-        progress_callback: Callable[[float, str], None] = None
+        progress_callback: Callable[[float, str], None] = None,
+        semaphore: asyncio.Semaphore = None,
+        adaptive_limiter: AdaptiveLimiter = None
     ):
         self.max_workers = max_workers
         self.progress_callback = progress_callback
         self.max_retries = APIConfig.MAX_RETRIES
         self.retry_delay = APIConfig.RETRY_DELAY
+        self.max_retry_delay = APIConfig.RETRY_MAX_DELAY
+        # 同一处理器上的所有任务（文本块总结、各层合并）共享并发限制；
+        # 传入semaphore时与其他处理器共享（如多篇论文共用全局并发限制）
+        self.semaphore = semaphore or asyncio.Semaphore(max_workers)
+        # 自适应并发（可选）：在上述并发上限之内，按延迟和429动态调整同一API密钥的并发数
+        self.adaptive_limiter = adaptive_limiter
+        # 最近一次批处理的进度统计
+        self.progress: BatchProgress = None
         
         # 初始化日志
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
+    
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        """判断错误是否值得重试（密钥无效、配额不足等永久性错误不重试）"""
+        if isinstance(error, APIError):
+            return error.retryable
+        return True
+    
+    def next_delay(self, previous_delay: float, error: Exception = None) -> float:
+        """计算下一次重试的等待时间（decorrelated jitter 指数退避）"""
+        delay = min(
+            self.max_retry_delay,
+            random.uniform(self.retry_delay, max(previous_delay, self.retry_delay) * 3)
+        )
+        # 服务端给出Retry-After时至少等待该时长
+        if isinstance(error, APIRateLimitError) and error.retry_after:
+            delay = max(delay, error.retry_after)
+        return delay
         
+    def report(self, progress: BatchProgress):
+        """把进度统计交给进度回调（进度为已结束项目的占比）"""
+        if self.progress_callback:
+            self.progress_callback(progress.fraction, f"{progress.description}：{progress.format()}")
+    
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """依次占用批处理和自适应并发名额；论文的请求都在等待名额时暂停其处理时限"""
+        limiters = [self.semaphore] if self.adaptive_limiter is None else [self.semaphore, self.adaptive_limiter]
+        async with contextlib.AsyncExitStack() as stack:
+            with waiting_for_slot():
+                for limiter in limiters:
+                    await stack.enter_async_context(limiter)
+            with running_request():
+                yield
+    
+    async def attempt(self, item: Any, process_func: Callable[[Any], Any], progress: BatchProgress = None) -> Any:
+        """执行一次请求，并记录到进度统计"""
+        if progress is None:
+            return await process_func(item)
+        progress.started()
+        start_time = time.monotonic()
+        try:
+            result = await process_func(item)
+        except BaseException:
+            progress.stopped()
+            raise
+        progress.stopped(time.monotonic() - start_time, result)
+        self.report(progress)
+        return result
+    
+    async def run_item(self, item: Any, process_func: Callable[[Any], Any], progress: BatchProgress = None) -> Any:
+        """在共享并发限制下处理单个项目（可重试错误自动重试，重试耗尽返回None）"""
+        delay = self.retry_delay
+        for retry in range(self.max_retries):
+            try:
+                # 退避等待期间不占用并发名额
+                async with self.slot():
+                    return await self.attempt(item, process_func, progress)
+            except Exception as e:
+                if not self.is_retryable(e):
+                    self.logger.error(f"不可恢复的错误，终止批处理: {str(e)}")
+                    raise
+                if retry < self.max_retries - 1:
+                    delay = self.next_delay(delay, e)
+                    # 剩余的处理时间不够等待重试时放弃整篇论文，取消其余任务
+                    remaining = remaining_time()
+                    if remaining is not None and delay >= remaining:
+                        raise DeadlineExceededError(
+                            f"处理超时：剩余{max(remaining, 0):.1f}秒，不足以等待重试: {str(e)}"
+                        ) from e
+                    self.logger.warning(
+                        f"处理失败，{delay:.1f}秒后重试 ({retry + 1}/{self.max_retries}): {str(e)}"
+                    )
+                    if progress:
+                        progress.retry_scheduled()
+                        self.report(progress)
+                    await asyncio.sleep(delay)
+                    if progress:
+                        progress.retry_started()
+                else:
+                    self.logger.error(f"处理项目失败，重试耗尽后丢弃: {str(e)}")
+                    if progress:
+                        progress.dropped()
+                        self.report(progress)
+                    return None
+    
+    def log_finished(self, progress: BatchProgress):
+        self.logger.info(f"{progress.description}完成：{progress.format()}（重试 {progress.retries} 次）")
+        if progress.failed:
+            self.logger.warning(f"{progress.description}：{progress.failed}/{progress.total} 个项目重试耗尽，已丢弃")
+    
     async def process_batch(
         self,
         items: List[Any],
@@ -28,41 +135,48 @@ class BatchProcessor:
     ) -> List[Any]:
         """批量处理项目"""
         try:
-            total_items = len(items)
+            progress = self.progress = BatchProgress(len(items), description)
             results = []
             
-            # 创建信号量来限制并发
-            semaphore = asyncio.Semaphore(self.max_workers)
-            
-            async def process_item_with_semaphore(item, index):
-                async with semaphore:
-                    for retry in range(self.max_retries):
-                        try:
-                            result = await process_func(item)
-                            if self.progress_callback:
-                                progress = (index + 1) / total_items
-                                self.progress_callback(progress, description)
-                            return result
-                        except Exception as e:
-                            if retry < self.max_retries - 1:
-                                self.logger.warning(f"处理失败，正在重试 ({retry + 1}/{self.max_retries}): {str(e)}")
-                                await asyncio.sleep(self.retry_delay)
-                            else:
-                                self.logger.error(f"处理项目失败: {str(e)}")
-                                return None
-            
             # 并行处理所有项目
-            tasks = [
-                process_item_with_semaphore(item, i)
-                for i, item in enumerate(items)
-            ]
+            tasks = [asyncio.ensure_future(self.run_item(item, process_func, progress)) for item in items]
             
-            # 等待所有任务完成
-            results = await asyncio.gather(*tasks)
+            # 等待所有任务完成，出现永久性错误时取消其余任务
+            try:
+                results = await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
             
-            # 过滤掉None结果
+            self.log_finished(progress)
+            # 过滤掉None结果（丢弃的数量见progress.failed）
             return [r for r in results if r is not None]
             
         except Exception as e:
             self.logger.error(f"批处理失败: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+    
+    async def iter_completed(
+        self,
+        items: List[Any],
+        process_func: Callable[[Any], Any],
+        description: str = "处理中"
+    ) -> AsyncIterator[Tuple[int, Any]]:
+        """按完成顺序逐个产出 (序号, 结果)，失败的项目结果为None"""
+        progress = self.progress = BatchProgress(len(items), description)
+        
+        async def indexed(item, index):
+            return index, await self.run_item(item, process_func, progress)
+        
+        tasks = [asyncio.ensure_future(indexed(item, i)) for i, item in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+            self.log_finished(progress)
+        finally:
+            # 出现永久性错误或调用方提前退出时取消其余任务
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
\ No newline at end of file
@@ -0,0 +1,49 @@
+from typing import Dict
+from config import APIConfig
+from prompts import EXTRACTION_TARGET_LENGTH, get_target_length
+
+
+class TokenBudgetPlanner:
+    """按处理阶段规划输出token预算（max_tokens）
+
+    输出token数决定生成耗时，各阶段只分配实际需要的预算：
+    - chunk: 全部文本块提取结果合起来大约填满一次合并的输入预算
+    - merge: 合并后的提取结果长度（与模式无关，便于在模式之间复用）
+    - final / single: 模式的目标长度加上余量
+    所有预算都不超过提供商的输出上限。
+    """
+
+    def __init__(self, mode: str, provider: str, chunk_count: int = 1):
+        config = APIConfig.get_config(provider)
+        self.max_output = config["max_tokens"]
+        if provider == "deepseek":
+            self.max_output = min(self.max_output, 4096)
+        self.target = get_target_length(mode)
+        self.chunk_count = max(chunk_count, 1)
+
+    def _cap(self, tokens: float) -> int:
+        return max(min(int(tokens), self.max_output), 1)
+
+    def plan(self) -> Dict[str, int]:
+        """返回各阶段的max_tokens"""
+        chunk = APIConfig.MERGE_INPUT_BUDGET / self.chunk_count
+        chunk = min(max(chunk, APIConfig.CHUNK_OUTPUT_MIN), APIConfig.CHUNK_OUTPUT_MAX)
+        final = self.target * APIConfig.OUTPUT_HEADROOM
+        return {
+            "chunk": self._cap(chunk),
+            "merge": self._cap(EXTRACTION_TARGET_LENGTH * APIConfig.OUTPUT_HEADROOM),
+            "final": self._cap(final),
+            "single": self._cap(final)
+        }
+
+    def for_stage(self, stage: str) -> int:
+        return self.plan().get(stage, self.max_output)
+
+    def expand(self, max_tokens: int) -> int:
+        """输出被截断时的下一次预算（翻倍，不超过提供商上限）"""
+        return self._cap(max_tokens * 2)
+
+    @staticmethod
+    def length_hint(max_tokens: int) -> str:
+        """附加在文本之后的篇幅提示，让模型在预算内完整作答"""
+        return f"\n\n---\nKeep the response complete and within about {int(max_tokens * 0.8)} tokens."
\ No newline at end of file
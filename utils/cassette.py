@@ -0,0 +1,231 @@
+from typing import Any, Dict, List, Tuple
+from collections import defaultdict, deque
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from openai.types.chat import ChatCompletion
+from .exceptions import APIError
+from .usage import get_current_stage
+
+
+def request_key(request: Dict[str, Any]) -> str:
+    """请求的规范化哈希，用于回放时匹配"""
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _open(path: str, mode: str):
+    """.gz结尾的文件使用gzip压缩"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def load_entries(path: str) -> List[Dict[str, Any]]:
+    """读取录制文件中的全部记录"""
+    entries = []
+    with _open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    return entries
+
+
+class Cassette:
+    """LLM请求录制/回放
+
+    录制模式：把每个请求及响应、耗时、所属阶段写入录制文件（JSONL，可gzip压缩）。
+    回放模式：按请求内容匹配录制的响应，可选按原始延迟或零延迟返回。
+    录制/回放时AIHandler会跳过本地响应缓存，保证每次运行的请求序列一致。
+    """
+
+    RECORD = "record"
+    REPLAY = "replay"
+
+    def __init__(self, path: str, mode: str = RECORD, original_latency: bool = True):
+        if mode not in (self.RECORD, self.REPLAY):
+            raise ValueError(f"不支持的录制模式: {mode}")
+
+        self.path = path
+        self.mode = mode
+        self.original_latency = original_latency
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._file = None
+        self._responses: Dict[str, deque] = defaultdict(deque)
+        self._last: Dict[str, Dict[str, Any]] = {}
+
+        if mode == self.RECORD:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = _open(path, "w")
+        else:
+            for entry in load_entries(path):
+                self._responses[entry["key"]].append(entry)
+            print(f"加载录制文件: {path}，共 {sum(len(q) for q in self._responses.values())} 条请求")
+
+    def record(self, request: Dict[str, Any], response: Any, latency: float, start_offset: float):
+        """记录一次请求与响应"""
+        entry = {
+            "key": request_key(request),
+            "stage": get_current_stage(),
+            "start": round(start_offset, 4),
+            "latency": round(latency, 4),
+            "request": request,
+            "response": response.model_dump() if hasattr(response, "model_dump") else response
+        }
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    async def replay(self, request: Dict[str, Any]) -> Tuple[ChatCompletion, float]:
+        """按请求内容返回录制的响应"""
+        key = request_key(request)
+        with self._lock:
+            queue = self._responses.get(key)
+            if queue:
+                entry = queue.popleft()
+                self._last[key] = entry
+            else:
+                # 相同请求多于录制次数时重复使用最后一次的响应
+                entry = self._last.get(key)
+        if entry is None:
+            raise APIError("录制文件中没有与该请求匹配的记录，请重新录制")
+
+        latency = entry["latency"] if self.original_latency else 0.0
+        if latency:
+            await asyncio.sleep(latency)
+        return ChatCompletion(**entry["response"]), latency
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def stage_stats(entries: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """按阶段统计请求数、累计延迟和墙钟跨度"""
+    stats: Dict[str, Dict[str, float]] = {}
+    for entry in entries:
+        stage = stats.setdefault(entry.get("stage", "other"), {
+            "calls": 0,
+            "latency": 0.0,
+            "first_start": float("inf"),
+            "last_end": 0.0,
+            "completion_tokens": 0
+        })
+        stage["calls"] += 1
+        stage["latency"] += entry["latency"]
+        stage["first_start"] = min(stage["first_start"], entry["start"])
+        stage["last_end"] = max(stage["last_end"], entry["start"] + entry["latency"])
+        usage = (entry.get("response") or {}).get("usage") or {}
+        stage["completion_tokens"] += usage.get("completion_tokens") or 0
+
+    for stage in stats.values():
+        stage["wall_time"] = round(stage.pop("last_end") - stage.pop("first_start"), 3)
+        stage["latency"] = round(stage["latency"], 3)
+    return stats
+
+
+def _content(entry: Dict[str, Any]) -> str:
+    choices = (entry.get("response") or {}).get("choices") or [{}]
+    return (choices[0].get("message") or {}).get("content") or ""
+
+
+def diff_cassettes(baseline_path: str, current_path: str) -> Dict[str, Any]:
+    """比较两次录制的阶段耗时与输出差异"""
+    baseline = load_entries(baseline_path)
+    current = load_entries(current_path)
+
+    baseline_outputs = {entry["key"]: _content(entry) for entry in baseline}
+    current_outputs = {entry["key"]: _content(entry) for entry in current}
+    shared = set(baseline_outputs) & set(current_outputs)
+    changed = sorted(key for key in shared if baseline_outputs[key] != current_outputs[key])
+
+    baseline_stats = stage_stats(baseline)
+    current_stats = stage_stats(current)
+    stages = {}
+    for name in sorted(set(baseline_stats) | set(current_stats)):
+        before = baseline_stats.get(name, {})
+        after = current_stats.get(name, {})
+        stages[name] = {
+            "calls": (before.get("calls", 0), after.get("calls", 0)),
+            "latency": (before.get("latency", 0.0), after.get("latency", 0.0)),
+            "wall_time": (before.get("wall_time", 0.0), after.get("wall_time", 0.0))
+        }
+
+    def span(entries):
+        return round(max((e["start"] + e["latency"] for e in entries), default=0.0), 3)
+
+    return {
+        "requests": (len(baseline), len(current)),
+        "total_time": (span(baseline), span(current)),
+        "stages": stages,
+        "only_in_baseline": len(set(baseline_outputs) - set(current_outputs)),
+        "only_in_current": len(set(current_outputs) - set(baseline_outputs)),
+        "changed_outputs": len(changed),
+        "changed_keys": changed
+    }
+
+
+def _format_pair(before: float, after: float) -> str:
+    if isinstance(before, float) or isinstance(after, float):
+        delta = f"{(after - before) / before:+.1%}" if before else "-"
+        return f"{before:.2f} -> {after:.2f} ({delta})"
+    return f"{before} -> {after}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM请求录制文件工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    stats_parser = subparsers.add_parser("stats", help="按阶段统计录制文件")
+    stats_parser.add_argument("path")
+
+    diff_parser = subparsers.add_parser("diff", help="比较两次录制的阶段耗时与输出")
+    diff_parser.add_argument("baseline")
+    diff_parser.add_argument("current")
+    diff_parser.add_argument("--json", action="store_true", help="以JSON格式输出")
+
+    args = parser.parse_args()
+    if args.command == "stats":
+        print(json.dumps(stage_stats(load_entries(args.path)), ensure_ascii=False, indent=2))
+        return
+
+    result = diff_cassettes(args.baseline, args.current)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+
+    print(f"请求数: {_format_pair(*result['requests'])}")
+    print(f"总耗时(秒): {_format_pair(*result['total_time'])}")
+    for name, stage in result["stages"].items():
+        print(
+            f"[{name}] 调用 {_format_pair(*stage['calls'])} | "
+            f"累计延迟 {_format_pair(*stage['latency'])} | 墙钟 {_format_pair(*stage['wall_time'])}"
+        )
+    print(
+        f"输出变化: {result['changed_outputs']} 条，"
+        f"仅基线: {result['only_in_baseline']} 条，仅当前: {result['only_in_current']} 条"
+    )
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
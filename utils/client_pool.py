@@ -0,0 +1,137 @@
+from typing import Any, Awaitable, Dict, Tuple
+import asyncio
+import hashlib
+import importlib.util
+import threading
+import httpx
+from openai import AsyncOpenAI
+from config import APIConfig
+
+class BackgroundLoop:
+    """后台常驻事件循环
+
+    Streamlit每次重新运行脚本都会通过asyncio.run创建新的事件循环，
+    绑定在旧循环上的连接无法复用。所有HTTP请求都提交到这个常驻循环上执行，
+    连接池和TLS会话因此可以在整个进程生命周期内复用。
+    """
+
+    def __init__(self, name: str = "ai-background-loop"):
+        self.name = name
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        """获取（必要时启动）后台事件循环"""
+        with self._lock:
+            if self.loop is None or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                started = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(started.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+                self._thread.start()
+                started.wait()
+                self.loop = loop
+            return self.loop
+
+    async def run(self, coro: Awaitable) -> Any:
+        """在后台循环上执行协程，并在当前循环中等待结果
+
+        当前任务被取消时，后台循环上的任务也会随之取消。
+        """
+        loop = self.get_loop()
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is loop:
+            return await coro
+
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        return await asyncio.wrap_future(future)
+
+    def run_sync(self, coro: Awaitable, timeout: float = None) -> Any:
+        """在非异步上下文中同步执行协程"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.get_loop())
+        return future.result(timeout)
+
+
+class ClientRegistry:
+    """进程级AsyncOpenAI客户端注册表，按 (提供商, 地址, 密钥) 复用客户端"""
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, str, str], AsyncOpenAI] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _http2_available() -> bool:
+        """HTTP/2为可选功能，需要安装h2"""
+        return importlib.util.find_spec("h2") is not None
+
+    def _create_http_client(self) -> httpx.AsyncClient:
+        """创建带连接池配置的HTTP客户端"""
+        http2 = APIConfig.ENABLE_HTTP2
+        if http2 and not self._http2_available():
+            print("未安装h2，HTTP/2不可用，使用HTTP/1.1")
+            http2 = False
+
+        return httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=APIConfig.POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=APIConfig.POOL_MAX_KEEPALIVE,
+                keepalive_expiry=APIConfig.POOL_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(APIConfig.REQUEST_TIMEOUT, connect=10.0),
+            follow_redirects=True
+        )
+
+    def get_client(self, provider: str, base_url: str, api_key: str) -> AsyncOpenAI:
+        """获取（或创建）共享客户端"""
+        key_hash = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+        registry_key = (provider, base_url, key_hash)
+        with self._lock:
+            client = self._clients.get(registry_key)
+            if client is None:
+                # 由限流器统一处理429重试，关闭SDK内置重试以免形成重试风暴
+                client = AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    max_retries=0,
+                    http_client=self._create_http_client()
+                )
+                self._clients[registry_key] = client
+                print(f"创建共享API客户端: {provider} {base_url}")
+            return client
+
+    def clear(self):
+        """关闭并移除所有客户端"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            try:
+                background_loop.run_sync(client.close(), timeout=10)
+            except Exception as e:
+                print(f"关闭API客户端失败: {str(e)}")
+
+
+# 进程级单例
+background_loop = BackgroundLoop()
+client_registry = ClientRegistry()
+
+
+def get_shared_client(provider: str, base_url: str, api_key: str) -> AsyncOpenAI:
+    """获取进程内共享的API客户端"""
+    return client_registry.get_client(provider, base_url, api_key)
+
+
+async def run_in_background(coro: Awaitable) -> Any:
+    """在后台常驻循环上执行协程（所有API请求都应通过此函数发送）"""
+    return await background_loop.run(coro)
\ No newline at end of file
@@ -0,0 +1,133 @@
+from typing import Any, Awaitable, Optional
+import asyncio
+import contextlib
+import contextvars
+import time
+from config import PDFConfig
+from .exceptions import DeadlineExceededError
+
+# 当前论文的处理时限，子任务和线程池中的提取（复制上下文时）都能读取
+_deadline: contextvars.ContextVar[Optional["Deadline"]] = contextvars.ContextVar("deadline", default=None)
+
+
+def remaining_time() -> Optional[float]:
+    """当前上下文距离截止时间的剩余秒数（未设置时限时为None）"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline.time_left()
+
+
+def check_deadline():
+    """已超过截止时间时抛出DeadlineExceededError（用于逐页OCR等长循环）"""
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceededError("处理超时，已超过论文的处理时限")
+
+
+def request_timeout(default: float) -> float:
+    """单次请求的超时时间：不超过默认值，也不超过剩余的处理时间"""
+    check_deadline()
+    remaining = remaining_time()
+    return default if remaining is None else min(default, remaining)
+
+
+@contextlib.contextmanager
+def _counting(kind: str):
+    deadline = _deadline.get()
+    if deadline is None:
+        yield
+        return
+    deadline.count(kind, 1)
+    try:
+        yield
+    finally:
+        deadline.count(kind, -1)
+
+
+def waiting_for_slot():
+    """等待并发名额（全局并发限制、自适应并发）期间"""
+    return _counting("waiting")
+
+
+def running_request():
+    """占用并发名额执行请求期间"""
+    return _counting("running")
+
+
+class Deadline:
+    """单篇论文的处理时限
+
+    计算提取、总结各阶段的处理时间，不计算等待并发名额的时间：该论文有请求在等待名额、
+    且没有正在执行的请求时暂停计时（与其他论文共享全局并发限制时，排队不会耗尽处理时间）。
+    有请求在执行时，同一篇论文其余请求的排队照常计时。
+    超时后取消该论文所有进行中的请求（文本块、合并、最终总结），抛出DeadlineExceededError。
+    timeout为None时不限时（如离线批处理）。
+    """
+
+    def __init__(self, timeout: Optional[float] = PDFConfig.TIMEOUT):
+        self.timeout = timeout
+        self.remaining = timeout
+        self.waiting = 0
+        self.running = 0
+        self.expires: Optional[float] = None  # 截止时间（time.monotonic()），暂停时顺延
+        self.paused_at: Optional[float] = None
+        self.outer: Optional["Deadline"] = None
+
+    def count(self, kind: str, delta: int):
+        """更新等待名额和执行中的请求数，并据此暂停或恢复计时"""
+        setattr(self, kind, getattr(self, kind) + delta)
+        if self.expires is None:
+            # 已结束（如被取消）的运行中，子任务稍后才退出
+            return
+        now = time.monotonic()
+        paused = self.waiting > 0 and self.running == 0
+        if paused and self.paused_at is None:
+            self.paused_at = now
+        elif not paused and self.paused_at is not None:
+            self.expires += now - self.paused_at
+            self.paused_at = None
+
+    def own_time_left(self) -> float:
+        now = time.monotonic() if self.paused_at is None else self.paused_at
+        return self.expires - now
+
+    def time_left(self) -> float:
+        """剩余的处理时间（嵌套时同时受外层时限的约束）"""
+        left = self.own_time_left()
+        return left if self.outer is None else min(left, self.outer.time_left())
+
+    async def run(self, awaitable: Awaitable[Any]) -> Any:
+        """在剩余的处理时间内执行，子任务通过上下文继承截止时间"""
+        if self.timeout is None:
+            return await awaitable
+        if self.remaining <= 0:
+            raise DeadlineExceededError(f"处理超时（超过{self.timeout:g}秒）")
+
+        self.expires = time.monotonic() + self.remaining
+        self.outer = _deadline.get()
+        token = _deadline.set(self)
+        task = asyncio.ensure_future(awaitable)
+        try:
+            # 暂停计时会顺延截止时间，到期时重新计算，确实超时才取消
+            while True:
+                left = self.time_left()
+                if left <= 0:
+                    task.cancel()
+                    await asyncio.wait({task})
+                    raise DeadlineExceededError(f"处理超时（超过{self.timeout:g}秒），已取消剩余的请求")
+                done, _ = await asyncio.wait({task}, timeout=left)
+                if done:
+                    return task.result()
+        finally:
+            try:
+                if not task.done():
+                    # 外层被取消（如停止任务）时，等子任务退出后再结算剩余时间
+                    task.cancel()
+                    await asyncio.wait({task})
+                if not task.cancelled():
+                    task.exception()
+            finally:
+                self.remaining = self.own_time_left()
+                self.expires, self.paused_at, self.outer = None, None, None
+                _deadline.reset(token)
@@ -0,0 +1,72 @@
+from typing import Any, Dict, Optional
+from datetime import datetime, timedelta
+import base64
+import hashlib
+import json
+import os
+
+
+class DocumentCache:
+    """整篇文档的结果缓存
+
+    以文件内容的哈希加上模式、提供商、模型和分块设置为键，保存最终总结和思维导图。
+    重复上传同一文件（即使文件名不同）时直接返回结果，不再解析文件或调用API。
+    """
+
+    def __init__(self, cache_dir: str = None, expiry: timedelta = timedelta(days=7)):
+        self.cache_dir = cache_dir or os.path.join(
+            os.path.dirname(os.path.dirname(__file__)), "cache", "documents"
+        )
+        self.expiry = expiry
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def file_hash(file) -> str:
+        """计算上传文件内容的哈希（不改变文件指针位置）"""
+        if hasattr(file, "getvalue"):
+            data = file.getvalue()
+        else:
+            position = file.tell()
+            file.seek(0)
+            data = file.read()
+            file.seek(position)
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def make_key(file_hash: str, **settings) -> str:
+        """文件哈希与处理设置共同决定缓存键"""
+        content = json.dumps({"file": file_hash, **settings}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存，过期或损坏时返回None"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+            if datetime.now() - datetime.fromtimestamp(record["timestamp"]) > self.expiry:
+                os.remove(path)
+                return None
+            if record.get("mindmap"):
+                record["mindmap"] = base64.b64decode(record["mindmap"])
+            return record
+        except Exception as e:
+            print(f"读取文档缓存失败: {str(e)}")
+            return None
+
+    def put(self, key: str, record: Dict[str, Any]):
+        """写入缓存（思维导图图片以base64保存）"""
+        data = dict(record)
+        data["timestamp"] = datetime.now().timestamp()
+        if data.get("mindmap"):
+            data["mindmap"] = base64.b64encode(data["mindmap"]).decode("ascii")
+        try:
+            with open(self._path(key), "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+        except Exception as e:
+            print(f"写入文档缓存失败: {str(e)}")
\ No newline at end of file
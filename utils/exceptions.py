@@ -48,4 +48,57 @@ class MergeError(FileProcessError):
 
 class EncodingError(FileProcessError):
     """文本编码错误"""
-    pass 
\ No newline at end of file
+    pass 
+
+class APIError(Exception):
+    """API调用相关的异常基类
+
+    retryable 表示该错误是否可能通过重试恢复。
+    """
+    retryable = False
+
+    def __init__(self, message: str, retryable: bool = None):
+        super().__init__(message)
+        if retryable is not None:
+            self.retryable = retryable
+
+class APIAuthError(APIError):
+    """API密钥无效或无访问权限"""
+    pass
+
+class APIQuotaError(APIError):
+    """API配额不足"""
+    pass
+
+class APIRateLimitError(APIError):
+    """请求频率超出限制"""
+    retryable = True
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class APITimeoutError(APIError):
+    """请求超时或网络连接失败"""
+    retryable = True
+
+class APIServerError(APIError):
+    """服务端错误（5xx）"""
+    retryable = True
+
+class APIContextLengthError(APIError):
+    """输入或输出超出模型上下文长度限制"""
+    pass
+
+class APIOutputTruncatedError(APIError):
+    """输出达到max_tokens上限被截断（finish_reason为length）"""
+
+    def __init__(self, message: str, partial: str = "", max_tokens: int = None, provider: str = None):
+        super().__init__(message)
+        self.partial = partial
+        self.max_tokens = max_tokens
+        self.provider = provider
+
+class DeadlineExceededError(APIError):
+    """论文处理超过时限（PDFConfig.TIMEOUT），剩余的请求已取消"""
+    pass
@@ -1,9 +1,11 @@
 from typing import List, Dict, Optional
 import os
 from datetime import datetime
+import json
 import zipfile
 import tempfile
 from config import UIConfig
+from .usage import merge_usage
 
 class PaperExporter:
     """论文导出器"""
@@ -46,6 +48,9 @@ class PaperExporter:
                         img_filepath = os.path.join(self.temp_dir, img_filename)
                         zipf.write(img_filepath, img_filename)
                     
+                # 添加用量报告
+                zipf.writestr('usage_report.json', self.export_usage_report(summaries))
+                    
                 # 添加README文件
                 readme_content = self._generate_readme(summaries)
                 readme_path = os.path.join(self.temp_dir, 'README.md')
@@ -88,6 +93,7 @@ class PaperExporter:
 - 每个文件包含一篇论文的总结
 - 总结包含研究背景、方法、结果等关键信息
 - 对应的思维导图以PNG格式保存（文件名：论文名_mindmap.png）
+- usage_report.json 记录每篇论文及整批的token用量与预估费用
 """
         
         return content
@@ -153,34 +159,67 @@ class PaperExporter:
         keywords = list(dict.fromkeys(matches))
         return ", ".join(keywords)
 
+    def excel_row(self, record: Dict) -> Dict:
+        """生成单篇论文在Excel中的一行（关键信息、总结文本和用量统计）"""
+        import os
+        summary_text = record.get("summary", "")
+        preview = summary_text[:200] + ("..." if len(summary_text) > 200 else "")
+        file_ext = os.path.splitext(record.get("filename", ""))[1].lower().lstrip(".")
+        key_info = self._extract_key_info(summary_text)
+        keywords = self._extract_keywords(summary_text)
+        record_dict = {
+            "论文标题": record.get("filename", ""),
+            "文件类型": file_ext,
+            "关键词": keywords,
+            "创新点": key_info.get("创新点", ""),
+            "背景": key_info.get("背景", ""),
+            "模型优势": key_info.get("模型优势", ""),
+            "结论": key_info.get("结论", ""),
+            "摘要预览": preview,
+            "总结文本": summary_text,
+            "总结模式": record.get("mode", ""),
+            "处理路径": {"fast": "单次总结", "full": "完整流程"}.get(record.get("path"), "")
+        }
+        usage = record.get("usage") or {}
+        record_dict.update({
+            "API调用次数": usage.get("calls", 0),
+            "输入tokens": usage.get("prompt_tokens", 0),
+            "缓存命中tokens": usage.get("cached_tokens", 0),
+            "输出tokens": usage.get("completion_tokens", 0),
+            "预估费用(USD)": round(usage.get("cost", 0.0), 6),
+            "处理耗时(秒)": usage.get("wall_time", 0.0)
+        })
+        return record_dict
+
     def export_excel(self, summaries: List[Dict]) -> bytes:
         """批量导出总结为Excel文件，其中包含论文的关键信息(如创新点、背景、模型优势)"""
         import pandas as pd
         import io
-        import os
-        records = []
-        for record in summaries:
-            summary_text = record.get("summary", "")
-            preview = summary_text[:200] + ("..." if len(summary_text) > 200 else "")
-            file_ext = os.path.splitext(record.get("filename", ""))[1].lower().lstrip(".")
-            key_info = self._extract_key_info(summary_text)
-            keywords = self._extract_keywords(summary_text)
-            record_dict = {
-                "论文标题": record.get("filename", ""),
-                "文件类型": file_ext,
-                "关键词": keywords,
-                "创新点": key_info.get("创新点", ""),
-                "背景": key_info.get("背景", ""),
-                "模型优势": key_info.get("模型优势", ""),
-                "结论": key_info.get("结论", ""),
-                "摘要预览": preview,
-                "总结文本": summary_text,
-                "总结模式": record.get("mode", "")
-            }
-            records.append(record_dict)
+        records = [self.excel_row(record) for record in summaries]
         
         df = pd.DataFrame(records)
         output = io.BytesIO()
         with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
             df.to_excel(writer, index=False, sheet_name="论文总结")
-        return output.getvalue()
\ No newline at end of file
+        return output.getvalue()
+
+    def export_usage_report(self, summaries: List[Dict]) -> bytes:
+        """导出token用量报告（JSON），包含每篇论文和整批的汇总"""
+        papers = []
+        for record in summaries:
+            timestamp = record.get("timestamp")
+            papers.append({
+                "filename": record.get("filename", ""),
+                "mode": record.get("mode", ""),
+                "path": record.get("path"),
+                "timestamp": timestamp.isoformat() if hasattr(timestamp, "isoformat") else timestamp,
+                "usage": record.get("usage")
+            })
+        
+        report = {
+            "generated_at": datetime.now().isoformat(),
+            "currency": "USD",
+            "papers": papers,
+            "total": merge_usage(record.get("usage") for record in summaries)
+        }
+        return json.dumps(report, ensure_ascii=False, indent=2).encode(self.encoding)
\ No newline at end of file
@@ -0,0 +1,388 @@
+"""本地模拟LLM后端
+
+实现chat.completions协议（以及Batch API需要的files/batches接口），
+根据输入文本生成确定性的总结，并可模拟延迟分布、速率限制、429和5xx错误。
+用于在不消耗token、不依赖网络的情况下压测整个处理流程。
+
+启动方式:
+    python -m utils.fake_llm --port 8765 --latency 0.8 --tps 80
+
+然后在界面中把API Base URL设置为 http://127.0.0.1:8765/v1（API Key任意）。
+"""
+from typing import Any, Dict, Optional
+from collections import Counter, deque
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import uuid
+from .http_server import HTTPServer, Request, Response, json_error
+from .rate_limiter import estimate_tokens
+
+_SENTENCE_PATTERN = re.compile(r'[^。！？.!?\n]+[。！？.!?]?')
+_WORD_PATTERN = re.compile(r'[A-Za-z][A-Za-z\-]{3,}|[\u4e00-\u9fff]{2,4}')
+
+
+def fake_summary(text: str, target_tokens: int) -> str:
+    """根据输入文本生成确定性的Markdown总结（约target_tokens个token）"""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:8]
+    sentences = [s.strip() for s in _SENTENCE_PATTERN.findall(text) if len(s.strip()) > 8]
+    words = Counter(w.lower() for w in _WORD_PATTERN.findall(text))
+    keywords = [w for w, _ in words.most_common(5)] or [digest]
+
+    lines = [
+        f"## 研究概述 {digest}",
+        "- " + "".join(f"【{k}】" for k in keywords),
+        "## 主要发现"
+    ]
+    if not sentences:
+        sentences = [text[:60] or digest]
+
+    # 循环使用输入中的句子，直到达到目标长度
+    index = 0
+    output = "\n".join(lines)
+    while estimate_tokens(output) < target_tokens:
+        sentence = sentences[index % len(sentences)][:80]
+        if index == len(sentences):
+            output += "\n## 讨论与展望"
+        output += f"\n- {sentence}"
+        index += 1
+    return output
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """按估算的token数截断文本"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+
+class FakeLLMBackend:
+    """模拟的LLM服务
+
+    参数:
+        latency: 首token延迟的中位数（秒），服从对数正态分布
+        latency_sigma: 对数正态分布的sigma，越大长尾越明显
+        tokens_per_second: 输出生成速度
+        output_ratio: 输出token数相对输入token数的比例
+        rpm / tpm: 每分钟请求数 / token数限制（0表示不限制），超出返回429
+        max_concurrency: 最大并发请求数（0表示不限制），超出返回429
+        saturation: 超过该并发数后延迟按 并发数/saturation 成比例增加，模拟服务端排队（0表示不限制）
+        error_rate_429 / error_rate_5xx: 随机注入429 / 5xx错误的概率
+        batch_delay: 批处理任务从创建到完成的时间（秒）
+        seed: 随机数种子
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        latency_sigma: float = 0.3,
+        tokens_per_second: float = 100.0,
+        output_ratio: float = 0.3,
+        rpm: int = 0,
+        tpm: int = 0,
+        max_concurrency: int = 0,
+        saturation: int = 0,
+        error_rate_429: float = 0.0,
+        error_rate_5xx: float = 0.0,
+        batch_delay: float = 1.0,
+        seed: int = 0
+    ):
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.output_ratio = output_ratio
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self.saturation = saturation
+        self.error_rate_429 = error_rate_429
+        self.error_rate_5xx = error_rate_5xx
+        self.batch_delay = batch_delay
+        self.random = random.Random(seed)
+
+        self._request_log = deque()  # (时间, token数)
+        self._seen_prefixes = set()
+        self.in_flight = 0
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.stats = Counter()
+
+    # ---------- 路由 ----------
+
+    async def handle(self, request: Request) -> Response:
+        path = request.path.rstrip("/")
+        if path.startswith("/v1"):
+            path = path[3:]
+
+        if request.method == "POST" and path == "/chat/completions":
+            return await self.chat_completions(request.json())
+        if request.method == "GET" and path == "/models":
+            return Response({"object": "list", "data": [{"id": "fake-model", "object": "model"}]})
+        if request.method == "GET" and path == "/stats":
+            return Response(self.get_stats())
+        if request.method == "POST" and path == "/files":
+            return self.create_file(request)
+        match = re.fullmatch(r"/files/([\w\-]+)/content", path)
+        if request.method == "GET" and match:
+            return self.file_content(match.group(1))
+        if request.method == "POST" and path == "/batches":
+            return self.create_batch(request.json())
+        match = re.fullmatch(r"/batches/([\w\-]+)", path)
+        if request.method == "GET" and match:
+            return self.retrieve_batch(match.group(1))
+        return json_error(404, f"未知接口: {request.method} {request.path}")
+
+    # ---------- chat.completions ----------
+
+    def _check_rate_limit(self, tokens: int) -> Optional[Response]:
+        """检查RPM/TPM/并发限制，超出时返回429"""
+        now = time.monotonic()
+        while self._request_log and now - self._request_log[0][0] > 60:
+            self._request_log.popleft()
+
+        retry_after = None
+        if self.rpm and len(self._request_log) >= self.rpm:
+            retry_after = 60 - (now - self._request_log[0][0])
+        elif self.tpm and sum(t for _, t in self._request_log) + tokens > self.tpm:
+            retry_after = 60 - (now - self._request_log[0][0]) if self._request_log else 1.0
+        elif self.max_concurrency and self.in_flight >= self.max_concurrency:
+            retry_after = 1.0
+        elif self.error_rate_429 and self.random.random() < self.error_rate_429:
+            retry_after = 1.0
+
+        if retry_after is None:
+            self._request_log.append((now, tokens))
+            return None
+
+        self.stats["rate_limited"] += 1
+        return json_error(
+            429,
+            "Rate limit reached for requests",
+            code="rate_limit_exceeded",
+            headers={"retry-after": f"{max(retry_after, 0.1):.2f}"}
+        )
+
+    def build_completion(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """生成chat.completion响应体（不含延迟）"""
+        messages = body.get("messages", [])
+        system_prompt = "".join(m.get("content", "") for m in messages if m.get("role") == "system")
+        user_text = "".join(m.get("content", "") for m in messages if m.get("role") != "system")
+
+        prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+        max_tokens = body.get("max_tokens") or 4096
+        target_tokens = max(60, int(estimate_tokens(user_text) * self.output_ratio))
+
+        content = fake_summary(user_text, min(target_tokens, max_tokens + 1))
+        finish_reason = "stop"
+        if estimate_tokens(content) > max_tokens:
+            content = _truncate_to_tokens(content, max_tokens)
+            finish_reason = "length"
+        completion_tokens = estimate_tokens(content)
+
+        # 模拟提供商的前缀缓存（按64 token为单位命中）
+        prefix_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+        cached_tokens = 0
+        if prefix_hash in self._seen_prefixes:
+            cached_tokens = estimate_tokens(system_prompt) // 64 * 64
+        self._seen_prefixes.add(prefix_hash)
+
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake-model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+                "prompt_cache_hit_tokens": cached_tokens,
+                "prompt_cache_miss_tokens": prompt_tokens - cached_tokens
+            }
+        }
+
+    def sample_latency(self, completion_tokens: int) -> float:
+        """首token延迟（对数正态）+ 生成耗时"""
+        first_token = 0.0
+        if self.latency > 0:
+            first_token = self.random.lognormvariate(math.log(self.latency), self.latency_sigma)
+        generation = completion_tokens / self.tokens_per_second if self.tokens_per_second else 0.0
+        return first_token + generation
+
+    async def chat_completions(self, body: Dict[str, Any]) -> Response:
+        self.stats["requests"] += 1
+        estimated = sum(estimate_tokens(m.get("content", "")) for m in body.get("messages", []))
+        limited = self._check_rate_limit(estimated + (body.get("max_tokens") or 0))
+        if limited:
+            return limited
+
+        self.in_flight += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+        try:
+            completion = self.build_completion(body)
+            latency = self.sample_latency(completion["usage"]["completion_tokens"])
+            if self.saturation and self.in_flight > self.saturation:
+                latency *= self.in_flight / self.saturation
+            await asyncio.sleep(latency)
+
+            if self.error_rate_5xx and self.random.random() < self.error_rate_5xx:
+                self.stats["server_errors"] += 1
+                return json_error(self.random.choice([500, 502, 503]), "The server had an error", code="server_error")
+
+            self.stats["completed"] += 1
+            self.stats["prompt_tokens"] += completion["usage"]["prompt_tokens"]
+            self.stats["completion_tokens"] += completion["usage"]["completion_tokens"]
+            return Response(completion)
+        finally:
+            self.in_flight -= 1
+
+    # ---------- files / batches ----------
+
+    def create_file(self, request: Request) -> Response:
+        fields = request.form()
+        filename, content = fields.get("file", ("upload.jsonl", b""))
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        self.files[file_id] = content
+        return Response({
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename or "upload.jsonl",
+            "purpose": fields.get("purpose", (None, b"batch"))[1].decode(),
+            "status": "processed"
+        })
+
+    def file_content(self, file_id: str) -> Response:
+        if file_id not in self.files:
+            return json_error(404, f"文件不存在: {file_id}")
+        return Response(self.files[file_id], content_type="application/octet-stream")
+
+    def _batch_view(self, batch: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in batch.items() if not k.startswith("_")}
+
+    def create_batch(self, body: Dict[str, Any]) -> Response:
+        input_file_id = body.get("input_file_id")
+        if input_file_id not in self.files:
+            return json_error(400, f"输入文件不存在: {input_file_id}")
+        lines = [line for line in self.files[input_file_id].decode("utf-8").splitlines() if line.strip()]
+        batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+        self.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body.get("endpoint", "/v1/chat/completions"),
+            "input_file_id": input_file_id,
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+            "_ready_at": time.monotonic() + self.batch_delay,
+            "_lines": lines
+        }
+        return Response(self._batch_view(self.batches[batch_id]))
+
+    def retrieve_batch(self, batch_id: str) -> Response:
+        batch = self.batches.get(batch_id)
+        if batch is None:
+            return json_error(404, f"批处理任务不存在: {batch_id}")
+
+        if batch["status"] == "in_progress" and time.monotonic() >= batch["_ready_at"]:
+            outputs = []
+            for line in batch["_lines"]:
+                item = json.loads(line)
+                outputs.append(json.dumps({
+                    "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                    "custom_id": item["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "request_id": uuid.uuid4().hex,
+                        "body": self.build_completion(item["body"])
+                    },
+                    "error": None
+                }, ensure_ascii=False))
+            output_file_id = f"file-{uuid.uuid4().hex[:12]}"
+            self.files[output_file_id] = ("\n".join(outputs) + "\n").encode("utf-8")
+            batch["output_file_id"] = output_file_id
+            batch["status"] = "completed"
+            batch["request_counts"]["completed"] = len(outputs)
+            self.stats["batch_requests"] += len(outputs)
+
+        return Response(self._batch_view(batch))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, in_flight=self.in_flight)
+
+
+def start_fake_backend(port: int = 0, **kwargs) -> HTTPServer:
+    """在独立线程中启动模拟后端，返回服务器（base_url + "/v1" 即API地址）"""
+    backend = FakeLLMBackend(**kwargs)
+    server = HTTPServer(backend.handle, port=port)
+    server.backend = backend
+    return server.start_in_thread()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟LLM后端（chat.completions协议）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="首token延迟中位数（秒）")
+    parser.add_argument("--sigma", type=float, default=0.3, help="延迟对数正态分布的sigma")
+    parser.add_argument("--tps", type=float, default=100.0, help="输出生成速度（token/秒）")
+    parser.add_argument("--output-ratio", type=float, default=0.3, help="输出/输入token比例")
+    parser.add_argument("--rpm", type=int, default=0, help="每分钟请求数限制（0为不限制）")
+    parser.add_argument("--tpm", type=int, default=0, help="每分钟token数限制（0为不限制）")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="最大并发请求数（0为不限制）")
+    parser.add_argument("--saturation", type=int, default=0, help="超过该并发数后延迟成比例增加（0为不限制）")
+    parser.add_argument("--error-429", type=float, default=0.0, help="随机429错误概率")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="随机5xx错误概率")
+    parser.add_argument("--batch-delay", type=float, default=1.0, help="批处理任务完成时间（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    backend = FakeLLMBackend(
+        latency=args.latency,
+        latency_sigma=args.sigma,
+        tokens_per_second=args.tps,
+        output_ratio=args.output_ratio,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        max_concurrency=args.max_concurrency,
+        saturation=args.saturation,
+        error_rate_429=args.error_429,
+        error_rate_5xx=args.error_5xx,
+        batch_delay=args.batch_delay,
+        seed=args.seed
+    )
+
+    async def serve():
+        server = await HTTPServer(backend.handle, args.host, args.port).start()
+        print(f"模拟LLM后端已启动: {server.base_url}/v1")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -5,6 +5,7 @@ import re
 from config import PDFConfig
 from .text_splitter import TextSplitter
 from .exceptions import (
+    DeadlineExceededError,
     FileProcessError,
     FileSizeError,
     FileTypeError,
@@ -20,11 +21,11 @@ from .exceptions import (
 class BaseFileProcessor(ABC):
     """文件处理器基类"""
     
-    def __init__(self):
+    def __init__(self, chunk_size: int = None):
         """初始化处理器"""
         # 创建文本分块器
         self.text_splitter = TextSplitter(
-            chunk_size=PDFConfig.CHUNK_SIZE,
+            chunk_size=chunk_size or PDFConfig.CHUNK_SIZE,
             overlap_size=PDFConfig.OVERLAP_SIZE
         )
         
@@ -133,7 +134,7 @@ class BaseFileProcessor(ABC):
             
             return chunks
             
-        except FileProcessError:
+        except (FileProcessError, DeadlineExceededError):
             raise
         except Exception as e:
             raise TextExtractionError(f"文本提取失败: {str(e)}")
@@ -156,8 +157,8 @@ class BaseFileProcessor(ABC):
             raise MergeError(f"文本合并失败: {str(e)}")
     
     @staticmethod
-    def get_processor(filename: str) -> 'BaseFileProcessor':
-        """根据文件类型获取对应的处理器"""
+    def get_processor(filename: str, chunk_size: int = None) -> 'BaseFileProcessor':
+        """根据文件类型获取对应的处理器（chunk_size为文本块大小，默认使用配置值）"""
         try:
             if not filename:
                 raise FileTypeError("文件名为空")
@@ -166,10 +167,10 @@ class BaseFileProcessor(ABC):
             
             if ext == '.pdf':
                 from .pdf_processor import PDFProcessor
-                return PDFProcessor()
+                return PDFProcessor(chunk_size)
             elif ext in ['.doc', '.docx']:
                 from .word_processor import WordProcessor
-                return WordProcessor()
+                return WordProcessor(chunk_size)
             else:
                 raise FileTypeError(f"不支持的文件类型: {ext}")
                 
@@ -178,6 +179,26 @@ class BaseFileProcessor(ABC):
         except Exception as e:
             raise FileProcessError(f"处理器创建失败: {str(e)}")
     
+    @staticmethod
+    def estimate_tokens(file) -> int:
+        """提取文本前粗略估算文件的token数（用于调度排序，PDF按页数，其余按文件大小）"""
+        data = file.getvalue() if hasattr(file, "getvalue") else None
+        if data is None:
+            position = file.tell()
+            file.seek(0)
+            data = file.read()
+            file.seek(position)
+        
+        if os.path.splitext(getattr(file, "name", ""))[1].lower() == '.pdf':
+            try:
+                import fitz
+                with fitz.open(stream=data, filetype="pdf") as doc:
+                    return len(doc) * PDFConfig.TOKENS_PER_PAGE
+            except Exception:
+                pass
+        # Word文档是压缩的XML，按每4字节约1个token粗略估算
+        return len(data) // 4
+    
     @staticmethod
     def get_supported_extensions() -> List[str]:
         """获取支持的文件扩展名列表"""
@@ -0,0 +1,223 @@
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import parse_qs, unquote, urlsplit
+import asyncio
+import json
+import threading
+
+# 最大请求体（与PDFConfig.MAX_FILE_SIZE一致，留出multipart开销）
+MAX_BODY_SIZE = 64 * 1024 * 1024
+
+_REASONS = {
+    200: "OK",
+    201: "Created",
+    202: "Accepted",
+    204: "No Content",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    502: "Bad Gateway",
+    503: "Service Unavailable"
+}
+
+
+class PayloadTooLargeError(ValueError):
+    """请求体超过MAX_BODY_SIZE"""
+
+
+class Request:
+    """HTTP请求"""
+
+    def __init__(self, method: str, target: str, headers: Dict[str, str], body: bytes):
+        self.method = method.upper()
+        parts = urlsplit(target)
+        self.path = unquote(parts.path)
+        self.query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body.decode("utf-8")) if self.body else {}
+
+    def form(self) -> Dict[str, Tuple[Optional[str], bytes]]:
+        """解析multipart/form-data，返回 {字段名: (文件名, 内容)}"""
+        content_type = self.headers.get("content-type", "")
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + self.body
+        )
+        fields = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name:
+                fields[name] = (part.get_filename(), part.get_payload(decode=True) or b"")
+        return fields
+
+
+class Response:
+    """HTTP响应"""
+
+    def __init__(
+        self,
+        body=b"",
+        status: int = 200,
+        content_type: str = "application/json",
+        headers: Dict[str, str] = None
+    ):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        elif isinstance(body, str):
+            body = body.encode("utf-8")
+        self.body = body
+        self.status = status
+        self.headers = {"content-type": content_type}
+        self.headers.update(headers or {})
+
+
+def json_error(status: int, message: str, code: str = None, headers: Dict[str, str] = None) -> Response:
+    """生成OpenAI风格的错误响应"""
+    return Response(
+        {"error": {"message": message, "type": "error", "code": code}},
+        status=status,
+        headers=headers
+    )
+
+
+class HTTPServer:
+    """基于asyncio的轻量HTTP/1.1服务器（支持keep-alive）
+
+    只依赖标准库，用于本地模拟LLM后端和任务API。
+    handler接收Request并返回Response。
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Request], Awaitable[Response]],
+        host: str = "127.0.0.1",
+        port: int = 0
+    ):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.server = None
+        self.connections = 0
+        self._writers = set()
+        self._loop = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        """在当前事件循环上启动服务"""
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            # 关闭仍保持的keep-alive连接，让连接处理协程在事件循环停止前退出
+            for writer in list(self._writers):
+                writer.close()
+            await self.server.wait_closed()
+            for _ in range(100):
+                if not self._writers:
+                    break
+                await asyncio.sleep(0.01)
+            self.server = None
+
+    def start_in_thread(self) -> "HTTPServer":
+        """在独立线程的事件循环上启动服务（模拟外部服务）"""
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="http-server", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop_thread(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        self._loop = None
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", 0) or 0)
+        if length > MAX_BODY_SIZE:
+            raise PayloadTooLargeError("请求体过大")
+        body = await reader.readexactly(length) if length else b""
+        return Request(method, target, headers, body)
+
+    async def _write_response(self, writer: asyncio.StreamWriter, response: Response, keep_alive: bool):
+        reason = _REASONS.get(response.status, "Unknown")
+        headers = dict(response.headers)
+        headers["content-length"] = str(len(response.body))
+        headers["connection"] = "keep-alive" if keep_alive else "close"
+        head = f"HTTP/1.1 {response.status} {reason}\r\n" + "".join(
+            f"{name}: {value}\r\n" for name, value in headers.items()
+        ) + "\r\n"
+        writer.write(head.encode("latin-1") + response.body)
+        await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except PayloadTooLargeError as e:
+                    await self._write_response(writer, json_error(413, str(e)), False)
+                    break
+                except ValueError as e:
+                    # 请求行或content-length格式错误
+                    await self._write_response(writer, json_error(400, f"请求格式错误: {str(e)}"), False)
+                    break
+                if request is None:
+                    break
+
+                try:
+                    response = await self.handler(request)
+                except Exception as e:
+                    response = json_error(500, f"服务器内部错误: {str(e)}")
+
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                await self._write_response(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
\ No newline at end of file
@@ -0,0 +1,267 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from config import APIConfig
+
+
+def owner_of(api_key: str) -> str:
+    """任务的提交者标识：API密钥的哈希（不保存密钥本身）"""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+class JobStore:
+    """任务持久化（SQLite）
+
+    记录每篇论文的任务状态、进度和结果，以及已完成的文本块提取/合并结果（检查点）。
+    浏览器断开或进程重启后，可以按任务ID重新查看状态，中断的任务从检查点继续。
+    使用线程锁保护连接，可以在界面线程和后台任务线程之间共享。
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(
+            os.path.dirname(os.path.dirname(__file__)), "cache", "jobs.sqlite3"
+        )
+        directory = os.path.dirname(self.path)
+        # 上传的原始文件保存在数据库旁边，恢复任务时重新读取
+        self.file_dir = os.path.join(directory, "job_files")
+        os.makedirs(self.file_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    session_id TEXT,
+                    owner TEXT,
+                    filename TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    settings TEXT NOT NULL,
+                    cost INTEGER DEFAULT 0,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    message TEXT,
+                    progress REAL,
+                    error TEXT,
+                    result TEXT,
+                    mindmap BLOB,
+                    attempts INTEGER DEFAULT 0,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, cost, created);
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    job_id TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (job_id, key)
+                );
+            """)
+            # 旧版本创建的数据库没有owner列
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+    def _execute(self, sql: str, params: tuple = ()) -> int:
+        """执行写操作，返回受影响的行数"""
+        with self._lock:
+            return self._conn.execute(sql, params).rowcount
+
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row, include_mindmap: bool = False) -> Dict[str, Any]:
+        job = dict(row)
+        job["settings"] = json.loads(job["settings"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        if not include_mindmap:
+            job.pop("mindmap", None)
+        return job
+
+    def submit(
+        self,
+        filename: str,
+        data: bytes,
+        settings: Dict[str, Any],
+        session_id: str = None,
+        cost: int = 0,
+        owner: str = None
+    ) -> str:
+        """保存上传的文件并创建排队中的任务，返回任务ID（owner为提交者API密钥的哈希，见 owner_of）"""
+        job_id = uuid.uuid4().hex[:12]
+        file_path = os.path.join(self.file_dir, job_id)
+        with open(file_path, "wb") as f:
+            f.write(data)
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, session_id, owner, filename, file_path, settings, cost, status, created, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, session_id, owner, filename, file_path, json.dumps(settings, ensure_ascii=False), cost, self.QUEUED, now, now)
+        )
+        return job_id
+
+    def get(self, job_id: str, include_mindmap: bool = False) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return self._to_dict(rows[0], include_mindmap) if rows else None
+
+    def list(self, job_ids: List[str] = None, session_id: str = None, owners: List[str] = None) -> List[Dict[str, Any]]:
+        """按提交顺序列出任务（不含思维导图），可按任务ID、会话和提交者过滤"""
+        conditions, params = [], []
+        for column, values in (("id", job_ids), ("owner", owners)):
+            if values is not None:
+                if not values:
+                    return []
+                conditions.append(f"{column} IN ({','.join('?' * len(values))})")
+                params.extend(values)
+        if session_id is not None:
+            conditions.append("session_id = ?")
+            params.append(session_id)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._query(f"SELECT * FROM jobs{where} ORDER BY created", tuple(params))
+        return [self._to_dict(row) for row in rows]
+
+    def count_by_status(self) -> Dict[str, int]:
+        rows = self._query("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        counts = {status: 0 for status in (self.QUEUED, self.RUNNING, self.DONE, self.FAILED)}
+        counts.update({row[0]: row[1] for row in rows})
+        return counts
+
+    def read_file(self, job: Dict[str, Any]) -> bytes:
+        with open(job["file_path"], "rb") as f:
+            return f.read()
+
+    def claim_next(
+        self,
+        providers: List[str],
+        job_ids: List[str] = (),
+        exclude_sessions: Set[str] = ()
+    ) -> Optional[Dict[str, Any]]:
+        """取出下一个可执行的任务并标记为运行中（预估成本小的优先）
+
+        只取有可用密钥的任务：提供商在providers中（服务端密钥），或任务ID在job_ids中（任务自己登记的密钥）；
+        跳过exclude_sessions中的会话（同时处理的论文数已达上限）。
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY cost, created",
+                (self.QUEUED,)
+            ).fetchall()
+            for row in rows:
+                if row["id"] not in job_ids and json.loads(row["settings"]).get("provider") not in providers:
+                    continue
+                if row["session_id"] in exclude_sessions:
+                    continue
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, error = NULL, updated = ? WHERE id = ?",
+                    (self.RUNNING, time.time(), row["id"])
+                )
+                job = self._to_dict(row)
+                job["status"] = self.RUNNING
+                return job
+        return None
+
+    def update_progress(self, job_id: str, stage: str, message: str = None, progress: float = None):
+        self._execute(
+            "UPDATE jobs SET stage = ?, message = COALESCE(?, message), progress = ?, updated = ? WHERE id = ?",
+            (stage, message, progress, time.time(), job_id)
+        )
+
+    def complete(self, job_id: str, result: Dict[str, Any], mindmap: bytes = None):
+        self._execute(
+            "UPDATE jobs SET status = ?, stage = 'done', progress = 1.0, result = ?, mindmap = ?, updated = ? WHERE id = ?",
+            (self.DONE, json.dumps(result, ensure_ascii=False, default=str), mindmap, time.time(), job_id)
+        )
+
+    def fail(self, job_id: str, error: str):
+        self._execute(
+            "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?",
+            (self.FAILED, error, time.time(), job_id)
+        )
+
+    def requeue(self, job_id: str):
+        """重新排队（失败的任务重试时保留检查点，执行次数重新计算）"""
+        self._execute(
+            "UPDATE jobs SET status = ?, error = NULL, attempts = 0, updated = ? WHERE id = ?",
+            (self.QUEUED, time.time(), job_id)
+        )
+
+    def requeue_interrupted(self, max_attempts: int = APIConfig.JOB_MAX_ATTEMPTS) -> Tuple[int, int]:
+        """进程重启后，把上次运行中的任务重新排队（从检查点继续），返回重新排队和标记为失败的任务数
+
+        已执行max_attempts次的任务标记为失败，避免每次都导致进程崩溃的任务反复恢复。
+        """
+        now = time.time()
+        failed = self._execute(
+            "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE status = ? AND attempts >= ?",
+            (self.FAILED, f"任务已中断{max_attempts}次，不再自动恢复（可手动重试）", now, self.RUNNING, max_attempts)
+        )
+        requeued = self._execute(
+            "UPDATE jobs SET status = ?, message = '任务中断，等待从检查点继续', updated = ? WHERE status = ?",
+            (self.QUEUED, now, self.RUNNING)
+        )
+        return requeued, failed
+
+    def load_checkpoint(self, job_id: str, key: str) -> Optional[str]:
+        rows = self._query(
+            "SELECT value FROM checkpoints WHERE job_id = ? AND key = ?",
+            (job_id, key)
+        )
+        return rows[0]["value"] if rows else None
+
+    def save_checkpoint(self, job_id: str, key: str, value: str):
+        self._execute(
+            "INSERT OR REPLACE INTO checkpoints (job_id, key, value) VALUES (?, ?, ?)",
+            (job_id, key, value)
+        )
+
+    def count_checkpoints(self, job_id: str) -> int:
+        return self._query("SELECT COUNT(*) FROM checkpoints WHERE job_id = ?", (job_id,))[0][0]
+
+    def checkpoint(self, job_id: str) -> "JobCheckpoint":
+        return JobCheckpoint(self, job_id)
+
+
+class JobCheckpoint:
+    """单个任务的检查点：按输入内容保存已完成的请求结果"""
+
+    def __init__(self, store: JobStore, job_id: str):
+        self.store = store
+        self.job_id = job_id
+
+    @staticmethod
+    def key(kind: str, text: str) -> str:
+        return f"{kind}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def load(self, key: str) -> Optional[str]:
+        return self.store.load_checkpoint(self.job_id, key)
+
+    def save(self, key: str, value: str):
+        self.store.save_checkpoint(self.job_id, key, value)
+
+    def wrap(self, kind: str, func: Callable[[str], Awaitable[str]]) -> Callable[[str], Awaitable[str]]:
+        """包装请求函数：检查点中已有结果时直接返回，否则执行并保存结果"""
+        async def run(text: str) -> str:
+            key = self.key(kind, text)
+            saved = self.load(key)
+            if saved is not None:
+                return saved
+            result = await func(text)
+            # 失败（返回None）的结果不保存，恢复时重新请求
+            if result:
+                self.save(key, result)
+            return result
+        return run
\ No newline at end of file
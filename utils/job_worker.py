@@ -0,0 +1,299 @@
+from typing import Any, Dict, Optional, Set, Tuple
+from collections import Counter
+import asyncio
+import concurrent.futures
+import io
+import json
+import logging
+import os
+import threading
+from config import APIConfig
+from .document_cache import DocumentCache
+from .job_store import JobStore, owner_of
+from .openai_handler import AIHandler
+from .rate_limiter import estimate_tokens
+from .router import ProviderRouter
+from .scheduler import PaperScheduler, get_priority_limiter, set_job_cost
+from .summarizer import DocumentSummarizer, compose_summary, render_mindmap
+from .usage import UsageTracker
+
+
+class JobWorker:
+    """后台任务执行器
+
+    在独立线程的常驻事件循环中领取任务存储中排队的任务，不受Streamlit脚本重跑和浏览器断开的影响。
+    启动时把上次中断的任务重新排队，已提取的文本块和已完成的提取/合并请求从检查点恢复。
+    API密钥只保存在内存中，不写入任务存储：客户端的密钥只登记给提交的任务使用；
+    服务端环境变量中的密钥可供所有任务使用。进程重启后没有可用密钥的任务保持排队，直到提交者重新登记密钥。
+    """
+
+    def __init__(
+        self,
+        store: JobStore = None,
+        max_jobs: int = APIConfig.MAX_CONCURRENT_PAPERS,
+        poll_interval: float = APIConfig.JOB_POLL_INTERVAL
+    ):
+        self.store = store or JobStore()
+        self.document_cache = DocumentCache()
+        self.max_jobs = max(max_jobs, 1)
+        self.poll_interval = poll_interval
+        # 服务端环境变量中的密钥（按提供商），客户端的密钥不会登记在这里
+        self.credentials: Dict[str, Tuple[str, Optional[str]]] = {}
+        # 每个任务提交时使用的密钥：多个会话共享执行器时，任务只使用各自会话的密钥
+        self.job_credentials: Dict[str, Tuple[str, Optional[str]]] = {}
+        # 启用多提供商路由的任务登记的其他提供商的密钥
+        self.job_routes: Dict[str, Dict[str, Tuple[str, Optional[str]]]] = {}
+        self.loop = None
+        self.running: Dict[str, asyncio.Task] = {}
+        # 运行中任务所属的会话和该会话同时处理的论文数上限
+        self.running_sessions: Dict[str, Tuple[str, int]] = {}
+        self._thread = None
+        self._wake = None
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+        # 环境变量中配置的密钥，进程重启后无需重新提交即可恢复任务
+        for provider in APIConfig.PROVIDERS:
+            api_key = os.getenv(f"{provider.upper()}_API_KEY")
+            if api_key:
+                self.credentials[provider] = (api_key, os.getenv(f"{provider.upper()}_API_BASE"))
+
+    def start(self):
+        """启动（必要时重启）后台线程"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            started = threading.Event()
+            self.loop = asyncio.new_event_loop()
+
+            def run():
+                asyncio.set_event_loop(self.loop)
+                self.loop.run_until_complete(self._main(started))
+
+            self._thread = threading.Thread(target=run, name="job-worker", daemon=True)
+            self._thread.start()
+            started.wait()
+
+    def wake(self):
+        """有新任务或新密钥时立即检查队列"""
+        if self.loop is not None and self._wake is not None:
+            self.loop.call_soon_threadsafe(self._wake.set)
+
+    def register(self, job_id: str, api_key: str, api_base: str = None):
+        """为任务登记（或重新登记）密钥，只供该任务使用"""
+        self.job_credentials[job_id] = (api_key, api_base)
+        self.wake()
+
+    def can_run(self, job: Dict[str, Any]) -> bool:
+        """任务有登记的密钥，或其提供商有服务端密钥"""
+        return job["id"] in self.job_credentials or job["settings"]["provider"] in self.credentials
+
+    def submit(
+        self,
+        filename: str,
+        data: bytes,
+        settings: Dict[str, Any],
+        api_key: str,
+        api_base: str = None,
+        session_id: str = None,
+        cost: int = 0,
+        routes: Dict[str, Tuple[str, Optional[str]]] = None
+    ) -> str:
+        """提交任务，返回任务ID
+
+        settings包含provider、mode、chunk_size、max_concurrent，以及可选的routing、hedge
+        （多提供商路由和对冲请求，其他提供商的密钥通过routes登记）和max_papers（同一会话同时处理的论文数）。
+        """
+        job_id = self.store.submit(filename, data, settings, session_id=session_id, cost=cost, owner=owner_of(api_key))
+        self.job_credentials[job_id] = (api_key, api_base)
+        if routes:
+            self.job_routes[job_id] = dict(routes)
+        self.start()
+        self.wake()
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        """停止排队中或运行中的任务（标记为失败，可从检查点重试），返回是否停止了任务"""
+        if self._thread is None or not self._thread.is_alive():
+            return self._cancel(job_id)
+        # 在事件循环线程中取消：与领取任务互不交错，刚被领取的任务也能取消
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                future.set_result(self._cancel(job_id))
+            except Exception as e:
+                future.set_exception(e)
+
+        self.loop.call_soon_threadsafe(run)
+        return future.result()
+
+    def _cancel(self, job_id: str) -> bool:
+        job = self.store.get(job_id)
+        if job is None or job["status"] not in (JobStore.QUEUED, JobStore.RUNNING):
+            return False
+        task = self.running.get(job_id)
+        if task is not None:
+            task.cancel()
+        self.job_credentials.pop(job_id, None)
+        self.job_routes.pop(job_id, None)
+        self.store.fail(job_id, "任务已停止")
+        self.logger.info(f"任务 {job_id} 已停止: {job['filename']}")
+        return True
+
+    async def _main(self, started: threading.Event):
+        self._wake = asyncio.Event()
+        interrupted, failed = self.store.requeue_interrupted()
+        if interrupted:
+            self.logger.info(f"{interrupted} 个中断的任务重新排队，将从检查点继续")
+        if failed:
+            self.logger.warning(f"{failed} 个任务已中断{APIConfig.JOB_MAX_ATTEMPTS}次，标记为失败")
+        started.set()
+
+        while True:
+            while len(self.running) < self.max_jobs:
+                job = self.store.claim_next(
+                    list(self.credentials),
+                    list(self.job_credentials),
+                    exclude_sessions=self.busy_sessions()
+                )
+                if job is None:
+                    break
+                task = asyncio.ensure_future(self._run_job(job))
+                self.running[job["id"]] = task
+                self.running_sessions[job["id"]] = (
+                    job["session_id"] or job["id"],
+                    job["settings"].get("max_papers", self.max_jobs)
+                )
+                task.add_done_callback(lambda _, job_id=job["id"]: self._finished(job_id))
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _finished(self, job_id: str):
+        # 任务结束后不再保留客户端的密钥（重试时重新登记）
+        self.running.pop(job_id, None)
+        self.running_sessions.pop(job_id, None)
+        self.job_credentials.pop(job_id, None)
+        self.job_routes.pop(job_id, None)
+        self._wake.set()
+
+    def busy_sessions(self) -> Set[str]:
+        """运行中的任务数已达到同时处理论文数上限的会话"""
+        counts = Counter(session for session, _ in self.running_sessions.values())
+        return {session for session, max_papers in self.running_sessions.values() if counts[session] >= max_papers}
+
+    def create_summarizer(self, job: Dict[str, Any]) -> DocumentSummarizer:
+        settings = job["settings"]
+        provider = settings["provider"]
+        api_key, api_base = self.job_credentials.get(job["id"]) or self.credentials[provider]
+        max_concurrent = settings.get("max_concurrent", APIConfig.MAX_CONCURRENT)
+        # 与界面中的批处理共享同一API密钥的并发名额（按会话公平分配）
+        limiter = get_priority_limiter(provider, api_key).session(job["session_id"] or job["id"], max_concurrent)
+        handler = AIHandler(api_key=api_key, api_base=api_base, provider=provider)
+        if settings.get("routing"):
+            handler.router = self.create_router(job, handler)
+        scheduler = PaperScheduler(
+            max_papers=1,
+            max_concurrent=max_concurrent,
+            limiter=limiter,
+            adaptive_limiter=handler.concurrency_limiter
+        )
+        return DocumentSummarizer(
+            handler,
+            mode=settings["mode"],
+            provider=provider,
+            chunk_size=settings.get("chunk_size"),
+            max_concurrent=max_concurrent,
+            scheduler=scheduler,
+            checkpoint=self.store.checkpoint(job["id"])
+        )
+
+    def create_router(self, job: Dict[str, Any], handler: AIHandler) -> Optional[ProviderRouter]:
+        """使用任务登记的其他提供商密钥（没有时使用服务端密钥）构建多提供商路由，不足两个时返回None"""
+        routes = self.job_routes.get(job["id"], {})
+        handlers = {handler.provider: handler}
+        for provider in APIConfig.PROVIDERS:
+            credentials = routes.get(provider) or self.credentials.get(provider)
+            if provider in handlers or credentials is None:
+                continue
+            api_key, api_base = credentials
+            handlers[provider] = AIHandler(api_key=api_key, api_base=api_base, provider=provider)
+        if len(handlers) < 2:
+            self.logger.warning(f"任务 {job['id']} 只有一个可用的提供商，不使用多提供商路由")
+            return None
+        return ProviderRouter(handlers, hedge=job["settings"].get("hedge", APIConfig.HEDGE_ENABLED))
+
+    async def _run_job(self, job: Dict[str, Any]):
+        job_id, filename = job["id"], job["filename"]
+
+        def report(stage: str, message: str, progress: float = None):
+            self.store.update_progress(job_id, stage, message, progress)
+
+        try:
+            summarizer = self.create_summarizer(job)
+            file = io.BytesIO(self.store.read_file(job))
+            file.name = filename
+
+            document_key = summarizer.document_key(file)
+            cached = self.document_cache.get(document_key)
+            if cached:
+                usage = UsageTracker().summary()
+                usage["document_cache"] = True
+                result = {"final_summary": cached["final_summary"], "path": cached.get("path"), "usage": usage}
+            else:
+                # 文本块作为检查点保存，恢复时无需重新解析和OCR
+                text_chunks = summarizer.checkpoint.load("extract")
+                if text_chunks is None:
+                    report("extract", "正在提取文本...")
+                    text_chunks = await summarizer.extract(filename, file)
+                    summarizer.checkpoint.save("extract", json.dumps(text_chunks, ensure_ascii=False))
+                else:
+                    text_chunks = json.loads(text_chunks)
+                    report("extract", f"从检查点恢复（{self.store.count_checkpoints(job_id)} 项已完成）")
+
+                set_job_cost(sum(estimate_tokens(chunk) for chunk in text_chunks))
+                result = await summarizer.summarize(filename, text_chunks, report)
+
+            complete_summary = compose_summary(filename, result["final_summary"])
+            report("render", "正在生成思维导图...")
+            loop = asyncio.get_running_loop()
+            try:
+                mindmap_image = await loop.run_in_executor(None, render_mindmap, complete_summary)
+            except Exception as e:
+                self.logger.warning(f"{filename} 思维导图生成失败: {str(e)}")
+                mindmap_image = None
+
+            result.update({"summary": complete_summary, "mode": summarizer.mode})
+            self.store.complete(job_id, result, mindmap_image)
+            # 有文本块被丢弃的不完整结果不写入整篇文档缓存
+            if not cached and not result["usage"].get("dropped_chunks"):
+                self.document_cache.put(document_key, {
+                    "filename": filename,
+                    "final_summary": result["final_summary"],
+                    "mindmap": mindmap_image,
+                    "path": result["path"],
+                    "usage": result["usage"]
+                })
+            self.logger.info(f"任务 {job_id} 完成: {filename}")
+        except Exception as e:
+            self.logger.error(f"任务 {job_id} 失败: {str(e)}")
+            self.store.fail(job_id, str(e))
+
+
+# 进程级后台任务执行器：同一服务器上的所有会话共享
+_worker: Optional[JobWorker] = None
+_worker_lock = threading.Lock()
+
+
+def get_job_worker() -> JobWorker:
+    """获取（必要时创建并启动）进程内共享的后台任务执行器"""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = JobWorker()
+        _worker.start()
+        return _worker
\ No newline at end of file
@@ -1,5 +1,5 @@
-from openai import AsyncOpenAI
-from typing import List, Optional, Callable, Dict, Any
+import openai
+from typing import List, Optional, Callable, Dict, Any, Tuple
 import asyncio
 import hashlib
 import json
@@ -8,6 +8,30 @@ import time
 from datetime import datetime, timedelta
 from config import APIConfig
 from prompts import get_prompts
+from .client_pool import get_shared_client, run_in_background
+from .rate_limiter import get_rate_limiter, estimate_tokens, parse_retry_after
+from .adaptive_limiter import get_adaptive_limiter
+from .scheduler import get_priority_limiter
+from .usage import extract_usage, record_call
+from .reducer import TreeReducer
+from .budget import TokenBudgetPlanner
+from .deadline import request_timeout
+from .exceptions import (
+    APIError,
+    APIAuthError,
+    APIQuotaError,
+    APIRateLimitError,
+    APITimeoutError,
+    APIServerError,
+    APIContextLengthError,
+    APIOutputTruncatedError
+)
+
+# 未指定指令时使用的system消息
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant"
+
+# 对冲请求在备用提供商的并发限制中使用的会话名
+HEDGE_SESSION = "hedge"
 
 class AIHandler:
     """AI API处理器"""
@@ -19,11 +43,30 @@ class AIHandler:
         
         self.provider = provider
         self.config = APIConfig.get_config(provider)
-        self.client = AsyncOpenAI(
-            api_key=api_key,
-            base_url=api_base or self.config["api_base"]
+        # 使用进程内共享的客户端，连接池在会话和脚本重跑之间复用
+        self.client = get_shared_client(
+            provider,
+            api_base or self.config["api_base"],
+            api_key
         )
         
+        # 同一提供商、同一密钥在进程内共享限流预算
+        self.rate_limiter = get_rate_limiter(provider, api_key)
+        
+        # 自适应并发（可选）：批处理器按它调整并发数，请求的耗时和429反馈给它，见 utils/adaptive_limiter.py
+        self.concurrency_limiter = get_adaptive_limiter(provider, api_key) if APIConfig.ADAPTIVE_CONCURRENCY else None
+        # 同一密钥所有会话共享的并发名额，对冲请求作为备用提供商时在这里占用名额，见 utils/scheduler.py
+        self.priority_limiter = get_priority_limiter(provider, api_key)
+        
+        # 多提供商路由（可选），见 utils/router.py
+        self.router = None
+        
+        # 离线批处理收集器（可选），见 utils/batch_job.py
+        self.batch_collector = None
+        
+        # 请求录制/回放（可选），见 utils/cassette.py
+        self.cassette = None
+        
         # 初始化缓存
         self.cache_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "cache")
         self.cache_expiry = timedelta(days=7)  # 缓存7天过期
@@ -81,26 +124,48 @@ class AIHandler:
         except Exception as e:
             print(f"写入缓存失败: {str(e)}")
     
-    def _calculate_hash(self, prompt: str, **kwargs) -> str:
-        """计算提示词和参数的哈希值"""
+    def _calculate_hash(self, prompt: str, provider: str = None, **kwargs) -> str:
+        """计算提示词和参数的哈希值（provider默认为当前提供商）"""
         # 将所有参数组合成一个字符串
         params_str = json.dumps(kwargs, sort_keys=True)
-        content = f"{prompt}|{params_str}|{self.provider}"
+        content = f"{prompt}|{params_str}|{provider or self.provider}"
         return hashlib.md5(content.encode()).hexdigest()
     
-    async def process_text(self, text: str, prompt_template: str) -> str:
-        """处理单个文本块"""
+    def cache_key(self, text: str, **settings) -> str:
+        """计算中间结果（如整篇文档的提取结果）的缓存键"""
+        return self._calculate_hash(text, **settings)
+    
+    def read_cached(self, key: str) -> Optional[str]:
+        """读取中间结果缓存（录制/回放时不使用缓存），命中时计入用量统计"""
+        if self.cassette:
+            return None
+        result = self._read_cache(key)
+        if result is not None:
+            record_call(self.provider, self.config["model"], cache_hit=True)
+        return result
+    
+    def write_cached(self, key: str, result: str):
+        """写入中间结果缓存"""
+        if not self.cassette:
+            self._write_cache(key, result)
+    
+    async def process_text(self, text: str, prompt_template: str, max_tokens: int = None) -> str:
+        """处理单个文本块（max_tokens为规划的输出预算，会同时提示模型控制篇幅）"""
         try:
             if not text or not prompt_template:
                 raise ValueError("文本或提示词模板不能为空")
             
             print(f"处理文本块: 长度={len(text)}")
             
-            # 格式化提示词
-            prompt = prompt_template.format(text=text)
+            if max_tokens:
+                text += TokenBudgetPlanner.length_hint(max_tokens)
             
-            # 调用API
-            result = await self.get_completion_with_cache(prompt)
+            # 静态指令作为system前缀，文本放在最后，便于命中提供商的前缀缓存
+            result = await self.get_completion_with_cache(
+                text,
+                max_tokens=max_tokens,
+                system_prompt=prompt_template.strip()
+            )
             
             if not result:
                 raise Exception("API返回结果为空")
@@ -108,6 +173,9 @@ class AIHandler:
             print(f"处理完成: 结果长度={len(result)}")
             return result
             
+        except APIError:
+            # 保留错误类型，供调用方判断是否可以重试
+            raise
         except Exception as e:
             print(f"处理文本失败: {str(e)}")
             raise Exception(f"处理文本失败: {str(e)}")
@@ -116,7 +184,8 @@ class AIHandler:
         self, 
         prompt: str,
         max_tokens: int = None,
-        temperature: float = None
+        temperature: float = None,
+        system_prompt: str = None
     ) -> str:
         """获取API响应（带缓存）"""
         try:
@@ -124,24 +193,31 @@ class AIHandler:
             cache_key = self._calculate_hash(
                 prompt,
                 max_tokens=max_tokens,
-                temperature=temperature
+                temperature=temperature,
+                system_prompt=system_prompt
             )
             
-            # 尝试从缓存获取
-            cached_result = self._read_cache(cache_key)
+            # 尝试从缓存获取（录制/回放时跳过缓存，保证每次运行的请求一致）
+            cached_result = None if self.cassette else self._read_cache(cache_key)
             if cached_result is not None:
                 print("使用缓存结果")
+                record_call(self.provider, self.config["model"], cache_hit=True)
                 return cached_result
             
-            # 调用API
-            result = await self.get_completion(
-                prompt,
-                max_tokens=max_tokens,
-                temperature=temperature
-            )
+            # 调用API（输出被截断时放大预算重试）
+            provider, result = await self._complete_untruncated(prompt, max_tokens, temperature, system_prompt)
             
-            # 写入缓存
-            self._write_cache(cache_key, result)
+            # 按实际给出结果的提供商写入缓存（路由切换或对冲请求时可能不是当前提供商）
+            if not self.cassette:
+                if provider != self.provider:
+                    cache_key = self._calculate_hash(
+                        prompt,
+                        provider=provider,
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                        system_prompt=system_prompt
+                    )
+                self._write_cache(cache_key, result)
             
             return result
             
@@ -149,45 +225,242 @@ class AIHandler:
             print(f"API调用失败: {str(e)}")
             raise
     
-    async def get_completion(self, prompt: str, max_tokens: int = None, temperature: float = None) -> str:
-        """获取API响应"""
+    @property
+    def max_output_tokens(self) -> int:
+        """当前提供商单次请求的输出上限"""
+        if self.provider == "deepseek":
+            return min(self.config["max_tokens"], 4096)
+        return self.config["max_tokens"]
+    
+    async def _complete_untruncated(
+        self,
+        prompt: str,
+        max_tokens: int = None,
+        temperature: float = None,
+        system_prompt: str = None
+    ) -> Tuple[str, str]:
+        """调用API；输出因max_tokens被截断时放大预算重试，已达上限则使用截断的结果
+
+        返回实际给出结果的提供商和结果。
+        """
+        retries = 0
+        while True:
+            try:
+                return await self._route(
+                    prompt,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    system_prompt=system_prompt
+                )
+            except APIOutputTruncatedError as e:
+                expanded = min(e.max_tokens * 2, self.max_output_tokens)
+                if retries >= APIConfig.TRUNCATION_RETRIES or expanded <= e.max_tokens:
+                    print(f"输出仍被截断（max_tokens={e.max_tokens}），使用截断的结果")
+                    return e.provider or self.provider, e.partial
+                retries += 1
+                print(f"输出被截断（max_tokens={e.max_tokens}），放大预算到 {expanded} 后重试")
+                max_tokens = expanded
+    
+    async def get_completion(
+        self,
+        prompt: str,
+        max_tokens: int = None,
+        temperature: float = None,
+        system_prompt: str = None
+    ) -> str:
+        """获取API响应（配置了路由时在多个提供商之间分配）"""
+        _, result = await self._route(prompt, max_tokens, temperature, system_prompt)
+        return result
+    
+    async def _route(
+        self,
+        prompt: str,
+        max_tokens: int = None,
+        temperature: float = None,
+        system_prompt: str = None
+    ) -> Tuple[str, str]:
+        """发送请求（配置了路由时在多个提供商之间分配），返回实际给出结果的提供商和结果"""
+        if self.router:
+            return await self.router.complete(
+                lambda handler: handler._request(prompt, max_tokens, temperature, system_prompt)
+            )
+        return self.provider, await self._request(prompt, max_tokens, temperature, system_prompt)
+    
+    def try_reserve_slot(self) -> Optional[Callable[[], None]]:
+        """不等待地占用本密钥的一个并发名额（对冲请求使用），没有空闲名额时返回None，否则返回释放名额的函数"""
+        if not self.priority_limiter.try_acquire(HEDGE_SESSION):
+            return None
+        if self.concurrency_limiter and not self.concurrency_limiter.try_acquire():
+            self.priority_limiter.release(HEDGE_SESSION)
+            return None
+        
+        def release():
+            if self.concurrency_limiter:
+                self.concurrency_limiter.release()
+            self.priority_limiter.release(HEDGE_SESSION)
+        return release
+    
+    def build_request(
+        self,
+        prompt: str,
+        max_tokens: int = None,
+        temperature: float = None,
+        system_prompt: str = None
+    ) -> Dict[str, Any]:
+        """构造chat.completions请求参数"""
+        # 确保max_tokens在有效范围内
+        if self.provider == "deepseek":
+            max_tokens = min(max_tokens or self.config["max_tokens"], 4096)
+        else:
+            max_tokens = max_tokens or self.config["max_tokens"]
+        
+        return {
+            "model": self.config["model"],
+            "messages": [
+                {"role": "system", "content": system_prompt or DEFAULT_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": max_tokens,
+            "temperature": temperature or self.config["temperature"]
+        }
+    
+    async def _request(
+        self,
+        prompt: str,
+        max_tokens: int = None,
+        temperature: float = None,
+        system_prompt: str = None
+    ) -> str:
+        """向当前提供商发送请求
+
+        system_prompt为静态指令，prompt为可变文本；两者分开发送，
+        使相同指令的请求拥有一致的前缀。
+        """
         try:
             print(f"调用API: provider={self.provider}")  # 添加日志
             
-            # 确保max_tokens在有效范围内
-            if self.provider == "deepseek":
-                max_tokens = min(max_tokens or self.config["max_tokens"], 4096)
+            request = self.build_request(prompt, max_tokens, temperature, system_prompt)
+            
+            cost_multiplier = 1.0
+            if self.cassette and self.cassette.mode == "replay":
+                # 回放模式：直接返回录制的响应，不访问API
+                response, latency = await self.cassette.replay(request)
+            elif self.batch_collector:
+                # 离线批处理模式：请求交给Batch API统一提交，结果返回后再继续
+                start_time = time.monotonic()
+                response = await self.batch_collector.submit(request)
+                latency = time.monotonic() - start_time
+                cost_multiplier = APIConfig.BATCH_COST_MULTIPLIER
             else:
-                max_tokens = max_tokens or self.config["max_tokens"]
+                # 预估本次请求的token消耗（输入 + 输出上限），获取限流配额
+                estimated_tokens = (
+                    sum(estimate_tokens(m["content"]) for m in request["messages"])
+                    + request["max_tokens"]
+                )
+                await self.rate_limiter.acquire(estimated_tokens)
+                
+                # 单次请求的超时不超过论文剩余的处理时间（已超时则不再发送）
+                timeout = request_timeout(APIConfig.REQUEST_TIMEOUT)
+                
+                # 请求在后台常驻循环上发送，以复用连接池中的keep-alive连接；
+                # 论文超时或被停止时，等待中的任务被取消，后台循环上的请求随之取消
+                start_offset = self.cassette.elapsed() if self.cassette else 0.0
+                start_time = time.monotonic()
+                response = await run_in_background(
+                    self.client.chat.completions.create(**request, timeout=timeout)
+                )
+                latency = time.monotonic() - start_time
+                
+                if self.cassette:
+                    self.cassette.record(request, response, latency, start_offset)
+                
+                usage = getattr(response, "usage", None)
+                self.rate_limiter.record_usage(
+                    estimated_tokens,
+                    getattr(usage, "total_tokens", None)
+                )
+                if self.concurrency_limiter:
+                    self.concurrency_limiter.record_success(latency, getattr(usage, "completion_tokens", 0))
             
-            response = await self.client.chat.completions.create(
-                model=self.config["model"],
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant"},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=max_tokens,
-                temperature=temperature or self.config["temperature"]
+            choice = response.choices[0]
+            result = choice.message.content or ""
+            truncated = choice.finish_reason == "length"
+            
+            # 记录到当前论文的用量统计（含计划的输出预算，便于对比实际用量）
+            record_call(
+                self.provider,
+                self.config["model"],
+                response,
+                latency,
+                cost_multiplier=cost_multiplier,
+                planned_tokens=request["max_tokens"],
+                truncated=truncated
             )
             
-            result = response.choices[0].message.content
-            print(f"API调用成功: 结果长度={len(result)}")  # 添加日志
+            tokens = extract_usage(response)
+            print(
+                f"API调用成功: 结果长度={len(result)}, 输入tokens={tokens['prompt_tokens']}, "
+                f"输出tokens={tokens['completion_tokens']}/{request['max_tokens']}, "
+                f"缓存命中tokens={tokens['cached_tokens']}, 耗时={latency:.2f}秒"
+            )  # 添加日志
+            
+            if truncated:
+                raise APIOutputTruncatedError(
+                    f"输出达到max_tokens={request['max_tokens']}被截断",
+                    partial=result,
+                    max_tokens=request["max_tokens"],
+                    provider=self.provider
+                )
             return result
             
         except Exception as e:
-            error_msg = str(e)
-            print(f"API调用错误: {error_msg}")  # 添加日志
+            print(f"API调用错误: {str(e)}")  # 添加日志
+            error = self._classify_error(e)
             
-            if "insufficient_user_quota" in error_msg:
-                raise Exception("API配额不足，请检查账户余额或联系服务提供商")
-            elif "invalid_api_key" in error_msg:
-                raise Exception("API密钥无效，请检查API Key是否正确")
-            elif "model_not_found" in error_msg:
-                raise Exception(f"模型 {self.config['model']} 不可用，请尝试其他模型")
-            elif "Invalid max_tokens" in error_msg:
-                raise Exception(f"Token数量超出限制，当前提供商最大支持 {self.config['max_tokens']} tokens")
-            else:
-                raise Exception(f"API调用失败: {error_msg}")
+            # 限流时暂停共享限流器，避免其他请求继续撞上429
+            if isinstance(error, APIRateLimitError):
+                delay = self.rate_limiter.handle_rate_limit(e)
+                print(f"触发限流，暂停 {delay:.1f} 秒")
+                if self.concurrency_limiter:
+                    self.concurrency_limiter.record_throttle()
+            
+            raise error from e
+    
+    def _classify_error(self, e: Exception) -> APIError:
+        """将SDK异常转换为带类型的API异常"""
+        if isinstance(e, APIError):
+            return e
+        
+        error_msg = str(e)
+        status = getattr(e, "status_code", None)
+        
+        if "insufficient_user_quota" in error_msg or "insufficient_quota" in error_msg or status == 402:
+            return APIQuotaError("API配额不足，请检查账户余额或联系服务提供商")
+        if (
+            isinstance(e, (openai.AuthenticationError, openai.PermissionDeniedError))
+            or "invalid_api_key" in error_msg
+        ):
+            return APIAuthError("API密钥无效，请检查API Key是否正确")
+        if "model_not_found" in error_msg:
+            return APIError(f"模型 {self.config['model']} 不可用，请尝试其他模型")
+        if (
+            "context_length_exceeded" in error_msg
+            or "maximum context length" in error_msg
+            or "Invalid max_tokens" in error_msg
+        ):
+            return APIContextLengthError(
+                f"Token数量超出限制，当前提供商最大支持 {self.config['max_tokens']} tokens"
+            )
+        if isinstance(e, openai.RateLimitError) or status == 429:
+            return APIRateLimitError(f"请求过于频繁: {error_msg}", retry_after=parse_retry_after(e))
+        if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError, asyncio.TimeoutError)):
+            return APITimeoutError(f"API请求超时: {error_msg}")
+        if isinstance(e, openai.InternalServerError) or (status is not None and status >= 500):
+            return APIServerError(f"API服务端错误: {error_msg}")
+        if status is not None and status not in (408, 409):
+            # 其余4xx请求错误重试无效
+            return APIError(f"API调用失败: {error_msg}")
+        return APIError(f"API调用失败: {error_msg}", retryable=True)
 
     async def summarize(
         self, 
@@ -214,7 +487,7 @@ class AIHandler:
         chunks = merged_chunks  # 使用合并后的块
         
         prompts = get_prompts(mode)
-        prompt_template = prompts["summary_prompt"]
+        prompt_template = prompts["extraction_prompt"]
         
         # 更新总块数
         total_chunks = len(chunks)
@@ -223,8 +496,10 @@ class AIHandler:
         # 并行处理所有文本块
         async def process_chunk(chunk: str) -> str:
             nonlocal processed
-            prompt = f"{prompt_template}\n\n文本内容:\n{chunk}"
-            result = await self.get_completion_with_cache(prompt)
+            result = await self.get_completion_with_cache(
+                chunk,
+                system_prompt=prompt_template.strip()
+            )
             processed += 1
             if self.progress_callback:
                 self.progress_callback(processed / total_chunks)
@@ -234,6 +509,8 @@ class AIHandler:
             chunk_summaries = await asyncio.gather(
                 *[process_chunk(chunk) for chunk in chunks]
             )
+        except APIError:
+            raise
         except Exception as e:
             raise Exception(f"处理文本块失败: {str(e)}")
         
@@ -244,6 +521,8 @@ class AIHandler:
         # 合并多个块的总结
         try:
             return await self.merge_summaries(chunk_summaries, prompts["merge_prompt"])
+        except APIError:
+            raise
         except Exception as e:
             raise Exception(f"���并总结失败: {str(e)}")
 
@@ -252,35 +531,44 @@ class AIHandler:
         summaries: List[str],
         merge_prompt_template: str
     ) -> str:
-        """优化的合并策略"""
-        # 如果摘要数量少，直接合并
-        if len(summaries) <= 2:
-            combined_text = "\n\n".join(summaries)
-            return await self._merge_batch(combined_text, merge_prompt_template)
-        
-        # 分批合并
-        batch_size = 3
-        while len(summaries) > 1:
-            new_summaries = []
-            for i in range(0, len(summaries), batch_size):
-                batch = summaries[i:i + batch_size]
-                if len(batch) == 1:
-                    new_summaries.append(batch[0])
-                else:
-                    combined_text = "\n\n".join(batch)
-                    merged = await self._merge_batch(combined_text, merge_prompt_template)
-                    new_summaries.append(merged)
-            summaries = new_summaries
-        
-        return summaries[0]
+        """分层并发合并多个总结"""
+        return await self.create_reducer(merge_prompt_template).reduce(summaries)
+    
+    def fits_single_request(self, text: str, system_prompt: str, max_tokens: int = None) -> bool:
+        """判断整篇文本能否在一次请求内完成总结（预留输出token）"""
+        if not APIConfig.FAST_PATH_ENABLED:
+            return False
+        request = self.build_request(text, max_tokens=max_tokens, system_prompt=system_prompt)
+        input_tokens = sum(estimate_tokens(m["content"]) for m in request["messages"])
+        available = self.config["context_window"] - request["max_tokens"]
+        return input_tokens <= min(available, APIConfig.FAST_PATH_MAX_TOKENS)
+    
+    def create_reducer(
+        self,
+        merge_prompt_template: str,
+        batch_processor=None,
+        max_tokens: int = None
+    ) -> TreeReducer:
+        """按当前提供商的上下文窗口创建分层合并器（max_tokens为每次合并的输出预算）"""
+        max_tokens = max_tokens or min(4096, self.config["max_tokens"])
+        return TreeReducer(
+            lambda text: self._merge_batch(text, merge_prompt_template, max_tokens),
+            context_window=self.config["context_window"],
+            prompt_tokens=estimate_tokens(merge_prompt_template),
+            output_tokens=max_tokens,
+            batch_processor=batch_processor
+        )
 
-    async def _merge_batch(self, text: str, merge_prompt_template: str) -> str:
+    async def _merge_batch(self, text: str, merge_prompt_template: str, max_tokens: int = None) -> str:
         """合并文本"""
         try:
-            prompt = f"{merge_prompt_template}\n\n文本内容:\n{text}"
+            max_tokens = max_tokens or min(4096, self.config["max_tokens"])
             return await self.get_completion_with_cache(
-                prompt,
-                max_tokens=min(4096, self.config["max_tokens"])
+                text + TokenBudgetPlanner.length_hint(max_tokens),
+                max_tokens=max_tokens,
+                system_prompt=merge_prompt_template.strip()
             )
+        except APIError:
+            raise
         except Exception as e:
             raise Exception(f"合并文本失败: {str(e)}")
\ No newline at end of file
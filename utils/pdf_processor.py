@@ -6,7 +6,9 @@ from PIL import Image
 import numpy as np
 from typing import List, Dict, Optional
 from .file_processor import BaseFileProcessor
+from .deadline import check_deadline, remaining_time
 from .exceptions import (
+    DeadlineExceededError,
     FileProcessError,
     FileCorruptedError,
     PageLimitError,
@@ -20,9 +22,9 @@ from config import PDFConfig
 class PDFProcessor(BaseFileProcessor):
     """PDF文件处理器"""
     
-    def __init__(self):
+    def __init__(self, chunk_size: int = None):
         """初始化PDF处理器"""
-        super().__init__()
+        super().__init__(chunk_size)
         # 初始化OCR
         if PDFConfig.ENABLE_OCR:
             try:
@@ -57,12 +59,16 @@ class PDFProcessor(BaseFileProcessor):
                 text_content = []
                 
                 for page_num in range(len(doc)):
+                    # 超过论文的处理时限时停止（扫描件逐页OCR可能很慢）
+                    check_deadline()
                     try:
                         # 获取页面文本
                         page_text = self._process_page(doc[page_num])
                         if page_text:
                             text_content.append(page_text)
                     except Exception as e:
+                        # OCR因处理时限被终止时报告超时
+                        check_deadline()
                         raise TextProcessError(f"第{page_num+1}页处理失败: {str(e)}")
                 
                 if not text_content:
@@ -73,7 +79,7 @@ class PDFProcessor(BaseFileProcessor):
             finally:
                 doc.close()
                 
-        except FileProcessError:
+        except (FileProcessError, DeadlineExceededError):
             raise
         except Exception as e:
             raise TextExtractionError(f"PDF文本提取失败: {str(e)}")
@@ -109,21 +115,25 @@ class PDFProcessor(BaseFileProcessor):
             # 处理图像
             img = self._process_image(img)
             
-            # 进行OCR识别
+            # 进行OCR识别（不超过剩余的处理时间，0表示不限时）
+            timeout = max(remaining_time() or 0, 0)
             try:
                 text = pytesseract.image_to_string(
                     img,
                     lang=PDFConfig.OCR_LANGUAGE,
-                    config=f'--psm {PDFConfig.OCR_PSM} --oem {PDFConfig.OCR_OEM}'
+                    config=f'--psm {PDFConfig.OCR_PSM} --oem {PDFConfig.OCR_OEM}',
+                    timeout=timeout
                 )
                 
                 if not text.strip():
                     # 如果识别结果为空，尝试不同的PSM模式
                     for psm in [1, 4, 6]:
+                        check_deadline()
                         text = pytesseract.image_to_string(
                             img,
                             lang=PDFConfig.OCR_LANGUAGE,
-                            config=f'--psm {psm} --oem {PDFConfig.OCR_OEM}'
+                            config=f'--psm {psm} --oem {PDFConfig.OCR_OEM}',
+                            timeout=max(remaining_time() or 0, 0)
                         )
                         if text.strip():
                             break
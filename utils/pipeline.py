@@ -0,0 +1,97 @@
+from typing import Any, Awaitable, Callable, Dict, List
+import asyncio
+import itertools
+import logging
+from config import APIConfig
+
+# 队列结束标记（优先级最低，排在所有项目之后）
+_DONE = object()
+
+
+class StagedPipeline:
+    """分阶段流水线
+
+    各阶段由有界优先级队列连接，每个阶段有自己的工作协程数：
+    前一阶段的输出队列满时前一阶段暂停（背压），不会无限制地提前处理；
+    后一阶段处理第N项的同时，前一阶段已经在处理第N+1项。
+    阶段函数返回None表示该项目不再进入后续阶段（如处理失败或命中缓存）。
+    阶段函数抛出的异常视为致命错误，取消整个流水线并重新抛出。
+    """
+
+    def __init__(self, queue_size: int = APIConfig.PIPELINE_QUEUE_SIZE):
+        self.queue_size = max(queue_size, 1)
+        self.stages: List[Dict[str, Any]] = []
+        self.logger = logging.getLogger(__name__)
+
+    def add_stage(
+        self,
+        name: str,
+        func: Callable[[Any], Awaitable[Any]],
+        workers: int = 1,
+        priority: Callable[[Any], float] = None
+    ) -> "StagedPipeline":
+        """添加阶段（priority返回值越小越先处理，未指定时按到达顺序）"""
+        self.stages.append({
+            "name": name,
+            "func": func,
+            "workers": max(workers, 1),
+            "priority": priority
+        })
+        return self
+
+    async def run(self, items: List[Any]):
+        """处理全部项目，直到每个项目离开流水线"""
+        if not self.stages:
+            return
+
+        sequence = itertools.count()
+        # 第一个阶段的输入一次性放入，其余阶段之间的队列有界
+        queues = [asyncio.PriorityQueue()] + [
+            asyncio.PriorityQueue(maxsize=self.queue_size) for _ in self.stages[1:]
+        ]
+
+        async def put(index: int, item: Any):
+            priority_func = self.stages[index]["priority"]
+            priority = priority_func(item) if priority_func else 0
+            await queues[index].put((priority, next(sequence), item))
+
+        async def close(index: int):
+            for _ in range(self.stages[index]["workers"]):
+                await queues[index].put((float("inf"), next(sequence), _DONE))
+
+        async def worker(index: int):
+            stage = self.stages[index]
+            while True:
+                _, _, item = await queues[index].get()
+                if item is _DONE:
+                    return
+                result = await stage["func"](item)
+                if result is not None and index + 1 < len(self.stages):
+                    await put(index + 1, result)
+
+        async def run_stage(index: int):
+            workers = [asyncio.ensure_future(worker(index)) for _ in range(self.stages[index]["workers"])]
+            try:
+                await asyncio.gather(*workers)
+            except BaseException:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                raise
+            # 本阶段的全部工作协程结束后，通知下一阶段不会再有新项目
+            if index + 1 < len(self.stages):
+                await close(index + 1)
+
+        for item in items:
+            await put(0, item)
+        await close(0)
+
+        tasks = [asyncio.ensure_future(run_stage(index)) for index in range(len(self.stages))]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException as e:
+            self.logger.error(f"流水线终止: {str(e)}")
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
\ No newline at end of file
@@ -0,0 +1,110 @@
+from typing import Any, Dict, Optional
+import threading
+import time
+from .rate_limiter import estimate_tokens
+from .router import LatencyTracker
+
+
+class BatchProgress:
+    """单次批处理的实时进度与吞吐统计
+
+    按项目（而不是列表中的位置）统计已完成、失败（重试耗尽被丢弃）、等待重试和进行中的数量，
+    以及输出速度（按结果文本估算token数）、请求延迟p50/p95和按当前完成速度估算的剩余时间。
+    """
+
+    def __init__(self, total: int, description: str = "处理中"):
+        self.total = total
+        self.description = description
+        self.completed = 0
+        self.failed = 0
+        self.retrying = 0
+        self.in_flight = 0
+        self.retries = 0
+        self.output_tokens = 0
+        self.latency = LatencyTracker()
+        self.start_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> int:
+        return self.completed + self.failed
+
+    @property
+    def fraction(self) -> float:
+        """已结束（完成或失败）的项目占比"""
+        return self.finished / self.total if self.total else 1.0
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def stopped(self, latency: float = None, result: Any = None):
+        """一次请求结束；给出latency时记录为成功，结果为None的项目计为失败"""
+        with self._lock:
+            self.in_flight -= 1
+            if latency is None:
+                return
+            if result is None:
+                self.failed += 1
+                return
+            self.completed += 1
+            self.latency.record(latency)
+            if isinstance(result, str):
+                self.output_tokens += estimate_tokens(result)
+
+    def retry_scheduled(self):
+        with self._lock:
+            self.retrying += 1
+            self.retries += 1
+
+    def retry_started(self):
+        with self._lock:
+            self.retrying -= 1
+
+    def dropped(self):
+        """重试耗尽，项目被丢弃"""
+        with self._lock:
+            self.failed += 1
+
+    def tokens_per_second(self) -> float:
+        elapsed = time.monotonic() - self.start_time
+        return self.output_tokens / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> Optional[float]:
+        """按当前的完成速度估算剩余时间（秒），尚无完成的项目时为None"""
+        if not self.finished:
+            return None
+        elapsed = time.monotonic() - self.start_time
+        return elapsed / self.finished * (self.total - self.finished)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retrying": self.retrying,
+            "in_flight": self.in_flight,
+            "retries": self.retries,
+            "tokens_per_second": round(self.tokens_per_second(), 1),
+            "p50": self.latency.p50(),
+            "p95": self.latency.p95(),
+            "eta": self.eta()
+        }
+
+    def format(self) -> str:
+        """单行的进度说明，如：已完成 12/48 · 重试中 1 · 进行中 5 · 180 tokens/s · 延迟 p50 2.1s / p95 4.0s · 预计剩余 20秒"""
+        parts = [f"已完成 {self.completed}/{self.total}"]
+        if self.failed:
+            parts.append(f"失败 {self.failed}")
+        if self.retrying:
+            parts.append(f"重试中 {self.retrying}")
+        if self.in_flight:
+            parts.append(f"进行中 {self.in_flight}")
+        if self.output_tokens:
+            parts.append(f"{self.tokens_per_second():.0f} tokens/s")
+        if self.latency.count():
+            parts.append(f"延迟 p50 {self.latency.p50():.1f}s / p95 {self.latency.p95():.1f}s")
+        eta = self.eta()
+        if eta is not None and self.finished < self.total:
+            parts.append(f"预计剩余 {eta:.0f}秒")
+        return " · ".join(parts)
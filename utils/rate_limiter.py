@@ -0,0 +1,150 @@
+from typing import Dict, Optional, Tuple
+from email.utils import parsedate_to_datetime
+import asyncio
+import hashlib
+import re
+import threading
+import time
+from config import APIConfig
+
+# 中日韩字符大约每个字符对应一个token，其余文本大约每4个字符对应一个token
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数量"""
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def parse_retry_after(error: Exception) -> Optional[float]:
+    """从API错误的响应头中解析Retry-After（秒）"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    try:
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms:
+            return max(float(retry_after_ms) / 1000, 0.0)
+
+        retry_after = headers.get("retry-after")
+        if not retry_after:
+            return None
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            # HTTP日期格式
+            retry_time = parsedate_to_datetime(retry_after)
+            return max(retry_time.timestamp() - time.time(), 0.0)
+    except Exception:
+        return None
+
+
+class TokenBucket:
+    """令牌桶
+
+    使用线程锁保护状态，不绑定事件循环，可以在多个会话（线程）之间共享。
+    允许余额为负数，表示已经预约了未来的令牌。
+    """
+
+    def __init__(self, capacity: float, refill_rate: float):
+        """capacity为桶容量，refill_rate为每秒补充的令牌数"""
+        self.capacity = float(capacity)
+        self.refill_rate = float(refill_rate)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        """按流逝时间补充令牌"""
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+            self.updated_at = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """预约令牌，返回需要等待的秒数"""
+        # 单次请求超过桶容量时按容量计，避免永远等待
+        amount = min(float(amount), self.capacity)
+        self._refill(now)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.refill_rate
+
+    def adjust(self, amount: float, now: float):
+        """退还（正数）或追加扣除（负数）令牌"""
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """按提供商的请求数/Token数限流器（RPM + TPM）"""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.request_bucket = TokenBucket(rpm, rpm / 60.0)
+        self.token_bucket = TokenBucket(tpm, tpm / 60.0)
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    async def acquire(self, estimated_tokens: int):
+        """在发送请求前获取配额，必要时等待"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(
+                self.request_bucket.reserve(1, now),
+                self.token_bucket.reserve(estimated_tokens, now),
+                self.blocked_until - now
+            )
+
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        # 等待期间可能收到了新的Retry-After
+        while True:
+            with self._lock:
+                remaining = self.blocked_until - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """根据实际用量修正预估的token消耗"""
+        if actual_tokens is None:
+            return
+        with self._lock:
+            self.token_bucket.adjust(estimated_tokens - actual_tokens, time.monotonic())
+
+    def block(self, seconds: float):
+        """收到429后暂停所有请求指定的秒数"""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def handle_rate_limit(self, error: Exception) -> float:
+        """处理限流错误，优先使用Retry-After，返回暂停的秒数"""
+        delay = parse_retry_after(error)
+        if delay is None:
+            delay = APIConfig.RATE_LIMIT_BACKOFF
+        self.block(delay)
+        return delay
+
+
+# 进程级限流器注册表：同一提供商、同一API密钥的所有会话共享一个预算
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str, api_key: str) -> RateLimiter:
+    """获取（或创建）进程内共享的限流器"""
+    key_hash = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    registry_key = (provider, key_hash)
+    with _limiters_lock:
+        limiter = _limiters.get(registry_key)
+        if limiter is None:
+            config = APIConfig.get_config(provider)
+            limiter = RateLimiter(config["rpm"], config["tpm"])
+            _limiters[registry_key] = limiter
+        return limiter
\ No newline at end of file
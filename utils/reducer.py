@@ -0,0 +1,225 @@
+from typing import Any, Awaitable, Callable, Dict, List
+import asyncio
+import time
+from config import APIConfig
+from .batch_processor import BatchProcessor
+from .exceptions import APIContextLengthError
+from .rate_limiter import estimate_tokens
+from .usage import add_stage_time, run_in_stage
+
+
+class TreeReducer:
+    """分层并发合并（树形归并）
+
+    每一层把相邻的总结按token预算分组（保持文档顺序），同一层的合并请求
+    通过BatchProcessor并发执行，结果作为下一层的输入，直到只剩一个总结。
+    """
+
+    def __init__(
+        self,
+        merge_func: Callable[[str], Awaitable[str]],
+        context_window: int,
+        prompt_tokens: int = 0,
+        output_tokens: int = 4096,
+        input_budget: int = APIConfig.MERGE_INPUT_BUDGET,
+        min_fan_in: int = APIConfig.MERGE_MIN_FAN_IN,
+        batch_processor: BatchProcessor = None
+    ):
+        self.merge_func = merge_func
+        # 单次合并请求能容纳的输入上限（上下文窗口减去指令和输出）
+        self.max_input_tokens = max(context_window - prompt_tokens - output_tokens, 1)
+        self.input_budget = min(input_budget, self.max_input_tokens)
+        self.min_fan_in = max(min_fan_in, 2)
+        self.batch_processor = batch_processor or BatchProcessor()
+        # 每一层的分组大小，便于查看合并树的形状
+        self.levels: List[List[int]] = []
+        # 重试耗尽被丢弃的输入数（reduce_stream），其内容不会出现在合并结果中
+        self.dropped = 0
+
+    @staticmethod
+    def join(summaries: List[str]) -> str:
+        return "\n\n".join(summaries)
+
+    def _group_sizes(self, tokens: List[int], allow_overflow: bool = True) -> List[int]:
+        """按token预算把相邻项分组，返回每组的大小
+
+        allow_overflow为True时，组内项数未达到min_fan_in允许超出预算，但不超过上下文窗口。
+        """
+        sizes = []
+        group_size, group_tokens = 0, 0
+        for count in tokens:
+            fits_budget = group_tokens + count <= self.input_budget
+            fits_window = group_tokens + count <= self.max_input_tokens
+            forced = allow_overflow and group_size < self.min_fan_in and fits_window
+            if group_size and not (fits_budget or forced):
+                sizes.append(group_size)
+                group_size, group_tokens = 0, 0
+            group_size += 1
+            group_tokens += count
+        if group_size:
+            sizes.append(group_size)
+        return sizes
+
+    def plan_level(self, summaries: List[str]) -> List[List[str]]:
+        """把相邻的总结按token预算分组"""
+        groups, start = [], 0
+        for size in self._group_sizes([estimate_tokens(s) for s in summaries]):
+            groups.append(summaries[start:start + size])
+            start += size
+        return groups
+
+    async def reduce(self, summaries: List[str]) -> str:
+        """逐层合并，直到只剩一个总结"""
+        summaries = [s for s in summaries if s]
+        if not summaries:
+            raise ValueError("没有可合并的总结")
+
+        self.levels = []
+        while len(summaries) > 1:
+            groups = self.plan_level(summaries)
+            if len(groups) == len(summaries):
+                raise APIContextLengthError("单个总结超出上下文窗口，无法继续合并，请减小文本块大小")
+            self.levels.append([len(group) for group in groups])
+
+            # 只有一个总结的组直接进入下一层，其余组并发合并
+            pending = [group for group in groups if len(group) > 1]
+            merged = await self.batch_processor.process_batch(
+                pending,
+                lambda group: self.merge_func(self.join(group)),
+                description=f"正在合并总结（第{len(self.levels)}层）"
+            )
+            if len(merged) != len(pending):
+                raise Exception("部分总结合并失败")
+
+            merged_iter = iter(merged)
+            summaries = [group[0] if len(group) == 1 else next(merged_iter) for group in groups]
+
+        return summaries[0]
+
+    async def reduce_stream(
+        self,
+        items: List[Any],
+        map_func: Callable[[Any], Awaitable[str]],
+        map_stage: str = "chunk",
+        merge_stage: str = "merge"
+    ) -> str:
+        """边总结边合并
+
+        文本块总结按完成顺序到达；相邻的已完成总结凑满一次合并的token预算后立即合并，
+        合并结果留在原位置参与后续合并，使合并与文本块阶段的长尾重叠。
+        所有文本块完成后，剩余结果再按层并发合并。
+        """
+        start_time = time.monotonic()
+        # 按文档顺序排列的片段，text为None表示仍在总结或合并中
+        slots: List[Dict[str, Any]] = [{"text": None, "tokens": 0, "level": 0} for _ in items]
+        segments = list(slots)
+        merging: Dict[asyncio.Future, Dict[str, Any]] = {}
+        early_groups: List[int] = []
+        failures: List[BaseException] = []
+        current = asyncio.current_task()
+
+        def position(segment: Dict[str, Any]) -> int:
+            return next(i for i, item in enumerate(segments) if item is segment)
+
+        def launch(group: List[Dict[str, Any]]):
+            merged = {"text": None, "tokens": 0, "level": group[0]["level"] + 1}
+            index = position(group[0])
+            segments[index:index + len(group)] = [merged]
+            task = asyncio.ensure_future(run_in_stage(
+                merge_stage,
+                self.batch_processor.run_item(
+                    [segment["text"] for segment in group],
+                    lambda texts: self.merge_func(self.join(texts))
+                )
+            ))
+            merging[task] = merged
+            task.add_done_callback(on_merged)
+            early_groups.append(len(group))
+
+        def schedule():
+            """在每段连续的、同一层的已完成片段中，合并已经凑满预算的分组
+
+            最后一组（未到文档末尾时）可能继续变大，暂不合并。只合并同一层的片段，
+            超出预算的强制合并留到最后按层处理，避免形成串行的合并链。
+            """
+            run: List[Dict[str, Any]] = []
+            for segment in segments + [None]:
+                ready = segment is not None and segment["text"] is not None
+                if ready and (not run or run[-1]["level"] == segment["level"]):
+                    run.append(segment)
+                    continue
+                if run:
+                    sizes = self._group_sizes([s["tokens"] for s in run], allow_overflow=False)
+                    # 到达文档末尾的最后一组不会再变大，可以立即合并
+                    closed = sizes if segment is None else sizes[:-1]
+                    start = 0
+                    for size in closed:
+                        if size > 1:
+                            launch(run[start:start + size])
+                        start += size
+                run = [segment] if ready else []
+
+        def on_merged(task: asyncio.Future):
+            merged = merging[task]
+            if task.cancelled():
+                return
+            if task.exception() is not None or task.result() is None:
+                # 合并失败时整篇论文已无法完成：立即停止，取消进行中的文本块和其他合并
+                if not failures:
+                    failures.append(task.exception() or Exception("部分总结合并失败"))
+                    current.cancel()
+                return
+            merged["text"] = task.result()
+            merged["tokens"] = estimate_tokens(merged["text"])
+            schedule()
+
+        stream = self.batch_processor.iter_completed(
+            items,
+            lambda item: run_in_stage(map_stage, map_func(item)),
+            description="正在总结文本块"
+        )
+        try:
+            async for index, summary in stream:
+                segment = slots[index]
+                if summary:
+                    segment["text"] = summary
+                    segment["tokens"] = estimate_tokens(summary)
+                    schedule()
+                else:
+                    # 重试耗尽的文本块被丢弃，记录数量以便向用户说明
+                    del segments[position(segment)]
+                    self.dropped += 1
+            map_done = time.monotonic()
+            add_stage_time(map_stage, map_done - start_time)
+
+            # 等待进行中的合并（完成时可能触发更高一层的合并）
+            while any(not task.done() for task in merging):
+                await asyncio.wait([task for task in merging if not task.done()])
+            for task, merged in merging.items():
+                if task.exception() is not None:
+                    raise task.exception()
+                if merged["text"] is None:
+                    raise Exception("部分总结合并失败")
+        except asyncio.CancelledError:
+            if not failures:
+                raise
+            # 由合并失败触发的取消，转换为合并失败的错误（Python 3.11+需撤销取消计数）
+            if hasattr(current, "uncancel"):
+                current.uncancel()
+            raise failures[0]
+        finally:
+            await stream.aclose()
+            for task in merging:
+                task.cancel()
+            await asyncio.gather(*merging, return_exceptions=True)
+
+        summaries = [segment["text"] for segment in segments]
+        if not summaries:
+            raise Exception("文本块处理失败")
+        try:
+            result = await run_in_stage(merge_stage, self.reduce(summaries))
+        finally:
+            # 合并阶段只统计文本块阶段结束之后的耗时（即关键路径上的部分）
+            add_stage_time(merge_stage, time.monotonic() - map_done)
+        self.levels = ([early_groups] if early_groups else []) + self.levels
+        return result
\ No newline at end of file
@@ -0,0 +1,176 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from collections import deque
+import asyncio
+import random
+import threading
+import time
+from config import APIConfig
+from .exceptions import APIError, APIOutputTruncatedError
+
+class LatencyTracker:
+    """滚动窗口内的请求延迟统计（线程安全）"""
+
+    def __init__(self, window_size: int = APIConfig.LATENCY_WINDOW):
+        self.samples = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        """记录一次请求耗时（秒）"""
+        with self._lock:
+            self.samples.append(latency)
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self.samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """计算第p百分位延迟，无样本时返回None"""
+        with self._lock:
+            if not self.samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def p50(self) -> Optional[float]:
+        return self.percentile(50)
+
+    def p95(self) -> Optional[float]:
+        return self.percentile(95)
+
+
+# 进程级延迟统计：同一提供商的所有会话共享
+_trackers: Dict[str, LatencyTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def get_latency_tracker(name: str) -> LatencyTracker:
+    """获取（或创建）指定提供商的延迟统计"""
+    with _trackers_lock:
+        tracker = _trackers.get(name)
+        if tracker is None:
+            tracker = LatencyTracker()
+            _trackers[name] = tracker
+        return tracker
+
+
+class ProviderRouter:
+    """多提供商路由
+
+    - 按权重把请求分配到不同提供商
+    - 提供商出错时自动切换到下一个
+    - 可选对冲请求：主请求超过该提供商p95延迟仍未返回时，
+      向第二个提供商发送相同请求，采用先返回的结果
+    """
+
+    def __init__(
+        self,
+        handlers: Dict[str, Any],
+        weights: Dict[str, float] = None,
+        hedge: bool = APIConfig.HEDGE_ENABLED
+    ):
+        if not handlers:
+            raise ValueError("至少需要一个API提供商")
+
+        self.handlers = handlers
+        weights = weights or APIConfig.ROUTING_WEIGHTS
+        self.weights = {name: max(weights.get(name, 1.0), 0.0) for name in handlers}
+        self.hedge = hedge
+        self.trackers = {name: get_latency_tracker(name) for name in handlers}
+
+    def _pick_order(self) -> List[str]:
+        """按权重随机决定尝试顺序"""
+        remaining = [name for name in self.handlers if self.weights[name] > 0]
+        # 权重全部为0的提供商只作为最后的备选
+        fallback = [name for name in self.handlers if self.weights[name] <= 0]
+        order = []
+        while remaining:
+            choice = random.choices(remaining, weights=[self.weights[n] for n in remaining])[0]
+            order.append(choice)
+            remaining.remove(choice)
+        return order + fallback
+
+    def hedge_delay(self, name: str) -> Optional[float]:
+        """对冲等待时间：样本足够时取p95延迟，否则不对冲"""
+        tracker = self.trackers[name]
+        if tracker.count() < APIConfig.HEDGE_MIN_SAMPLES:
+            return None
+        return max(tracker.p95(), APIConfig.HEDGE_MIN_DELAY)
+
+    async def _timed(self, name: str, request: Callable[[Any], Awaitable[Any]]) -> Tuple[str, Any]:
+        """执行请求并记录延迟，返回提供商和结果"""
+        start = time.monotonic()
+        result = await request(self.handlers[name])
+        self.trackers[name].record(time.monotonic() - start)
+        return name, result
+
+    async def _call_with_hedge(
+        self,
+        primary: str,
+        backup: Optional[str],
+        request: Callable[[Any], Awaitable[Any]]
+    ) -> Tuple[str, Any]:
+        """发送主请求，必要时发送对冲请求
+
+        对冲请求不经过调用方的批处理名额，需要立即占用备用提供商的并发名额，没有空闲名额时不对冲。
+        """
+        delay = self.hedge_delay(primary) if (self.hedge and backup) else None
+        if delay is None:
+            return await self._timed(primary, request)
+
+        primary_task = asyncio.ensure_future(self._timed(primary, request))
+        pending = {primary_task}
+        error = None
+        try:
+            # 调用方在等待期间被取消（如超过截止时间）时，finally中同样取消主请求
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary_task.result()
+
+            release = self.handlers[backup].try_reserve_slot()
+            if release is None:
+                print(f"{primary} 超过p95延迟 {delay:.1f}秒，{backup} 没有空闲的并发名额，不发送对冲请求")
+                return await primary_task
+
+            print(f"{primary} 超过p95延迟 {delay:.1f}秒，向 {backup} 发送对冲请求")
+            backup_task = asyncio.ensure_future(self._timed(backup, request))
+            backup_task.add_done_callback(lambda _: release())
+            pending.add(backup_task)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def complete(self, request: Callable[[Any], Awaitable[Any]]) -> Tuple[str, Any]:
+        """路由一次请求，request接收AIHandler并返回协程；返回实际给出结果的提供商和结果"""
+        order = self._pick_order()
+        last_error = None
+        for i, name in enumerate(order):
+            backup = order[i + 1] if i + 1 < len(order) else None
+            try:
+                return await self._call_with_hedge(name, backup, request)
+            except APIOutputTruncatedError:
+                # 输出预算不足与提供商无关，交给调用方放大预算
+                raise
+            except APIError as e:
+                last_error = e
+                if backup:
+                    print(f"{name} 调用失败，切换到 {backup}: {str(e)}")
+        raise last_error
+
+    def stats(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """各提供商的延迟统计"""
+        return {
+            name: {
+                "count": tracker.count(),
+                "p50": tracker.p50(),
+                "p95": tracker.p95()
+            }
+            for name, tracker in self.trackers.items()
+        }
\ No newline at end of file
@@ -0,0 +1,225 @@
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+from collections import defaultdict
+import asyncio
+import contextvars
+import hashlib
+import logging
+import threading
+import time
+from config import APIConfig
+from .adaptive_limiter import AdaptiveLimiter
+from .batch_processor import BatchProcessor
+from .exceptions import APIAuthError, APIQuotaError
+
+# 当前请求所属论文的预估成本（token数），由PaperScheduler在每篇论文的任务中设置
+_job_cost: contextvars.ContextVar[int] = contextvars.ContextVar("job_cost", default=0)
+
+
+def set_job_cost(cost: int):
+    """设置当前任务（及其创建的子任务）所属论文的预估成本"""
+    _job_cost.set(cost)
+
+
+class PriorityLimiter:
+    """按优先级分配并发名额的限流器
+
+    名额空出时按以下顺序选择等待中的请求：
+    1. 公平分配：进行中请求最少的会话优先，避免一个会话的大批量上传占满API密钥；
+    2. 短任务优先：同一会话内预估成本（token数）较小的论文的请求优先，缩短平均完成时间；
+    3. 老化：排队时间按PRIORITY_AGING_RATE折算为成本的减少，长任务不会一直等待。
+    使用线程锁保护状态，不绑定事件循环，可以在多个会话（线程）之间共享。
+    """
+
+    def __init__(self, capacity: int, aging_rate: float = APIConfig.PRIORITY_AGING_RATE):
+        self.capacity = max(capacity, 1)
+        self.aging_rate = aging_rate
+        self.active = 0
+        self.session_active: Dict[str, int] = defaultdict(int)
+        self._waiters: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def session(self, session_id: str, max_concurrent: int) -> "SessionLimiter":
+        """某个会话的限流入口（会话自身的并发上限为max_concurrent）"""
+        return SessionLimiter(self, session_id, max_concurrent)
+
+    def _priority(self, waiter: Dict[str, Any], now: float) -> Tuple[int, float, float]:
+        aged_cost = waiter["cost"] - self.aging_rate * (now - waiter["enqueued_at"])
+        return self.session_active[waiter["session"]], aged_cost, waiter["enqueued_at"]
+
+    def _dispatch(self):
+        """把空闲名额分配给优先级最高的等待请求（调用方持有锁）"""
+        now = time.monotonic()
+        while self.active < self.capacity:
+            eligible = [w for w in self._waiters if self.session_active[w["session"]] < w["limit"]]
+            if not eligible:
+                return
+            waiter = min(eligible, key=lambda w: self._priority(w, now))
+            self._waiters.remove(waiter)
+            self.active += 1
+            self.session_active[waiter["session"]] += 1
+            waiter["granted"] = True
+            waiter["loop"].call_soon_threadsafe(_wake, waiter["future"])
+
+    async def acquire(self, session_id: str, limit: int, cost: int):
+        loop = asyncio.get_running_loop()
+        waiter = {
+            "session": session_id,
+            "limit": max(limit, 1),
+            "cost": cost,
+            "enqueued_at": time.monotonic(),
+            "future": loop.create_future(),
+            "loop": loop,
+            "granted": False
+        }
+        with self._lock:
+            self._waiters.append(waiter)
+            self._dispatch()
+        try:
+            await waiter["future"]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter["granted"]:
+                    self._release(session_id)
+                else:
+                    self._waiters.remove(waiter)
+            raise
+
+    def try_acquire(self, session_id: str) -> bool:
+        """有空闲名额且没有排队的请求时立即占用（不等待），否则返回False"""
+        with self._lock:
+            if self._waiters or self.active >= self.capacity:
+                return False
+            self.active += 1
+            self.session_active[session_id] += 1
+            return True
+
+    def _release(self, session_id: str):
+        self.active -= 1
+        self.session_active[session_id] -= 1
+        if not self.session_active[session_id]:
+            del self.session_active[session_id]
+        self._dispatch()
+
+    def release(self, session_id: str):
+        with self._lock:
+            self._release(session_id)
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class SessionLimiter:
+    """会话的限流入口，可以像asyncio.Semaphore一样使用 async with"""
+
+    def __init__(self, limiter: PriorityLimiter, session_id: str, max_concurrent: int):
+        self.limiter = limiter
+        self.session_id = session_id
+        self.max_concurrent = max_concurrent
+
+    async def __aenter__(self):
+        await self.limiter.acquire(self.session_id, self.max_concurrent, _job_cost.get())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.limiter.release(self.session_id)
+        return False
+
+
+# 进程级优先级限流器注册表：同一提供商、同一API密钥的所有会话共享并发名额
+_priority_limiters: Dict[Tuple[str, str], PriorityLimiter] = {}
+_priority_limiters_lock = threading.Lock()
+
+
+def get_priority_limiter(provider: str, api_key: str) -> PriorityLimiter:
+    """获取（或创建）进程内共享的优先级限流器"""
+    key_hash = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    registry_key = (provider, key_hash)
+    with _priority_limiters_lock:
+        limiter = _priority_limiters.get(registry_key)
+        if limiter is None:
+            limiter = PriorityLimiter(APIConfig.GLOBAL_MAX_CONCURRENT)
+            _priority_limiters[registry_key] = limiter
+        return limiter
+
+
+class PaperScheduler:
+    """多篇论文并发处理
+
+    同时处理多篇论文，所有论文的文本块提取、合并和最终总结请求共享同一个全局并发限制，
+    某篇论文处于串行的合并/最终总结阶段时，其余论文的请求可以占用空闲的并发名额。
+    给出每篇论文的预估成本时，短论文优先开始，其请求在限流器中也优先获得名额。
+    """
+
+    def __init__(
+        self,
+        max_papers: int = APIConfig.MAX_CONCURRENT_PAPERS,
+        max_concurrent: int = APIConfig.MAX_CONCURRENT,
+        limiter: Any = None,
+        adaptive_limiter: AdaptiveLimiter = None
+    ):
+        self.max_papers = max(max_papers, 1)
+        self.max_concurrent = max(max_concurrent, 1)
+        # 全局请求并发限制（所有论文、所有阶段共享）；可传入SessionLimiter与其他会话共享
+        self.limiter = limiter or asyncio.Semaphore(self.max_concurrent)
+        # 自适应并发（可选），在全局并发限制之内按延迟和429动态调整，见 utils/adaptive_limiter.py
+        self.adaptive_limiter = adaptive_limiter
+        self.logger = logging.getLogger(__name__)
+
+    def batch_processor(self, progress_callback: Callable[[float, str], None] = None) -> BatchProcessor:
+        """创建使用全局并发限制的批处理器（每篇论文一个，进度各自独立）"""
+        return BatchProcessor(
+            max_workers=self.max_concurrent,
+            progress_callback=progress_callback,
+            semaphore=self.limiter,
+            adaptive_limiter=self.adaptive_limiter
+        )
+
+    async def run(
+        self,
+        items: List[Any],
+        process_func: Callable[[Any], Awaitable[Any]],
+        cost_func: Callable[[Any], int] = None
+    ) -> List[Any]:
+        """并发处理多篇论文，按输入顺序返回结果（失败的论文结果为异常对象）
+
+        cost_func返回论文的预估成本（token数），成本小的论文先开始（短任务优先）。
+        密钥无效、配额不足等对其余论文同样无法恢复的错误会取消所有论文并重新抛出。
+        """
+        costs = [cost_func(item) if cost_func else 0 for item in items]
+        # 按成本依次放行（asyncio.Semaphore按等待顺序唤醒）
+        order = sorted(range(len(items)), key=lambda index: costs[index])
+        paper_slots = asyncio.Semaphore(self.max_papers)
+
+        async def run_paper(item, cost):
+            async with paper_slots:
+                set_job_cost(cost)
+                return await process_func(item)
+
+        tasks: List[asyncio.Future] = [None] * len(items)
+        for index in order:
+            tasks[index] = asyncio.ensure_future(run_paper(items[index], costs[index]))
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and isinstance(task.exception(), (APIAuthError, APIQuotaError)):
+                        raise task.exception()
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        results = []
+        for task in tasks:
+            if task.cancelled():
+                results.append(asyncio.CancelledError())
+            elif task.exception() is not None:
+                self.logger.error(f"论文处理失败: {str(task.exception())}")
+                results.append(task.exception())
+            else:
+                results.append(task.result())
+        return results
\ No newline at end of file
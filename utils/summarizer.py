@@ -0,0 +1,256 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import contextvars
+from config import APIConfig, PDFConfig
+from prompts import get_prompts
+from .batch_processor import BatchProcessor
+from .budget import TokenBudgetPlanner
+from .deadline import Deadline
+from .document_cache import DocumentCache
+from .file_processor import BaseFileProcessor
+from .mindmap_generator import MindmapGenerator
+from .text_splitter import TextSplitter
+from .usage import UsageTracker, set_current_tracker, reset_current_tracker, usage_stage
+
+# 进度回调：report(阶段, 说明, 进度)，进度为0~1之间的小数或None
+ProgressCallback = Callable[[str, str, Optional[float]], None]
+
+
+def compose_summary(filename: str, final_summary: str) -> str:
+    """组合带标题的完整总结（Markdown）"""
+    return f"""# {filename} 论文总结
+
+{final_summary}"""
+
+
+def render_mindmap(complete_summary: str) -> bytes:
+    """生成思维导图图片（graphviz渲染较慢，异步代码中应放进线程池调用）"""
+    mindmap_generator = MindmapGenerator()
+    dot_source = mindmap_generator.generate(complete_summary)
+    return mindmap_generator.export_image(dot_source, 'png')
+
+
+class DocumentSummarizer:
+    """与界面无关的单篇论文处理流程
+
+    Streamlit界面、后台任务和命令行共用：文本提取 -> 单次总结，
+    或 文本块提取 -> 分层合并 -> 按模式生成最终总结。
+    """
+
+    def __init__(
+        self,
+        handler,
+        mode: str,
+        provider: str,
+        chunk_size: int = None,
+        max_concurrent: int = APIConfig.MAX_CONCURRENT,
+        scheduler=None,
+        offline: bool = False,
+        checkpoint=None,
+        deadline: Deadline = None
+    ):
+        self.handler = handler
+        self.mode = mode
+        self.provider = provider
+        self.chunk_size = chunk_size or PDFConfig.CHUNK_SIZE
+        self.max_concurrent = max_concurrent
+        # 多篇论文共享全局并发限制的调度器（可选），见 utils/scheduler.py
+        self.scheduler = scheduler
+        # 离线批处理时所有文本块放进同一个批处理任务
+        self.offline = offline
+        # 断点续传（可选），见 utils/job_store.py
+        self.checkpoint = checkpoint
+        # 处理时限：提取和总结共享同一篇论文的剩余时间（离线批处理不限时），见 utils/deadline.py
+        self.deadline = Deadline(None) if offline else deadline or Deadline(PDFConfig.TIMEOUT)
+
+    @property
+    def model(self) -> str:
+        return APIConfig.get_config(self.provider)["model"]
+
+    def document_key(self, file) -> str:
+        """整篇文档缓存的键：文件内容哈希 + 影响结果的处理设置（不使用缓存时也用于判断输出是否最新）"""
+        return DocumentCache.make_key(
+            DocumentCache.file_hash(file),
+            mode=self.mode,
+            provider=self.provider,
+            model=self.model,
+            chunk_size=self.chunk_size,
+            overlap_size=PDFConfig.OVERLAP_SIZE
+        )
+
+    async def extract(self, filename: str, file) -> List[str]:
+        """在线程池中提取文本块（PDF解析、OCR不阻塞事件循环中的API请求）"""
+        # 处理器在事件循环线程中创建（PDF处理器初始化时会检查OCR），只把提取放进线程池
+        processor = BaseFileProcessor.get_processor(filename, self.chunk_size)
+        loop = asyncio.get_running_loop()
+
+        async def run():
+            # 复制上下文，使线程中的逐页OCR能读取截止时间并及时停止
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(None, context.run, processor.extract_text, file)
+
+        return await self.deadline.run(run())
+
+    async def request(self, func: Callable[[str], Awaitable[str]], text: str, report: ProgressCallback) -> Optional[str]:
+        """单个请求（单次总结、最终总结）同样占用全局并发名额，并按批处理的重试和退避策略重试
+
+        重试耗尽时返回None。
+        """
+        return await self.batch_processor(1, report).run_item(text, func)
+
+    def batch_processor(self, chunk_count: int, report: ProgressCallback) -> BatchProcessor:
+        progress_callback = lambda p, d: report("chunk", d, p)
+        if self.scheduler and not self.offline:
+            # 与同时处理的其他论文共享全局并发限制
+            return self.scheduler.batch_processor(progress_callback)
+        max_workers = max(chunk_count, 1) if self.offline else self.max_concurrent
+        return BatchProcessor(
+            max_workers=max_workers,
+            progress_callback=progress_callback,
+            adaptive_limiter=None if self.offline else self.handler.concurrency_limiter
+        )
+
+    def checkpointed(self, kind: str, func: Callable[[str], Awaitable[str]]) -> Callable[[str], Awaitable[str]]:
+        """已完成的请求结果保存为检查点，任务中断后恢复时直接使用"""
+        if self.checkpoint is None:
+            return func
+        return self.checkpoint.wrap(kind, func)
+
+    async def summarize_full(self, text_chunks: List[str], prompts: Dict[str, str], budget: Dict[str, int], report: ProgressCallback):
+        """完整流程：文本块提取 -> 分层合并 -> 按模式生成最终总结
+
+        返回最终总结、合并树的形状和被丢弃的文本块数（重试耗尽，内容不在总结中）。
+        """
+        handler = self.handler
+        batch_processor = self.batch_processor(len(text_chunks), report)
+
+        # 文本块提取与合并与总结模式无关，合并后的提取结果按文本内容缓存，
+        # 同一篇论文切换模式时直接复用，只需重新生成最终总结
+        extraction_key = handler.cache_key(
+            "\n\n".join(text_chunks),
+            stage="extraction",
+            extraction_prompt=prompts["extraction_prompt"],
+            merge_prompt=prompts["merge_prompt"],
+            chunk_tokens=budget["chunk"],
+            merge_tokens=budget["merge"]
+        )
+        with usage_stage("merge"):
+            merged_summary = handler.read_cached(extraction_key)
+
+        merge_levels = []
+        dropped = 0
+        if merged_summary is None:
+            # 文本块提取与分层合并重叠进行：相邻的结果完成后立即合并，不必等待最慢的文本块
+            report("chunk", "正在分析文本块并合并提取结果...", None)
+
+            reducer = handler.create_reducer(
+                prompts["merge_prompt"],
+                batch_processor,
+                max_tokens=budget["merge"]
+            )
+            reducer.merge_func = self.checkpointed("merge", reducer.merge_func)
+            merged_summary = await reducer.reduce_stream(
+                text_chunks,
+                self.checkpointed("chunk", lambda chunk: handler.process_text(
+                    chunk,
+                    prompts["extraction_prompt"],
+                    max_tokens=budget["chunk"]
+                ))
+            )
+
+            if not merged_summary:
+                raise Exception("总结合并失败")
+
+            merge_levels = reducer.levels
+            dropped = reducer.dropped
+            if dropped:
+                # 不完整的提取结果不写入缓存，下次处理时重新请求失败的文本块
+                report("dropped", f"⚠️ {dropped}/{len(text_chunks)} 个文本块重试后仍然失败，总结中不包含这些部分", None)
+            else:
+                handler.write_cached(extraction_key, merged_summary)
+
+        # 按所选模式的提示词生成最终总结
+        report("final", "正在生成最终总结...", None)
+
+        final_request = self.checkpointed("final", lambda text: handler.process_text(
+            text,
+            prompts["final_summary_prompt"],
+            max_tokens=budget["final"]
+        ))
+        with usage_stage("final"):
+            final_summary = await self.request(final_request, merged_summary, report)
+
+        return final_summary, merge_levels, dropped
+
+    async def summarize(self, filename: str, text_chunks: List[str], report: ProgressCallback = None) -> Dict[str, Any]:
+        """总结一篇论文，返回最终总结、处理路径和用量统计
+
+        超过处理时限时取消所有进行中的请求，抛出DeadlineExceededError。
+        """
+        return await self.deadline.run(self._summarize(filename, text_chunks, report))
+
+    async def _summarize(self, filename: str, text_chunks: List[str], report: ProgressCallback = None) -> Dict[str, Any]:
+        report = report or (lambda stage, message, progress: None)
+
+        # 统计本篇论文所有LLM调用的token用量
+        usage_tracker = UsageTracker()
+        usage_token = set_current_tracker(usage_tracker)
+        try:
+            # 获取提示词
+            prompts = get_prompts(self.mode)
+
+            # 按模式的目标长度和文本块数量规划各阶段的输出预算
+            budget = TokenBudgetPlanner(self.mode, self.provider, len(text_chunks)).plan()
+
+            # 规划处理路径：整篇文档能放进一次请求时直接单次总结（合并文本块时去除相邻块的重叠部分）
+            full_text = TextSplitter(self.chunk_size, PDFConfig.OVERLAP_SIZE).merge_chunks(text_chunks)
+            if self.handler.fits_single_request(
+                full_text,
+                prompts["summary_prompt"],
+                max_tokens=budget["single"]
+            ):
+                path = "fast"
+                report("single", "文档较短，正在单次生成总结...", None)
+                single_request = self.checkpointed("single", lambda text: self.handler.process_text(
+                    text,
+                    prompts["summary_prompt"],
+                    max_tokens=budget["single"]
+                ))
+                with usage_stage("single"):
+                    final_summary = await self.request(single_request, full_text, report)
+                merge_levels, dropped = [], 0
+            else:
+                path = "full"
+                final_summary, merge_levels, dropped = await self.summarize_full(text_chunks, prompts, budget, report)
+            print(f"{filename} 处理路径: {path}")
+        finally:
+            reset_current_tracker(usage_token)
+
+        if not final_summary:
+            raise Exception("最终总结生成失败")
+
+        usage = usage_tracker.summary()
+        usage.update({
+            "provider": self.provider,
+            "model": self.model,
+            "chunk_size": self.chunk_size,
+            "chunks": len(text_chunks),
+            "path": path,
+            "merge_levels": merge_levels,
+            "dropped_chunks": dropped,
+            "output_budget": budget
+        })
+        print(
+            f"{filename} 用量: 调用{usage['calls']}次, 输入tokens={usage['prompt_tokens']}, "
+            f"输出tokens={usage['completion_tokens']}(计划{usage['planned_tokens']}, 截断{usage['truncated']}次), "
+            f"缓存命中tokens={usage['cached_tokens']}"
+            f"({usage['cached_tokens'] / max(usage['prompt_tokens'], 1):.0%}), "
+            f"预估费用=${usage['cost']:.4f}"
+            + (f", 丢弃文本块={dropped}" if dropped else "")
+        )
+
+        return {
+            "final_summary": final_summary,
+            "path": path,
+            "usage": usage
+        }
\ No newline at end of file
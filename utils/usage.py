@@ -0,0 +1,240 @@
+from typing import Any, Dict, Iterable, List, Optional
+from contextlib import contextmanager
+import contextvars
+import threading
+import time
+from config import APIConfig
+
+# 处理阶段及其显示名称
+STAGE_LABELS = {
+    "single": "单次总结",
+    "chunk": "文本块提取",
+    "merge": "合并总结",
+    "final": "最终总结"
+}
+
+_current_tracker = contextvars.ContextVar("usage_tracker", default=None)
+_current_stage = contextvars.ContextVar("usage_stage", default="other")
+
+
+def extract_usage(response: Any) -> Dict[str, int]:
+    """从API响应中提取token用量，兼容OpenAI和DeepSeek的缓存字段"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+
+    # OpenAI: usage.prompt_tokens_details.cached_tokens
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) if details else None
+    # DeepSeek: usage.prompt_cache_hit_tokens
+    if cached_tokens is None:
+        cached_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", None) or 0,
+        "cached_tokens": cached_tokens or 0
+    }
+
+
+def estimate_cost(provider: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """按APIConfig中的价格（美元/百万token）估算费用"""
+    pricing = APIConfig.get_config(provider).get("pricing")
+    if not pricing:
+        return 0.0
+    uncached_tokens = max(prompt_tokens - cached_tokens, 0)
+    return (
+        uncached_tokens * pricing["input"]
+        + cached_tokens * pricing["cached_input"]
+        + completion_tokens * pricing["output"]
+    ) / 1_000_000
+
+
+def _empty_totals() -> Dict[str, Any]:
+    return {
+        "calls": 0,
+        "cache_hits": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "cached_tokens": 0,
+        "total_tokens": 0,
+        "cost": 0.0,
+        "latency": 0.0,
+        "planned_tokens": 0,
+        "truncated": 0
+    }
+
+
+def _add_totals(totals: Dict[str, Any], other: Dict[str, Any]):
+    for key in _empty_totals():
+        totals[key] += other.get(key, 0)
+
+
+class UsageTracker:
+    """单篇论文的token用量与费用统计（按处理阶段汇总）"""
+
+    def __init__(self):
+        self.calls: List[Dict[str, Any]] = []
+        self.stage_time: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        stage: str,
+        provider: str,
+        model: str,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cached_tokens: int = 0,
+        latency: float = 0.0,
+        cache_hit: bool = False,
+        cost_multiplier: float = 1.0,
+        planned_tokens: int = 0,
+        truncated: bool = False
+    ):
+        """记录一次LLM调用
+
+        cache_hit表示命中本地响应缓存（未调用API）；
+        cost_multiplier用于Batch API等折扣计费；
+        planned_tokens为请求的max_tokens，truncated表示输出因达到上限被截断。
+        """
+        with self._lock:
+            self.calls.append({
+                "stage": stage,
+                "provider": provider,
+                "model": model,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "cached_tokens": cached_tokens,
+                "latency": latency,
+                "cache_hit": cache_hit,
+                "planned_tokens": planned_tokens,
+                "truncated": truncated,
+                "cost": estimate_cost(provider, prompt_tokens, completion_tokens, cached_tokens) * cost_multiplier
+            })
+
+    def add_stage_time(self, stage: str, seconds: float):
+        """累计阶段的实际耗时（墙钟时间）"""
+        with self._lock:
+            self.stage_time[stage] = self.stage_time.get(stage, 0.0) + seconds
+
+    def summary(self) -> Dict[str, Any]:
+        """汇总为可序列化的字典"""
+        with self._lock:
+            calls = list(self.calls)
+            stage_time = dict(self.stage_time)
+
+        totals = _empty_totals()
+        stages: Dict[str, Dict[str, Any]] = {}
+        for call in calls:
+            stage = stages.setdefault(call["stage"], _empty_totals())
+            for bucket in (totals, stage):
+                bucket["calls"] += 1
+                bucket["cache_hits"] += int(call["cache_hit"])
+                bucket["prompt_tokens"] += call["prompt_tokens"]
+                bucket["completion_tokens"] += call["completion_tokens"]
+                bucket["cached_tokens"] += call["cached_tokens"]
+                bucket["total_tokens"] += call["prompt_tokens"] + call["completion_tokens"]
+                bucket["cost"] += call["cost"]
+                bucket["latency"] += call["latency"]
+                bucket["planned_tokens"] += call["planned_tokens"]
+                bucket["truncated"] += int(call["truncated"])
+
+        for name, seconds in stage_time.items():
+            stages.setdefault(name, _empty_totals())["wall_time"] = round(seconds, 3)
+
+        totals["wall_time"] = round(sum(stage_time.values()), 3)
+        totals["stages"] = stages
+        return totals
+
+
+def merge_usage(summaries: Iterable[Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+    """合并多篇论文的用量汇总（用于整批统计）"""
+    totals = _empty_totals()
+    totals["wall_time"] = 0.0
+    totals["papers"] = 0
+    stages: Dict[str, Dict[str, Any]] = {}
+    for summary in summaries:
+        if not summary:
+            continue
+        totals["papers"] += 1
+        _add_totals(totals, summary)
+        totals["wall_time"] += summary.get("wall_time", 0.0)
+        for name, stage in summary.get("stages", {}).items():
+            merged = stages.setdefault(name, _empty_totals())
+            _add_totals(merged, stage)
+            if "wall_time" in stage:
+                merged["wall_time"] = merged.get("wall_time", 0.0) + stage["wall_time"]
+    totals["stages"] = stages
+    return totals
+
+
+def set_current_tracker(tracker: Optional[UsageTracker]) -> contextvars.Token:
+    """设置当前上下文的用量统计器（子任务会继承）"""
+    return _current_tracker.set(tracker)
+
+
+def reset_current_tracker(token: contextvars.Token):
+    _current_tracker.reset(token)
+
+
+def get_current_stage() -> str:
+    return _current_stage.get()
+
+
+@contextmanager
+def usage_stage(stage: str):
+    """标记当前处理阶段，并统计该阶段的墙钟耗时"""
+    token = _current_stage.set(stage)
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+        tracker = _current_tracker.get()
+        if tracker is not None:
+            tracker.add_stage_time(stage, time.monotonic() - start)
+
+
+async def run_in_stage(stage: str, awaitable):
+    """在指定阶段下执行（用于并发任务，不统计墙钟耗时）"""
+    token = _current_stage.set(stage)
+    try:
+        return await awaitable
+    finally:
+        _current_stage.reset(token)
+
+
+def add_stage_time(stage: str, seconds: float):
+    """把阶段耗时累计到当前上下文的统计器中（阶段互相重叠时由调用方计时）"""
+    tracker = _current_tracker.get()
+    if tracker is not None:
+        tracker.add_stage_time(stage, seconds)
+
+
+def record_call(
+    provider: str,
+    model: str,
+    response: Any = None,
+    latency: float = 0.0,
+    cache_hit: bool = False,
+    cost_multiplier: float = 1.0,
+    planned_tokens: int = 0,
+    truncated: bool = False
+):
+    """将一次调用记录到当前上下文的统计器中（未设置统计器时忽略）"""
+    tracker = _current_tracker.get()
+    if tracker is None:
+        return
+    usage = extract_usage(response) if response is not None else {}
+    tracker.record(
+        stage=_current_stage.get(),
+        provider=provider,
+        model=model,
+        latency=latency,
+        cache_hit=cache_hit,
+        cost_multiplier=cost_multiplier,
+        planned_tokens=planned_tokens,
+        truncated=truncated,
+        **usage
+    )
\ No newline at end of file